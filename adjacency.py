@@ -0,0 +1,345 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from helpers import unpack_ids
+
+
+class FriendsAdjacency(object):
+    """In-memory compressed sparse row (CSR) adjacency of all collected friend lists.
+
+    The friend list of every source is kept as a sorted int64 slice of one large
+    `indices` array, so that membership and follow-back lookups are binary searches instead
+    of database queries. Rows are appended in the order sources are collected. If a source's
+    friends are written again, the merged list is appended and the old slice is abandoned.
+
+    Targets removed from all friend lists are compacted out of a row the next time the row is
+    looked up, so that lookups do not filter against all removed targets every time.
+
+    The adjacency can be saved to a directory of .npy files. Loading it from there
+    memory-maps the indices, so a warm restart only has to fetch the changes since saving.
+    `refresh` fetches the changes written by other processes in the meantime.
+
+    Attributes:
+        backing_file (str): directory to save to/load from, None to not persist
+    """
+
+    def __init__(self, backing_file=None, capacity=1024):
+        self.backing_file = backing_file
+        self.lock = threading.RLock()
+
+        # read only (possibly memory-mapped) part of the indices loaded from backing_file
+        self._base = np.empty(0, dtype=np.int64)
+        self._base_burned = np.empty(0, dtype=bool)
+        # appended part
+        self._tail = np.empty(capacity, dtype=np.int64)
+        self._tail_burned = np.zeros(capacity, dtype=bool)
+        self._tail_size = 0
+
+        self._rows = {}  # source -> (start, end) offsets into base + tail
+        self._removed = np.empty(0, dtype=np.int64)  # sorted targets removed from all lists
+        # number of removals of targets, and the number each row was compacted at
+        self._removed_version = 0
+        self._row_versions = {}
+        self.loaded_at = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _slices(self, source):
+        """Returns the neighbors and burned flags of `source` (views, not copies)."""
+        start, end = self._rows[source]
+        base_size = len(self._base)
+        if start >= base_size:
+            return (self._tail[start - base_size:end - base_size],
+                    self._tail_burned[start - base_size:end - base_size])
+        return self._base[start:end], self._base_burned[start:end]
+
+    def _append(self, friends, burned):
+        """Appends one sorted row to the tail and returns its (start, end) offsets."""
+        needed = self._tail_size + len(friends)
+        if needed > len(self._tail):
+            capacity = max(needed, 2 * len(self._tail))
+            tail = np.empty(capacity, dtype=np.int64)
+            tail[:self._tail_size] = self._tail[:self._tail_size]
+            tail_burned = np.zeros(capacity, dtype=bool)
+            tail_burned[:self._tail_size] = self._tail_burned[:self._tail_size]
+            self._tail, self._tail_burned = tail, tail_burned
+
+        self._tail[self._tail_size:needed] = friends
+        self._tail_burned[self._tail_size:needed] = burned
+        start = len(self._base) + self._tail_size
+        self._tail_size = needed
+        return start, start + len(friends)
+
+    def add_friends(self, source, friends, burned=None, overwrite_burned=False):
+        """Adds friends of `source`, merging them with the ones known already.
+
+        Args:
+            source (int): Twitter ID
+            friends (list or numpy.ndarray of int): Twitter IDs of friends of `source`
+            burned (list or numpy.ndarray of bool): burned flags of `friends`,
+                                                    defaults to all unburned
+            overwrite_burned (bool): If True, `burned` replaces the flags of known friends,
+                                     otherwise connections that were burned stay burned.
+        Returns:
+            Nothing
+        """
+        source = int(source)
+        friends = np.asarray(friends, dtype=np.int64)
+        if burned is None:
+            burned = np.zeros(len(friends), dtype=bool)
+        else:
+            burned = np.asarray(burned, dtype=bool)
+
+        friends, first = np.unique(friends, return_index=True)
+        burned = burned[first]
+
+        with self.lock:
+            if len(self._removed) > 0:
+                keep = ~np.isin(friends, self._removed)
+                friends, burned = friends[keep], burned[keep]
+            if source in self._rows:
+                old_friends, old_burned = self._compacted(source)
+                merged = np.union1d(old_friends, friends)
+                if len(merged) == len(old_friends):  # no new friends, e.g. on a refresh
+                    positions = np.searchsorted(old_friends, friends)
+                    if overwrite_burned:
+                        old_burned[positions] = burned
+                    else:
+                        old_burned[positions] |= burned
+                    return
+                merged_burned = np.zeros(len(merged), dtype=bool)
+                merged_burned[np.searchsorted(merged, old_friends)] = old_burned
+                if overwrite_burned:
+                    merged_burned[np.searchsorted(merged, friends)] = burned
+                else:
+                    merged_burned[np.searchsorted(merged, friends)] |= burned
+                friends, burned = merged, merged_burned
+            self._rows[source] = self._append(friends, burned)
+            self._row_versions[source] = self._removed_version
+
+    def _compacted(self, source):
+        """Returns the neighbors and burned flags of `source` like `_slices`, after removing
+        the targets removed since the row was compacted last from it. Rows in the tail are
+        shortened in place, rows in the (read only) base are appended to the tail."""
+        friends, burned = self._slices(source)
+        if self._row_versions.get(source, 0) == self._removed_version:
+            return friends, burned
+        self._row_versions[source] = self._removed_version
+        keep = ~np.isin(friends, self._removed)
+        if keep.all():
+            return friends, burned
+        start, end = self._rows[source]
+        if start >= len(self._base):
+            size = int(keep.sum())
+            friends[:size], burned[:size] = friends[keep], burned[keep]
+            self._rows[source] = (start, start + size)
+        else:
+            self._rows[source] = self._append(friends[keep], burned[keep])
+        return self._slices(source)
+
+    def _position(self, source, target):
+        """Returns the neighbors and burned flags of `source` and the position of `target`
+        in them, or None if `target` is not a friend of `source`."""
+        friends, burned = self._compacted(source)
+        i = np.searchsorted(friends, target)
+        if i == len(friends) or friends[i] != target:
+            return None
+        return friends, burned, i
+
+    def has_source(self, source) -> bool:
+        """Returns whether friends of `source` are known."""
+        return int(source) in self._rows
+
+    def follows(self, source, target) -> bool:
+        """Returns whether `target` is a known friend of `source`."""
+        source, target = int(source), int(target)
+        with self.lock:
+            if source not in self._rows:
+                return False
+            return self._position(source, target) is not None
+
+    def neighbors(self, source, unburned_only: bool = False):
+        """Returns the known friends of `source` as sorted numpy.ndarray (a copy)."""
+        source = int(source)
+        with self.lock:
+            if source not in self._rows:
+                return np.array([], dtype=np.int64)
+            friends, burned = self._compacted(source)
+            if unburned_only:
+                return friends[~burned]
+            return friends.copy()
+
+    def set_burned(self, source, target, burned: bool = True):
+        """Sets the burned flag of the connection (source)-->(target) if it is known."""
+        source, target = int(source), int(target)
+        with self.lock:
+            if source not in self._rows:
+                return
+            position = self._position(source, target)
+            if position is None:
+                return
+            friends, burned_flags, i = position
+            burned_flags[i] = burned
+
+    def remove_target(self, target):
+        """Removes `target` from all friend lists."""
+        self.remove_targets([target])
+
+    def remove_targets(self, targets):
+        """Removes `targets` (list or numpy.ndarray of int) from all friend lists."""
+        targets = np.asarray(targets, dtype=np.int64)
+        with self.lock:
+            removed = np.union1d(self._removed, targets)
+            if len(removed) > len(self._removed):
+                self._removed = removed
+                self._removed_version += 1
+
+    def load(self, dbh):
+        """Fills the adjacency with the friend lists stored in the database. If a backing file
+        exists, it is memory-mapped and only the changes since it was saved are read.
+
+        Args:
+            dbh (database_handler.DataBaseHandler)
+        Returns:
+            Nothing
+        """
+        since = since_burned = 0
+        if self.backing_file is not None and \
+                os.path.isfile(os.path.join(self.backing_file, "meta.json")):
+            since = since_burned = self._load_backing_file()
+            if dbh.friends_storage == "packed":
+                # connections unburned after saving were deleted from friends_burned, which
+                # the changes since saving do not show, so all burned flags are read again
+                with self.lock:
+                    self._base_burned[np.flatnonzero(self._base_burned)] = False
+                since_burned = 0
+
+        start_time = time.time()
+        self._read_changes(dbh, since, since_burned)
+        self.loaded_at = start_time
+
+    def refresh(self, dbh, overlap=0):
+        """Adds the friend lists, burned connections and removed targets written to the
+        database since the last load or refresh, e.g. by other processes.
+
+        Args:
+            dbh (database_handler.DataBaseHandler)
+            overlap (float): seconds to read before the last refresh as well, for rows of
+                             transactions that committed late
+        Returns:
+            Nothing
+        """
+        start_time = time.time()
+        self._read_changes(dbh, self.loaded_at - overlap)
+        self.loaded_at = start_time
+
+    def _read_changes(self, dbh, since, since_burned=None):
+        """Reads the friend lists and burned connections written after `since` (and
+        `since_burned`, defaults to `since`) and all removed targets from the database."""
+        after = dbh.timestamp_after(since, inclusive=True)
+        if since_burned is None:
+            since_burned = since
+
+        if dbh.friends_storage == "packed":
+            sources = dbh.engine.execute(f"SELECT source, ids FROM friends_packed WHERE {after}")
+            for source, ids in sources:
+                self.add_friends(source, unpack_ids(ids))
+            burned_after = dbh.timestamp_after(since_burned, inclusive=True)
+            burned = pd.read_sql(f"SELECT source, target FROM friends_burned WHERE {burned_after}",
+                                 dbh.engine)
+            for source, target in burned.values:
+                self.set_burned(source, target)
+            self.remove_targets(dbh.read_removed_targets(reload=True))
+        else:
+            query = f"SELECT source, target, burned FROM friends WHERE {after} ORDER BY source"
+            for chunk in pd.read_sql(query, dbh.engine, chunksize=1000000):
+                for source, edges in chunk.groupby('source'):
+                    self.add_friends(source, edges['target'].values,
+                                     edges['burned'].values.astype(bool),
+                                     overwrite_burned=True)
+
+    def _load_backing_file(self):
+        """Memory-maps a saved adjacency and returns the time it was saved at."""
+        path = self.backing_file
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+
+        self._base = np.load(os.path.join(path, "indices.npy"), mmap_mode='r')
+        # copy on write, so that burning does not alter the file before saving
+        self._base_burned = np.load(os.path.join(path, "burned.npy"), mmap_mode='c')
+        sources = np.load(os.path.join(path, "sources.npy"))
+        extents = np.load(os.path.join(path, "extents.npy"))
+        self._rows = {int(source): (int(start), int(end))
+                      for source, (start, end) in zip(sources, extents)}
+        self._removed = np.array(meta['removed'], dtype=np.int64)
+        self._removed_version = 0
+        self._row_versions = {}
+        self._tail_size = 0
+
+        return meta['saved_at']
+
+    def save(self):
+        """Writes the adjacency to `backing_file` in compacted form."""
+        if self.backing_file is None:
+            return
+
+        with self.lock:
+            for source in self._rows:
+                self._compacted(source)
+            sources = np.fromiter(self._rows.keys(), dtype=np.int64, count=len(self._rows))
+            lengths = np.array([end - start for start, end in self._rows.values()],
+                               dtype=np.int64)
+            ends = np.cumsum(lengths)
+            extents = np.column_stack([ends - lengths, ends])
+            indices = np.empty(ends[-1] if len(ends) > 0 else 0, dtype=np.int64)
+            burned = np.empty(len(indices), dtype=bool)
+            for source, (start, end) in zip(sources, extents):
+                indices[start:end], burned[start:end] = self._slices(source)
+            meta = {'saved_at': self.loaded_at, 'removed': self._removed.tolist()}
+
+        # write to temporary files first, so that a crash does not leave a broken copy
+        os.makedirs(self.backing_file, exist_ok=True)
+        for name, array in [("indices", indices), ("burned", burned),
+                            ("sources", sources), ("extents", extents)]:
+            np.save(os.path.join(self.backing_file, name + "_tmp.npy"), array)
+        with open(os.path.join(self.backing_file, "meta_tmp.json"), "w") as f:
+            json.dump(meta, f)
+        for name in ["indices.npy", "burned.npy", "sources.npy", "extents.npy", "meta.json"]:
+            tmp_name = name.replace(".", "_tmp.")
+            os.replace(os.path.join(self.backing_file, tmp_name),
+                       os.path.join(self.backing_file, name))
+
+
+_process_adjacency = None
+_process_adjacency_lock = threading.Lock()
+
+
+def get_process_adjacency(dbh, backing_file=None):
+    """Returns the process-wide FriendsAdjacency, loading it from the database (and the
+    backing file) the first time. Later calls reuse it, e.g. when `start.py` creates a new
+    Coordinator after an exception.
+
+    Args:
+        dbh (database_handler.DataBaseHandler)
+        backing_file (str): directory for a memory-mapped copy, see FriendsAdjacency
+    Returns:
+        FriendsAdjacency
+    """
+    global _process_adjacency
+    with _process_adjacency_lock:
+        if _process_adjacency is None:
+            adjacency = FriendsAdjacency(backing_file=backing_file)
+            print("Loading friends adjacency.")
+            adjacency.load(dbh)
+            print(f"Loaded friend lists of {len(adjacency)} accounts.")
+            if backing_file is not None:
+                atexit.register(adjacency.save)
+            _process_adjacency = adjacency
+        return _process_adjacency
@@ -0,0 +1,76 @@
+# Compares the keyword check of candidates for the next seed: one case-insensitive
+# `str.contains` per keyword (as before) with the KeywordMatcher compiled once for all keywords.
+# Uses synthetic timelines of 200 tweets each and random keywords, some of them regexes.
+import argparse
+import random
+import string
+import time
+
+import pandas as pd
+
+from helpers import KeywordMatcher
+
+
+def random_word(length):
+    return "".join(random.choices(string.ascii_lowercase, k=length))
+
+
+def make_timelines(number, vocabulary, tweets=200, words_per_tweet=20):
+    return [pd.Series([" ".join(random.choices(vocabulary, k=words_per_tweet)).capitalize()
+                       for _ in range(tweets)])
+            for _ in range(number)]
+
+
+def make_keywords(number, vocabulary, regexes=0.1, matching=0.1):
+    """Returns `number` keywords: a fraction of `regexes` of them regular expressions, and a
+    fraction of `matching` of them words of the timelines, the others words not in there."""
+    keywords = []
+    for i in range(number):
+        if random.random() < matching:
+            word = random.choice(vocabulary)
+        else:
+            word = random_word(10)
+        if random.random() < regexes:
+            word = f"{word[:3]}(?:{word[3:]}|_)\\b"
+        keywords.append(word)
+    return keywords
+
+
+def check_per_keyword(timeline, keywords):
+    return any(timeline.str.contains(keyword, case=False).any() for keyword in keywords)
+
+
+def measure(check, timelines):
+    start = time.time()
+    results = [check(timeline) for timeline in timelines]
+    return results, (time.time() - start) / len(timelines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark keyword checks of timelines.')
+    parser.add_argument('--keywords', type=int, default=100,
+                        help="number of keywords. Default: 100")
+    parser.add_argument('--timelines', type=int, default=200,
+                        help="number of timelines of 200 tweets. Default: 200")
+    parser.add_argument('--matching', type=float, default=0.01,
+                        help="fraction of keywords that occur in the timelines. Default: 0.01")
+    args = parser.parse_args()
+
+    random.seed(0)
+    vocabulary = [random_word(random.randint(3, 9)) for _ in range(20000)]
+    timelines = make_timelines(args.timelines, vocabulary)
+    keywords = make_keywords(args.keywords, vocabulary, matching=args.matching)
+
+    start = time.time()
+    matcher = KeywordMatcher(keywords)
+    print(f"Compiled {len(keywords)} keywords in {(time.time() - start) * 1000:.1f} ms.")
+
+    expected, per_keyword = measure(lambda timeline: check_per_keyword(timeline, keywords),
+                                    timelines)
+    results, compiled = measure(matcher.search, timelines)
+    assert results == expected
+
+    print(f"{sum(results)} of {len(timelines)} timelines contain a keyword.")
+    print(f"str.contains per keyword: {per_keyword * 1000:.2f} ms per timeline")
+    print(f"KeywordMatcher:           {compiled * 1000:.2f} ms per timeline "
+          f"({per_keyword / compiled:.1f} times faster)")
@@ -0,0 +1,111 @@
+# Compares selecting recent rows of a synthetic friends table by converting the timestamp
+# column (UNIX_TIMESTAMP(timestamp) > t) with a range on the indexed column itself
+# (timestamp > FROM_UNIXTIME(t), see DataBaseHandler.timestamp_after).
+# Uses the database configured in config.yml and drops its table friends_benchmark afterwards.
+import argparse
+import random
+import time
+
+from database_handler import DataBaseHandler
+
+TABLE = "friends_benchmark"
+
+
+def create_table(dbh):
+    dbh.engine.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    if dbh.config.dbtype.lower() == "mysql":
+        dbh.engine.execute(f"""CREATE TABLE {TABLE} (
+                                   source BIGINT NOT NULL,
+                                   target BIGINT NOT NULL,
+                                   burned TINYINT NOT NULL,
+                                   timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                   UNIQUE INDEX fedge (source, target),
+                                   INDEX(timestamp))""")
+    elif dbh.config.dbtype.lower() == "sqlite":
+        dbh.engine.execute(f"""CREATE TABLE {TABLE} (
+                                   source BIGINT NOT NULL,
+                                   target BIGINT NOT NULL,
+                                   burned TINYINT NOT NULL,
+                                   timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                   UNIQUE (source, target))""")
+        dbh.engine.execute(f"CREATE INDEX iBenchTimestamp ON {TABLE}(timestamp)")
+
+
+def fill_table(dbh, rows, days=30):
+    """Inserts `rows` friendships with timestamps spread over the last `days` days, by
+    doubling the table with shifted copies of its rows."""
+
+    now = time.time()
+    first = min(rows, 10000)
+    values = ", ".join(f"({i // 100}, {i}, 0, "
+                       f"{dbh.from_unixtime(now - random.uniform(0, days * 86400))})"
+                       for i in range(first))
+    dbh.engine.execute(f"INSERT INTO {TABLE} (source, target, burned, timestamp) "
+                       f"VALUES {values}")
+
+    if dbh.config.dbtype.lower() == "mysql":
+        shifted = "timestamp - INTERVAL FLOOR(RAND() * 3600) SECOND"
+    elif dbh.config.dbtype.lower() == "sqlite":
+        shifted = "datetime(timestamp, '-' || abs(random() % 3600) || ' seconds')"
+
+    count = first
+    while count < rows:
+        offset = dbh.engine.execute(f"SELECT MAX(source) + 1 FROM {TABLE}").fetchone()[0]
+        dbh.engine.execute(f"""INSERT INTO {TABLE} (source, target, burned, timestamp)
+                               SELECT source + {offset}, target, burned, {shifted}
+                               FROM {TABLE} LIMIT {min(count, rows - count)}""")
+        count += min(count, rows - count)
+        print(f"{count} rows")
+
+    if dbh.config.dbtype.lower() == "mysql":
+        dbh.engine.execute(f"ANALYZE TABLE {TABLE}")
+    elif dbh.config.dbtype.lower() == "sqlite":
+        dbh.engine.commit()
+        dbh.engine.execute("ANALYZE")
+
+
+def measure(dbh, condition, repeat):
+    """Returns the number of selected rows, the best time of `repeat` runs and the plan."""
+
+    query = f"SELECT COUNT(*) FROM {TABLE} WHERE {condition}"
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        selected = dbh.engine.execute(query).fetchone()[0]
+        times.append(time.time() - start)
+
+    if dbh.config.dbtype.lower() == "mysql":
+        plan = dbh.engine.execute("EXPLAIN " + query).fetchall()
+    elif dbh.config.dbtype.lower() == "sqlite":
+        plan = dbh.engine.execute("EXPLAIN QUERY PLAN " + query).fetchall()
+
+    return selected, min(times), plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark timestamp conditions.')
+    parser.add_argument('--rows', type=int, default=100000000,
+                        help="rows of the synthetic friends table. Default: 100000000")
+    parser.add_argument('--since', type=float, default=3600,
+                        help="select the rows of the last SINCE seconds. Default: 3600")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per query. Default: 3")
+    args = parser.parse_args()
+
+    dbh = DataBaseHandler(create_all=False)
+
+    create_table(dbh)
+    try:
+        start = time.time()
+        fill_table(dbh, args.rows)
+        print(f"Filled {TABLE} with {args.rows} rows in {time.time() - start:.0f} seconds.\n")
+
+        after = time.time() - args.since
+        for name, condition in [("function of column", f"{dbh.unix_timestamp()} > {after}"),
+                                ("range on column", dbh.timestamp_after(after))]:
+            selected, seconds, plan = measure(dbh, condition, args.repeat)
+            print(f"{name}: {condition}")
+            print(f"    {selected} rows selected in {seconds:.3f} seconds")
+            for row in plan:
+                print(f"    plan: {row}")
+    finally:
+        dbh.engine.execute(f"DROP TABLE {TABLE}")
@@ -1,17 +1,30 @@
+import heapq
 import multiprocessing.dummy as mp
+import queue
+import random
+import sqlite3 as lite
+import threading
 import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
 from exceptions import TestException
 from functools import wraps
 from sys import stdout, stderr
+from urllib.parse import urlparse
 
 import numpy as np
 import pandas as pd
 import tweepy
-from sqlalchemy.exc import IntegrityError, ProgrammingError
+from sqlalchemy.exc import DBAPIError, IntegrityError, ProgrammingError
 
+from adjacency import get_process_adjacency
 from database_handler import DataBaseHandler
-from helpers import friends_details_dtypes
+from helpers import KeywordMatcher, friends_details_dtypes
+from seed_pool import SeedPool
 from setup import FileImport
+from token_broker import TokenQueue
+from token_state import TokenStateStore
 
 # mp.set_start_method('spawn')
 
@@ -29,6 +42,33 @@ def get_latest_tweets(user_id, connection, fields=['lang', 'full_text']):
     return result
 
 
+def rate_limit_of(response):
+    """Reads the rate limit state from the response of a Twitter API call.
+
+    Args:
+        response (requests.Response): e.g. `api.last_response` or the response of a
+                                      tweepy.RateLimitError
+    Returns:
+        tuple of endpoint (str, e.g. '/friends/ids'), remaining calls (int) and reset time
+        (float, seconds since epoch), each None if unknown
+    """
+
+    if response is None:
+        return None, None, None
+
+    endpoint = None
+    path = urlparse(getattr(response, 'url', None) or '').path  # e.g. /1.1/friends/ids.json
+    if path.endswith('.json'):
+        endpoint = '/' + path[:-len('.json')].split('/', 2)[-1]
+
+    headers = getattr(response, 'headers', None) or {}
+    remaining = headers.get('x-rate-limit-remaining')
+    reset = headers.get('x-rate-limit-reset')
+
+    return (endpoint, int(remaining) if remaining is not None else None,
+            float(reset) if reset is not None else None)
+
+
 def get_fraction_of_tweets_in_language(tweets):
     """Returns fraction of languages in a tweet dataframe as a dictionary
 
@@ -144,6 +184,162 @@ def retry_x_times(x):
     return retry_decorator
 
 
+class RetryPolicy(object):
+    """Decides whether and when a failed step is retried, depending on the kind of error.
+
+    Errors are classified as "rate_limit", "transient" (network errors and server errors of
+    Twitter), "database" (lost or locked database connections), "permanent" (client errors of
+    Twitter and invalid queries), which is not retried, or "unknown" (everything else), which
+    is retried a few times, as `retry_x_times` did. The delay before the n-th retry (counting
+    from 0) is `base * 2**n` seconds, capped at `cap` and scaled by a random factor between
+    0.5 and 1, so that walkers failing together do not retry together.
+
+    Attributes:
+        backoff (dict): kind of error -> (base (float), cap (float), maximum number of retries)
+        max_failures (int): number of times the step on a seed may fail without being retried
+                            before the seed is dropped
+    """
+
+    backoff = {
+        'rate_limit': (60, 900, 10),
+        'transient': (2, 300, 10),
+        'database': (5, 600, 10),
+        'unknown': (2, 300, 3),
+    }
+    max_failures = 3
+
+    def classify(self, error):
+        """Returns the kind of `error` (str)."""
+
+        if isinstance(error, tweepy.RateLimitError):
+            return "rate_limit"
+        if isinstance(error, tweepy.TweepError):
+            status = getattr(getattr(error, 'response', None), 'status_code', None)
+            if error.api_code == 88 or status == 429:
+                return "rate_limit"
+            if ((status is not None and status >= 500) or
+                    "Failed to send request" in str(error.reason)):
+                return "transient"
+            return "permanent"
+        if isinstance(error, (IntegrityError, ProgrammingError)):
+            return "permanent"
+        if isinstance(error, (DBAPIError, lite.OperationalError)):
+            return "database"
+        if isinstance(error, (ConnectionError, TimeoutError)):
+            return "transient"
+        return "unknown"
+
+    def delay(self, kind, attempt):
+        """Returns the seconds to wait before retry number `attempt` (counting from 0) after
+        an error of `kind`, or None if it should not be retried."""
+
+        if kind not in self.backoff:
+            return None
+        base, cap, retries = self.backoff[kind]
+        if attempt >= retries:
+            return None
+        return min(cap, base * 2**attempt) * random.uniform(0.5, 1)
+
+
+class RetryScheduler(object):
+    """Timer queue that puts the seeds of failed steps back into a seed queue after the delay
+    given by a RetryPolicy, so that walkers do not wait (and hold tokens) in the meantime.
+    It also counts the failures of each seed that were not retried, see `drop`.
+
+    Attributes:
+        seed_queue (mp.Queue): queue the seeds are put back into
+        policy (RetryPolicy)
+    """
+
+    def __init__(self, seed_queue, policy=None):
+        self.seed_queue = seed_queue
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.condition = mp.Condition()
+        self.timers = []  # heap of (due time, seed)
+        self.attempts = {}  # seed -> number of retries so far
+        self.failures = {}  # seed -> number of failures that were not retried
+        self.counts = {'rate_limit': 0, 'transient': 0, 'database': 0, 'unknown': 0,
+                       'gave_up': 0, 'dropped': 0}
+        self.thread = None
+        self.stopped = False
+
+    def retry(self, seed, error):
+        """Schedules the retry of the step on `seed` that failed with `error`, if the policy
+        allows it.
+
+        Returns:
+            tuple of the kind of error (str) and the delay in seconds (float),
+            or None if the step should not be retried
+        """
+
+        kind = self.policy.classify(error)
+        with self.condition:
+            attempt = self.attempts.get(seed, 0)
+            delay = self.policy.delay(kind, attempt)
+            if delay is None:
+                self.attempts.pop(seed, None)
+                self.failures[seed] = self.failures.get(seed, 0) + 1
+                self.counts['gave_up'] += 1
+                return None
+            self.attempts[seed] = attempt + 1
+            self.counts[kind] += 1
+            heapq.heappush(self.timers, (time.time() + delay, seed))
+            if self.thread is None and not self.stopped:
+                self.thread = mp.Process(target=self._run, name="retry scheduler")
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        return kind, delay
+
+    def drop(self, seed):
+        """Returns whether `seed` should be dropped, because its step failed without retry
+        `policy.max_failures` times, e.g. on an account that breaks the step every time."""
+        with self.condition:
+            if self.failures.get(seed, 0) < self.policy.max_failures:
+                return False
+            del self.failures[seed]
+            self.counts['dropped'] += 1
+            return True
+
+    def succeeded(self, seed):
+        """Resets the number of retries and failures of `seed` after a successful step."""
+        with self.condition:
+            self.attempts.pop(seed, None)
+            self.failures.pop(seed, None)
+
+    def stop(self):
+        """Ends the thread putting seeds back, e.g. before the Coordinator is replaced. Seeds
+        waiting for their retry stay `pending`, so that they are saved with the latest seeds.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (len(self.timers) == 0 or
+                                            self.timers[0][0] > time.time()):
+                    timeout = None if len(self.timers) == 0 else self.timers[0][0] - time.time()
+                    self.condition.wait(timeout=timeout)
+                if self.stopped:
+                    return
+                _, seed = heapq.heappop(self.timers)
+            self.seed_queue.put(seed)
+
+    def pending(self):
+        """Returns the seeds waiting for their retry (list of int)."""
+        with self.condition:
+            return [seed for _, seed in sorted(self.timers)]
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counts, waiting=len(self.timers))
+
+
 class MyProcess(mp.Process):
     def run(self):
         try:
@@ -155,14 +351,83 @@ class MyProcess(mp.Process):
             self.err = None
 
 
+class ResetWheel(object):
+    """Wakes connections waiting for the rate limit window of an endpoint to reset.
+
+    Connections report tokens they found throttled for an endpoint together with the reset
+    time. A waiting connection claims the next reset of its endpoint that no other connection
+    waits for and sleeps until then, so that every reset of a (token, endpoint) wakes exactly
+    one waiter, which then leases that token, and nobody polls the token queue in the
+    meantime. With several processes, the wheel is served by the token_broker.TokenBroker.
+
+    Attributes:
+        max_wait (float): seconds to wait at most if no reset is known for an endpoint
+    """
+
+    def __init__(self, max_wait=900):
+        self.max_wait = max_wait
+        self.condition = mp.Condition()
+        self.resets = {}  # endpoint -> heap of (reset time, token)
+        self.known = {}  # (token, endpoint) -> reset time
+
+    def throttled(self, token, endpoint, reset_at):
+        """Reports that `token` has no calls left for `endpoint` until `reset_at`."""
+        with self.condition:
+            if self.known.get((token, endpoint)) == reset_at:
+                return
+            self.known[(token, endpoint)] = reset_at
+            heapq.heappush(self.resets.setdefault(endpoint, []), (reset_at, token))
+            self.condition.notify_all()
+
+    def wait(self, endpoint):
+        """Blocks until the next reset of `endpoint` that no other waiter claimed.
+
+        Returns:
+            the token whose window reset (str), or None if no reset was known for `max_wait`
+            seconds
+        """
+        with self.condition:
+            claim = None
+            while True:
+                heap = self.resets.setdefault(endpoint, [])
+                if claim is None:
+                    if len(heap) == 0:
+                        if not self.condition.wait(timeout=self.max_wait):
+                            return None
+                        continue
+                    claim = heapq.heappop(heap)
+                    if self.known.get((claim[1], endpoint)) != claim[0]:  # outdated
+                        claim = None
+                        continue
+                if len(heap) > 0 and heap[0] < claim:  # an earlier reset was reported
+                    heapq.heappush(heap, claim)
+                    claim = None
+                    continue
+                if claim[0] <= time.time():
+                    del self.known[(claim[1], endpoint)]
+                    return claim[1]
+                self.condition.wait(timeout=claim[0] - time.time())
+
+
 class Connection(object):
     """Class that handles the connection to Twitter
 
+    A connection holds one token of `token_queue` at a time. With `lazy`, it takes the token
+    only when the API is used and gives it back at the end of a `lease` block (or with
+    `release`) before doing other work, so that more walkers than tokens can share the tokens.
+
     Attributes:
         token_file_name (str): Path to file with user tokens
+        lazy (bool): whether to take a token at the first API access instead of on creation
+        reset_wheel (ResetWheel): shared by the connections using `token_queue` to wait for
+                                  rate limit resets, defaults to an own one
     """
 
-    def __init__(self, token_file_name="tokens.csv", token_queue=None):
+    # endpoint of `remaining_calls` and `reset_time`
+    rate_limit_endpoint = '/application/rate_limit_status'
+
+    def __init__(self, token_file_name="tokens.csv", token_queue=None, lazy=False,
+                 reset_wheel=None):
         self.credentials = FileImport().read_app_key_file()
 
         self.ctoken = self.credentials[0]
@@ -171,29 +436,177 @@ class Connection(object):
         if token_queue is None:
             self.tokens = FileImport().read_token_file(token_file_name)
 
-            self.token_queue = mp.Queue()
+            self.token_queue = TokenQueue()
 
             for token, secret in self.tokens.values:
                 self.token_queue.put((token, secret, {}, {}))
         else:
             self.token_queue = token_queue
 
-        self.token, self.secret, self.reset_time_dict, self.calls_dict = self.token_queue.get()
+        self.reset_wheel = reset_wheel if reset_wheel is not None else ResetWheel()
+
+        self.token, self.secret, self.reset_time_dict, self.calls_dict = None, None, None, None
+        self._api = None
+
+        if not lazy:
+            self.acquire()
+
+    @property
+    def api(self):
+        if self.token is None:
+            self.acquire()
+        return self._api
+
+    @api.setter
+    def api(self, api):
+        self._api = api
+
+    def acquire(self, token=None):
+        """Takes a token from the token queue, if the connection does not hold one already.
+
+        Args:
+            token (str): token to take if it is in the queue (and the queue supports taking
+                         particular tokens, see token_broker.TokenQueue), else the next one
+        Returns:
+            the token (str)
+        """
+
+        if self.token is None:
+            entry = None
+            if token is not None and hasattr(self.token_queue, 'take'):
+                entry = self.token_queue.take(token)
+            if entry is None:
+                entry = self.token_queue.get()
+            self.hold(entry)
+
+        return self.token
+
+    def hold(self, entry):
+        """Holds a token that was taken from the token queue elsewhere (e.g. with
+        `lease_spare_token`) as if the connection had acquired it.
+
+        Args:
+            entry (tuple): token, secret, reset times and remaining calls
+        Returns:
+            Nothing
+        """
+
+        self.token, self.secret, self.reset_time_dict, self.calls_dict = entry
         self.auth = tweepy.OAuthHandler(self.ctoken, self.csecret)
         self.auth.set_access_token(self.token, self.secret)
-        self.api = tweepy.API(self.auth, wait_on_rate_limit=False, wait_on_rate_limit_notify=False)
+        self._api = tweepy.API(self.auth, wait_on_rate_limit=False,
+                               wait_on_rate_limit_notify=False)
+
+    def release(self):
+        """Puts the token back into the token queue, if the connection holds one."""
+
+        if self.token is not None:
+            self.token_queue.put((self.token, self.secret, self.reset_time_dict, self.calls_dict))
+            self.token, self.secret, self.reset_time_dict, self.calls_dict = None, None, None, None
+            self._api = None
+
+    @contextmanager
+    def lease(self, endpoints=()):
+        """Context manager lending the connection to a with block. A token is taken at the
+        first API access in the block (see `api`) and put back into the token queue, with its
+        rate limit state, on any exit of the block. If the block raises tweepy.RateLimitError,
+        the token is marked as throttled (see `throttled`) before it is put back.
+
+        Args:
+            endpoints (list of str): endpoints used in the block, marked as throttled if a
+                                     rate limit error does not tell its endpoint
+
+        Example:
+            with connection.lease():
+                friends = connection.api.friends_ids(user_id=seed)
+        """
+
+        try:
+            yield self
+        except tweepy.RateLimitError as e:
+            self.throttled(e, endpoints)
+            raise
+        finally:
+            self.release()
+
+    def record(self, endpoint):
+        """Records the remaining calls and reset time of `endpoint` from the headers of the
+        last API response, after a call to `endpoint`. Without headers, the remaining calls
+        are unknown and forgotten.
+
+        Args:
+            endpoint (str): API endpoint, e.g. '/friends/ids'
+        Returns:
+            Nothing
+        """
+
+        _, remaining, reset = rate_limit_of(getattr(self._api, 'last_response', None))
+        if remaining is None:
+            self.calls_dict.pop(endpoint, None)
+            return
+        self.calls_dict[endpoint] = remaining
+        if reset is not None:
+            self.reset_time_dict[endpoint] = reset
+
+    def throttled(self, error, endpoints=()):
+        """Marks the token as having no calls left until the reset of the rate limit window
+        of the endpoint that raised `error`.
+
+        Args:
+            error (tweepy.RateLimitError)
+            endpoints (list of str): endpoints to mark if the response of `error` is unknown
+        Returns:
+            Nothing
+        """
+
+        if self.token is None:
+            return
+        endpoint, _, reset = rate_limit_of(getattr(error, 'response', None))
+        if endpoint is not None:
+            endpoints = [endpoint]
+        if reset is None:
+            reset = time.time() + 900  # length of a rate limit window
+        for endpoint in endpoints:
+            self.calls_dict[endpoint] = 0
+            self.reset_time_dict[endpoint] = reset
 
     def next_token(self):
 
-        self.token_queue.put((self.token, self.secret, self.reset_time_dict, self.calls_dict))
+        self.release()
+        self.acquire()
 
-        (self.token, self.secret,
-         self.reset_time_dict, self.calls_dict) = self.token_queue.get()
+    def ready(self, endpoint):
+        """Returns whether the token may have calls left for `endpoint`."""
 
-        self.auth = tweepy.OAuthHandler(self.ctoken, self.csecret)
-        self.auth.set_access_token(self.token, self.secret)
+        return (self.calls_dict.get(endpoint) != 0 or
+                self.reset_time_dict.get(endpoint, 0) <= time.time())
+
+    def wait_for_reset(self, endpoint):
+        """Exchanges the token for one that may have calls left for `endpoint`.
+
+        Each token in the queue is looked at once. If all are throttled, the connection waits
+        without a token until `reset_wheel` reports the next reset for `endpoint` and leases
+        the token whose window reset.
 
-        self.api = tweepy.API(self.auth)
+        Args:
+            endpoint (str): API endpoint, e.g. '/friends/ids'
+        Returns:
+            Nothing
+        """
+
+        self.acquire()
+        while not self.ready(endpoint):
+            for i in range(max(1, self.token_queue.qsize())):
+                self.reset_wheel.throttled(self.token, endpoint, self.reset_time_dict[endpoint])
+                self.next_token()
+                if self.ready(endpoint):
+                    return
+            self.reset_wheel.throttled(self.token, endpoint, self.reset_time_dict[endpoint])
+            self.release()
+            stdout.write(f"{time.strftime('%c')}: all tokens are rate limited for {endpoint}, "
+                         "waiting for the next reset.\n")
+            stdout.flush()
+            self.acquire(self.reset_wheel.wait(endpoint))
 
     def remaining_calls(self, endpoint='/friends/ids'):
         """Returns the number of remaining calls until reset time.
@@ -261,14 +674,19 @@ class Collector(object):
         connection (Connection object):
             Connection object with actually active credentials
         seed (int): Twitter id of seed user
+        wait_on_rate_limit (bool): If False, `get_friend_list` and `get_details` raise
+                                   tweepy.RateLimitError instead of waiting for a token.
     """
 
-    def __init__(self, connection, seed, following_pages_limit=0):
+    def __init__(self, connection, seed, following_pages_limit=0, wait_on_rate_limit=True):
         self.seed = seed
         self.connection = connection
+        self.wait_on_rate_limit = wait_on_rate_limit
 
         self.token_blacklist = {}
         self.following_pages_limit = following_pages_limit
+        # whether the last list returned by get_friend_list was not cut by the pages limit
+        self.last_list_complete = False
 
     class Decorators(object):
 
@@ -276,35 +694,34 @@ class Collector(object):
         def retry_with_next_token_on_rate_limit_error(func):
             def wrapper(*args, **kwargs):
                 collector = args[0]
-                old_token = collector.connection.token
+                connection = collector.connection
+                endpoint = Connection.rate_limit_endpoint
+                connection.acquire()
                 while True:
+                    token = connection.token
                     try:
-                        try:
-                            if kwargs['force_retry_token'] is True:
-                                print('Forced retry with token.')
-                                return func(*args, **kwargs)
-                        except KeyError:
-                            pass
-                        try:
-                            if collector.token_blacklist[old_token] <= time.time():
-                                print(f'Token starting with {old_token[:4]} should work again.')
-                                return func(*args, **kwargs)
-                            else:
-                                print(f'Token starting with {old_token[:4]} not ready yet.')
-                                collector.connection.next_token()
-                                time.sleep(10)
-                                continue
-                        except KeyError:
-                            print(f'Token starting with {old_token[:4]} not tried yet. Trying.')
+                        if kwargs.get('force_retry_token') is True:
+                            print('Forced retry with token.')
+                            return func(*args, **kwargs)
+                        if token not in collector.token_blacklist:
+                            print(f'Token starting with {token[:4]} not tried yet. Trying.')
                             return func(*args, **kwargs)
+                        if collector.token_blacklist[token] <= time.time():
+                            print(f'Token starting with {token[:4]} should work again.')
+                            return func(*args, **kwargs)
+                        print(f'Token starting with {token[:4]} not ready yet.')
+                        # let others use the token and wait for the next blacklisted token
+                        # to become ready on the reset wheel, then lease that one
+                        connection.release()
+                        connection.acquire(connection.reset_wheel.wait(endpoint))
                     except tweepy.RateLimitError:
-                        collector.token_blacklist[old_token] = time.time() + 150
-                        print(f'Token starting with {old_token[:4]} hit rate limit.')
+                        collector.token_blacklist[token] = time.time() + 150
+                        connection.reset_wheel.throttled(token, endpoint,
+                                                         collector.token_blacklist[token])
+                        print(f'Token starting with {token[:4]} hit rate limit.')
                         print("Retrying with next available token.")
-                        print(f"Blacklisted until {collector.token_blacklist[old_token]}")
-                        collector.connection.next_token()
-                        continue
-                    break
+                        print(f"Blacklisted until {collector.token_blacklist[token]}")
+                        connection.next_token()
             return wrapper
 
     @Decorators.retry_with_next_token_on_rate_limit_error
@@ -352,21 +769,11 @@ class Collector(object):
             while self.connection.calls_dict[endpoint] == 0:
                 stdout.write("Attempt with next available token.\n")
 
-                self.connection.next_token()
+                self.connection.wait_for_reset(endpoint)
 
-                try:
-                    next_reset_at = self.connection.reset_time_dict[endpoint]
-                    if time.time() >= next_reset_at:
-                        self.connection.calls_dict[endpoint] = \
-                            self.connection.remaining_calls(endpoint=endpoint)
-                    else:
-                        time.sleep(10)
-                        continue
-                except KeyError:
-                    self.connection.calls_dict[endpoint] = \
-                        try_remaining_calls_except_invalid_token()
-                    reset_time = self.connection.reset_time(endpoint=endpoint)
-                    self.connection.reset_time_dict[endpoint] = time.time() + reset_time
+                self.connection.calls_dict[endpoint] = try_remaining_calls_except_invalid_token()
+                reset_time = self.connection.reset_time(endpoint=endpoint)
+                self.connection.reset_time_dict[endpoint] = time.time() + reset_time
 
                 print("REMAINING CALLS FOR {} WITH TOKEN STARTING WITH {}: ".format(
                     endpoint, self.connection.token[:4]), self.connection.calls_dict[endpoint])
@@ -387,11 +794,7 @@ class Collector(object):
                 print(f"{time.strftime('%c')}: new reset of token {self.connection.token[:4]} for \
 {endpoint} in {int(self.connection.reset_time_dict[endpoint] - time.time())} seconds.")
 
-            while (endpoint in self.connection.reset_time_dict and
-                   self.connection.reset_time_dict[endpoint] >= time.time() and
-                   self.connection.calls_dict[endpoint] == 0):
-                self.connection.next_token()
-                time.sleep(1)
+            self.connection.wait_for_reset(endpoint)
 
             return None
 
@@ -410,6 +813,7 @@ class Collector(object):
             twitter_id = self.seed
 
         result = []
+        complete = False
 
         cursor = -1
         following_page = 0
@@ -418,12 +822,14 @@ class Collector(object):
                 try:
                     if follower is False:
                         page = self.connection.api.friends_ids(user_id=twitter_id, cursor=cursor)
-                        self.connection.calls_dict['/friends/ids'] = 1
+                        self.connection.record('/friends/ids')
                     else:
                         page = self.connection.api.followers_ids(user_id=twitter_id, cursor=cursor)
-                        self.connection.calls_dict['/followers/ids'] = 1
+                        self.connection.record('/followers/ids')
                     break
                 except tweepy.RateLimitError:
+                    if not self.wait_on_rate_limit:
+                        raise
                     if follower is False:
                         self.check_API_calls_and_update_if_necessary(endpoint='/friends/ids',
                                                                      check_calls=False)
@@ -434,11 +840,16 @@ class Collector(object):
             if len(page[0]) > 0:
                 result += page[0]
             else:
+                complete = True
                 break
             cursor = page[1][1]
+            if cursor == 0:
+                complete = True
 
             following_page += 1
 
+        self.last_list_complete = complete
+
         return result
 
     def get_details(self, friends):
@@ -473,9 +884,11 @@ class Collector(object):
                             stdout.flush()
                         else:
                             raise e
-                    self.connection.calls_dict['/users/lookup'] = 1
+                    self.connection.record('/users/lookup')
                     break
                 except tweepy.RateLimitError:
+                    if not self.wait_on_rate_limit:
+                        raise
                     self.check_API_calls_and_update_if_necessary(endpoint='/users/lookup',
                                                                  check_calls=False)
 
@@ -696,16 +1109,835 @@ class Collector(object):
         return following
 
 
+class FollowBackResolver(object):
+    """Answers whether an account follows another one from data collected anyway, so that
+    `Collector.check_follows` (one rate-limited API call) is only needed if it is inconclusive.
+
+    Sources, in this order:
+        1. friend lists in the friends table (or adjacency), as used before,
+        2. friend lists that are not stored (yet), e.g. partial pages,
+        3. follower lists gathered while bootstrapping.
+    A missing id only counts as an answer if the list it is missing from is complete.
+
+    Attributes:
+        dbh (DataBaseHandler)
+        max_lists (int): number of not stored friend and follower lists to keep each
+    """
+
+    def __init__(self, dbh, max_lists=10000):
+        self.dbh = dbh
+        self.max_lists = max_lists
+        self.lock = mp.Lock()
+
+        self.friend_lists = OrderedDict()  # source -> (sorted friend ids, complete)
+        self.follower_lists = OrderedDict()  # target -> (sorted follower ids, complete)
+        self.counts = {'stored_friends': 0, 'friend_lists': 0, 'follower_lists': 0, 'api': 0}
+
+    def _add(self, lists, account, ids, complete):
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        with self.lock:
+            if account in lists:
+                old_ids, old_complete = lists.pop(account)
+                ids = np.union1d(old_ids, ids)
+                complete = complete or old_complete
+            lists[account] = (ids, complete)
+            while len(lists) > self.max_lists:
+                lists.popitem(last=False)
+
+    def add_friends(self, source, friends, complete=False):
+        """Remembers (pages of) friends of `source` that are not written to the friends table."""
+        self._add(self.friend_lists, int(source), friends, complete)
+
+    def add_followers(self, target, followers, complete=False):
+        """Remembers (pages of) followers of `target`."""
+        self._add(self.follower_lists, int(target), followers, complete)
+
+    @staticmethod
+    def _lookup(lists, account, member):
+        """Returns True/False if `lists` determines whether `member` is in the list of
+        `account`, else None."""
+        if account not in lists:
+            return None
+        ids, complete = lists[account]
+        i = np.searchsorted(ids, member)
+        if i < len(ids) and ids[i] == member:
+            return True
+        if complete:
+            return False
+        return None
+
+    def resolve(self, source, target):
+        """Determines whether `source` follows `target` without calling the API.
+
+        Args:
+            source (int): user id
+            target (int): user id
+        Returns:
+            True or False if determined, None if the API has to be asked. In that case, call
+            `count_api_call` to keep the statistics right.
+        """
+        source, target = int(source), int(target)
+
+        if self.dbh.is_source(source):
+            with self.lock:
+                self.counts['stored_friends'] += 1
+            return self.dbh.follows(source=source, target=target)
+
+        with self.lock:
+            follows = self._lookup(self.friend_lists, source, target)
+            if follows is not None:
+                self.counts['friend_lists'] += 1
+                return follows
+
+            follows = self._lookup(self.follower_lists, target, source)
+            if follows is not None:
+                self.counts['follower_lists'] += 1
+                return follows
+
+        return None
+
+    def count_api_call(self):
+        with self.lock:
+            self.counts['api'] += 1
+
+    def stats(self):
+        """Returns the number of follow-back checks answered by each source and the hit rate,
+        i.e. the fraction of checks answered without an API call."""
+        with self.lock:
+            stats = dict(self.counts)
+        total = sum(stats.values())
+        stats['hit_rate'] = (total - stats['api']) / total if total > 0 else None
+        return stats
+
+
+class UnavailableAccounts(object):
+    """Negative cache of accounts that cannot be walked because they are protected, suspended
+    or do not exist (any more), kept in the table `unavailable_accounts`.
+
+    Such accounts are not asked for again until their entry expires (protected accounts may
+    become public again, deleted accounts hardly come back). They are removed from the seed
+    pool when they are found and, for the accounts found in earlier runs, when loading.
+
+    Attributes:
+        dbh (database_handler.DataBaseHandler)
+        seed_pool (seed_pool.SeedPool): pool to remove unavailable accounts from, or None
+        ttl (dict): seconds after which an account is tried again, by reason
+    """
+
+    ttl = {'protected': 7 * 86400, 'suspended': 30 * 86400, 'not_found': 90 * 86400}
+
+    def __init__(self, dbh, seed_pool=None):
+        self.dbh = dbh
+        self.seed_pool = seed_pool
+        self.lock = mp.Lock()
+        self.accounts = {}  # id -> (reason, expires)
+        self.counts = {'added': 0, 'skipped': 0, 'pruned': 0}
+        self.load()
+
+    @staticmethod
+    def classify(error):
+        """Returns why the account an API call failed for is unavailable ("protected",
+        "suspended" or "not_found"), or None if the error has another cause.
+
+        Args:
+            error (tweepy.error.TweepError)
+        """
+        reason = str(error.reason)
+        if "Not authorized." in reason:
+            return "protected"
+        if "suspended" in reason:
+            return "suspended"
+        if "does not exist" in reason or "not found" in reason.lower():
+            return "not_found"
+        return None
+
+    def load(self):
+        """Reads the unexpired entries from the database and prunes them from the seed pool."""
+        entries = self.dbh.read_unavailable_accounts()
+        with self.lock:
+            for account, reason, expires in entries.itertuples(index=False):
+                self.accounts[int(account)] = (reason, expires)
+        self._prune(entries['id'].values)
+
+    def _prune(self, accounts):
+        if self.seed_pool is None:
+            return
+        pruned = sum(self.seed_pool.remove(account) for account in accounts)
+        with self.lock:
+            self.counts['pruned'] += pruned
+
+    def add(self, account, reason):
+        """Records `account` as unavailable for `reason` and removes it from the seed pool."""
+        account = int(account)
+        expires = time.time() + self.ttl[reason]
+        with self.lock:
+            self.accounts[account] = (reason, expires)
+            self.counts['added'] += 1
+        self.dbh.write_unavailable_account(account, reason, expires)
+        self._prune([account])
+
+    def reason(self, account):
+        """Returns why `account` is unavailable, None if it is not known to be unavailable."""
+        with self.lock:
+            entry = self.accounts.get(int(account))
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self.accounts[int(account)]
+                return None
+            self.counts['skipped'] += 1
+            return entry[0]
+
+    def __contains__(self, account):
+        return self.reason(account) is not None
+
+    def available(self, accounts):
+        """Returns a boolean array marking which of `accounts` are not known to be unavailable.
+
+        Args:
+            accounts (array-like of int)
+        Returns:
+            numpy.ndarray of bool
+        """
+        now = time.time()
+        with self.lock:
+            available = np.array([self.accounts.get(int(account), (None, 0))[1] <= now
+                                  for account in accounts], dtype=bool)
+            self.counts['skipped'] += int((~available).sum())
+        return available
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats['known'] = len(self.accounts)
+        return stats
+
+
+def lease_spare_token(token_queue, endpoints, min_free_tokens=1):
+    """Takes a token with calls left for all `endpoints` without blocking, if more than
+    `min_free_tokens` tokens are idle in `token_queue`.
+
+    Returns:
+        token tuple, to be put back into `token_queue`, or None
+    """
+    if token_queue.qsize() <= min_free_tokens:
+        return None
+    try:
+        token = token_queue.get(block=False)
+    except queue.Empty:
+        return None
+    reset_time_dict, calls_dict = token[2], token[3]
+    for endpoint in endpoints:
+        if calls_dict.get(endpoint) == 0 and reset_time_dict.get(endpoint, 0) > time.time():
+            token_queue.put(token)
+            return None
+    return token
+
+
+class SpareTokenFetcher(ABC):
+    """Base of the fetchers that call the API in the background with spare tokens (see
+    `lease_spare_token`), while the walkers go on with their steps. Results are kept until
+    they are taken or discarded after `max_age` seconds.
+
+    Subclasses define the `endpoints` they call and `_fetch`.
+
+    Attributes:
+        token_queue (mp.Queue): the token queue of the Coordinator
+        min_free_tokens (int): number of tokens that have to be left in the queue for walkers
+        max_age (float): seconds after which unused results are discarded
+    """
+
+    endpoints = []
+    # how failures are reported, e.g. "Prefetching 123 failed"
+    action = "Fetching"
+
+    def __init__(self, token_queue, workers, min_free_tokens=1, max_age=600):
+        self.token_queue = token_queue
+        self.min_free_tokens = min_free_tokens
+        self.max_age = max_age
+
+        self.pool = mp.Pool(workers)
+        self.lock = mp.Lock()
+        self.pending = OrderedDict()  # key -> (start time, AsyncResult)
+        self.counts = {'started': 0, 'used': 0, 'discarded': 0, 'no_token': 0, 'failed': 0}
+
+    @abstractmethod
+    def _fetch(self, key, token):
+        """Fetches the data of `key` with `token` (a token tuple to hold, see `_connect`)."""
+
+    def _connect(self, token):
+        """Returns a connection holding `token`, which its `lease` block puts back."""
+        connection = Connection(token_queue=self.token_queue, lazy=True)
+        connection.hold(token)
+        return connection
+
+    def _passes_on(self, error):
+        """Returns whether `error` of a fetch is raised by `_take` instead of counted."""
+        return False
+
+    def _expire(self):
+        with self.lock:
+            while len(self.pending) > 0:
+                key, (started, _) = next(iter(self.pending.items()))
+                if time.time() - started <= self.max_age:
+                    break
+                del self.pending[key]
+                self.counts['discarded'] += 1
+
+    def _start(self, key):
+        """Starts fetching `key` in the background if a spare token is available.
+
+        Returns:
+            True if the fetch was started (or is running already), else False
+        """
+        with self.lock:
+            if key in self.pending:
+                return True
+        token = lease_spare_token(self.token_queue, self.endpoints, self.min_free_tokens)
+        if token is None:
+            with self.lock:
+                self.counts['no_token'] += 1
+            return False
+        with self.lock:
+            self.pending[key] = (time.time(), self.pool.apply_async(self._fetch, (key, token)))
+            self.counts['started'] += 1
+        return True
+
+    def _take(self, key, timeout, name):
+        """Returns the result of the fetch of `key` (called `name` in messages), waiting up to
+        `timeout` seconds if it still runs, or None if nothing was fetched."""
+        with self.lock:
+            entry = self.pending.pop(key, None)
+        if entry is None:
+            return None
+        try:
+            result = entry[1].get(timeout=timeout)
+        except Exception as e:
+            if self._passes_on(e):
+                raise
+            print(f"{self.action} {name} failed, accessing Twitter API. {e}")
+            result = None
+        with self.lock:
+            self.counts['used' if result is not None else 'failed'] += 1
+        return result
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class Prefetcher(SpareTokenFetcher):
+    """Speculatively fetches the friends and friend details of the seed a walker chose next,
+    while the walker still finishes its current step.
+
+    Prefetching only uses tokens that no walker is waiting for and that have calls left for
+    both endpoints. It gives up instead of waiting if a rate limit is hit. Results that are not
+    taken within `max_age` seconds are discarded.
+
+    Attributes:
+        following_pages_limit (int): see Collector
+        follow_back (FollowBackResolver): receives prefetched friend lists, if given
+        workers (int): number of prefetching threads
+        further Attributes: see SpareTokenFetcher
+    """
+
+    endpoints = ['/friends/ids', '/users/lookup']
+    action = "Prefetching"
+
+    def __init__(self, token_queue, following_pages_limit=0, follow_back=None, workers=2,
+                 min_free_tokens=1, max_age=600):
+        super().__init__(token_queue, workers, min_free_tokens=min_free_tokens, max_age=max_age)
+        self.following_pages_limit = following_pages_limit
+        self.follow_back = follow_back
+
+    def _fetch(self, seed, token):
+        connection = self._connect(token)
+        with connection.lease(self.endpoints):
+            collector = Collector(connection, seed,
+                                  following_pages_limit=self.following_pages_limit,
+                                  wait_on_rate_limit=False)
+            friend_list = collector.get_friend_list()
+            complete = collector.last_list_complete
+            if self.follow_back is not None:
+                self.follow_back.add_friends(seed, friend_list, complete=complete)
+            friends_details = collector.get_details(friend_list)
+            return friend_list, complete, friends_details
+
+    def start(self, seed):
+        """Starts prefetching `seed` in the background if a token is available.
+
+        Returns:
+            True if prefetching was started (or is running already), else False
+        """
+        self._expire()
+        return self._start(int(seed))
+
+    def take(self, seed, timeout=60):
+        """Returns the prefetched data of `seed`, waiting up to `timeout` seconds if the fetch
+        still runs.
+
+        Returns:
+            tuple of friend list (list of int), whether it is complete (bool) and
+            friends details (list of Tweepy user objects), or None if nothing is prefetched
+        """
+        return self._take(int(seed), timeout, seed)
+
+
+class TimelineScreener(SpareTokenFetcher):
+    """Fetches the latest tweets of the next candidates of a step concurrently, while the step
+    checks the current candidate for the language or keyword conditions. A rejected candidate
+    is then followed by one whose tweets are there already, instead of by another API call.
+
+    At most `candidates` timelines are fetched at a time per step (the current candidate's by
+    the step itself), and only with tokens that no walker is waiting for.
+
+    Attributes:
+        candidates (int): number of candidates screened at a time
+        further Attributes: see SpareTokenFetcher
+    """
+
+    endpoints = ['/statuses/user_timeline']
+    action = "Screening"
+
+    def __init__(self, token_queue, candidates=4, min_free_tokens=1, max_age=600):
+        super().__init__(token_queue, max(candidates - 1, 1), min_free_tokens=min_free_tokens,
+                         max_age=max_age)
+        self.candidates = candidates
+
+    def _fetch(self, key, token):
+        connection = self._connect(token)
+        with connection.lease(self.endpoints):
+            return get_latest_tweets(key[1], connection, fields=['lang', 'full_text'])
+
+    def _passes_on(self, error):
+        return (isinstance(error, tweepy.error.TweepError) and
+                UnavailableAccounts.classify(error) is not None)
+
+    def start(self, seed, candidates):
+        """Starts fetching the tweets of `candidates` of the step on `seed` that are not
+        fetched yet, as long as spare tokens are available."""
+        self._expire()
+        for candidate in candidates:
+            if not self._start((int(seed), int(candidate))):
+                return
+
+    def take(self, seed, candidate, timeout=120):
+        """Returns the fetched tweets of `candidate`, waiting up to `timeout` seconds if the
+        fetch still runs.
+
+        Returns:
+            pandas.DataFrame as returned by `get_latest_tweets`, None if nothing was fetched
+        Raises:
+            tweepy.error.TweepError: if the candidate turned out to be unavailable
+        """
+        return self._take((int(seed), int(candidate)), timeout, candidate)
+
+    def discard(self, seed):
+        """Forgets the fetches for the step on `seed` (their tokens are put back anyway)."""
+        with self.lock:
+            for key in [key for key in self.pending if key[0] == int(seed)]:
+                del self.pending[key]
+                self.counts['discarded'] += 1
+
+
+class RankedCandidates(object):
+    """Friends of a seed in the order they are tried as the next seed: highest followers count
+    first, friends with the same count in their order in the friends details.
+
+    The order is computed once per step. Rejecting the current candidate (e.g. because it does
+    not meet the language or keyword conditions or its edge was burned by another walker)
+    moves on to the next one in constant time.
+
+    Attributes:
+        ids (numpy.ndarray): ids of the friends in ranked order
+        followers_count (numpy.ndarray): their followers counts
+        position (int): index of the current candidate
+    """
+
+    def __init__(self, friends_details):
+        """
+        Args:
+            friends_details (pandas.DataFrame): with columns id and followers_count
+        """
+        followers_count = friends_details['followers_count'].values.astype(float)
+        # stable, so that ties keep their order; missing counts come last
+        order = np.argsort(-followers_count, kind='stable')
+        self.ids = friends_details['id'].values[order]
+        self.followers_count = followers_count[order]
+        self.position = 0
+
+    def __len__(self):
+        return len(self.ids) - self.position
+
+    def best(self):
+        """Returns the current candidate, None if all were rejected."""
+        if self.position >= len(self.ids):
+            return None
+        return self.ids[self.position]
+
+    def upcoming(self, n):
+        """Returns the ids of the (up to) `n` candidates after the current one."""
+        return self.ids[self.position + 1:self.position + 1 + n]
+
+    def reject(self):
+        """Drops the current candidate and returns the next one (None if there is none)."""
+        self.position = min(self.position + 1, len(self.ids))
+        return self.best()
+
+
+class StepMemo(object):
+    """Remembers the results of the completed stages of steps, so that a step retried after an
+    error resumes after its last completed stage instead of calling the API again.
+
+    A stage is identified by the seed of the step and the name of the stage (e.g. "friends"
+    or "details"). Results of failed stages are not stored. The stages of a seed are forgotten
+    when its step is done or after `max_age` seconds.
+
+    Attributes:
+        max_age (float): seconds after which stages of unfinished steps are discarded
+    """
+
+    def __init__(self, max_age=3600):
+        self.max_age = max_age
+        self.lock = mp.Lock()
+        self.steps = OrderedDict()  # seed -> (start time, {stage: result})
+        self.counts = {'stored': 0, 'reused': 0}
+
+    def _expire(self):
+        while len(self.steps) > 0:
+            seed, (started, _) = next(iter(self.steps.items()))
+            if time.time() - started <= self.max_age:
+                break
+            del self.steps[seed]
+
+    def lookup(self, seed, stage, default=None):
+        """Returns the stored result of `stage` of the step on `seed`, or `default`."""
+        with self.lock:
+            self._expire()
+            stages = self.steps.get(int(seed), (None, {}))[1]
+            if stage not in stages:
+                return default
+            self.counts['reused'] += 1
+            return stages[stage]
+
+    def put(self, seed, stage, result):
+        """Stores `result` as the result of `stage` of the step on `seed`."""
+        with self.lock:
+            self._expire()
+            self.steps.setdefault(int(seed), (time.time(), {}))[1][stage] = result
+            self.counts['stored'] += 1
+
+    def get(self, seed, stage, compute):
+        """Returns the stored result of `stage` of the step on `seed`, calling `compute` and
+        storing its result if the stage has not been completed yet.
+
+        Args:
+            seed (int)
+            stage (str)
+            compute (callable): function without arguments doing the work of the stage
+        Returns:
+            result of the stage
+        """
+        missing = object()
+        result = self.lookup(seed, stage, default=missing)
+        if result is missing:
+            result = compute()
+            self.put(seed, stage, result)
+        return result
+
+    def done(self, seed):
+        """Forgets the stages of the step on `seed`."""
+        with self.lock:
+            self.steps.pop(int(seed), None)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class InFlightSeeds(object):
+    """Registry of the seeds that are worked on, so that no two steps work on the same seed at
+    the same time.
+
+    Hubs are the next seed of many walks and random seeds are drawn from the seed pool, so the
+    same seed can end up in the seed queue twice. Two steps on it would fetch the same friends
+    twice and compete for the same edges. A seed that is already queued or worked on is
+    detected when it is put into the seed queue (`put`) and when a walker takes it from there
+    (`claim`). Its walk is then either merged into the other walk on the seed (i.e. dropped),
+    or redirected to a fresh seed from the seed pool, which keeps the number of walks.
+
+    Attributes:
+        seed_queue (queue.Queue)
+        seed_pool (seed_pool.SeedPool): to draw fresh seeds from, None to always merge
+        record (callable): records "merged" and "redirected" events in the journal, called
+                           like `Coordinator.record`
+        redirect (bool): whether to redirect duplicate walks instead of merging them
+    """
+
+    def __init__(self, seed_queue, seed_pool=None, record=None, redirect=True):
+        self.seed_queue = seed_queue
+        self.seed_pool = seed_pool
+        self.record = record
+        self.redirect = redirect
+        self.lock = mp.Lock()
+        self.seeds = {}  # seed -> name of the thread working on it
+        self.counts = {'claimed': 0, 'duplicates_enqueued': 0, 'duplicates_dequeued': 0,
+                       'merged': 0, 'redirected': 0}
+
+    def _queued(self, seed):
+        with self.seed_queue.mutex:
+            return seed in self.seed_queue.queue
+
+    def _fresh_seed(self, tries=10):
+        """Returns a random seed of the seed pool that is neither queued nor worked on, or None
+        if there is none after `tries` draws."""
+        if self.seed_pool is None or not self.redirect:
+            return None
+        for i in range(tries):
+            try:
+                seed = self.seed_pool.sample(n=1)[0]
+            except ValueError:  # empty seed pool
+                return None
+            if int(seed) not in self.seeds and not self._queued(seed):
+                return seed
+        return None
+
+    def _duplicate(self, seed, kind):
+        """Counts a duplicate of `seed` and returns the fresh seed to redirect its walk to, or
+        None to merge it."""
+        self.counts[kind] += 1
+        fresh = self._fresh_seed()
+        if fresh is None:
+            self.counts['merged'] += 1
+            if self.record is not None:
+                self.record("merged", seed)
+        else:
+            self.counts['redirected'] += 1
+            if self.record is not None:
+                self.record("redirected", seed, fresh)
+        return fresh
+
+    def put(self, seed):
+        """Puts `seed` into the seed queue, unless it is queued or worked on already.
+
+        Returns:
+            seed put into the queue instead (int), None if the walk was merged
+        """
+        with self.lock:
+            if int(seed) in self.seeds or self._queued(seed):
+                seed = self._duplicate(seed, 'duplicates_enqueued')
+                if seed is None:
+                    return None
+            self.seed_queue.put(seed)
+            return seed
+
+    def claim(self, seed):
+        """Registers `seed` taken from the seed queue as worked on by the current thread.
+
+        Returns:
+            seed to work on instead (int), None if the walk was merged
+        """
+        with self.lock:
+            if int(seed) in self.seeds:
+                seed = self._duplicate(seed, 'duplicates_dequeued')
+                if seed is None:
+                    return None
+            self.seeds[int(seed)] = threading.current_thread().name
+            self.counts['claimed'] += 1
+            return seed
+
+    def release(self, seed):
+        """Unregisters `seed` once its step is done or failed (before it is put back)."""
+        with self.lock:
+            self.seeds.pop(int(seed), None)
+
+    def working(self):
+        """Returns the seeds worked on (dict of seed -> thread name)."""
+        with self.lock:
+            return dict(self.seeds)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class Walker(MyProcess):
+    """Long-running walker thread that keeps taking seeds from the seed queue of a Coordinator
+    and working through them, until it is asked to stop.
+
+    A walker does not wait for other walkers. The next seed it determines goes back into the
+    seed queue, where any walker can pick it up. If a step fails, its token is put back. With a
+    `retry_scheduler` of the Coordinator, the seed is retried later (see RetryScheduler) while
+    the walker goes on with other seeds. Otherwise, or if the error is not retried, the seed is
+    put back into the seed queue before the walker ends with the exception, so that another
+    walker can continue the walk. A seed whose step failed without retry too often is dropped
+    instead, and its walk continues on a random seed (see RetryScheduler.drop). With the
+    `in_flight` registry of the Coordinator, a seed that another walker works on already is not
+    worked on twice (see InFlightSeeds).
+
+    Attributes:
+        coordinator (Coordinator)
+        stop (mp.Event): set to stop the walker after its current step
+        step_kwargs (dict): arguments for `Coordinator.work_through_seed_get_next_seed`
+        first_step_kwargs (dict): arguments to override `step_kwargs` with for the first step,
+                                  e.g. `restart`
+        max_steps (int): number of steps after which the walker ends, None for unlimited
+        steps (int): number of steps done so far
+        current_seed (int): seed the walker works on, None between steps
+    """
+
+    def __init__(self, coordinator, stop, step_kwargs={}, first_step_kwargs={}, max_steps=None,
+                 name=None):
+        super().__init__(target=self.walk, name=name)
+        self.daemon = True
+        self.coordinator = coordinator
+        self.stop = stop
+        self.step_kwargs = step_kwargs
+        self.first_step_kwargs = first_step_kwargs
+        self.max_steps = max_steps
+        self.steps = 0
+        self.current_seed = None
+        self.err = None
+
+    def connect(self):
+        return Connection(token_queue=self.coordinator.token_queue, lazy=True,
+                          reset_wheel=getattr(self.coordinator, 'reset_wheel', None))
+
+    def walk(self):
+        retry_scheduler = getattr(self.coordinator, 'retry_scheduler', None)
+        # retry through the scheduler instead of sleeping in the step
+        step_kwargs = dict(self.step_kwargs, retries=1) if retry_scheduler else self.step_kwargs
+        kwargs = dict(step_kwargs, **self.first_step_kwargs)
+
+        while not self.stop.is_set():
+            if self.max_steps is not None and self.steps >= self.max_steps:
+                break
+            try:
+                seed = self.coordinator.seed_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            # a seed another walker works on already is merged or redirected
+            in_flight = getattr(self.coordinator, 'in_flight', None)
+            if in_flight is not None:
+                seed = in_flight.claim(seed)
+                if seed is None:
+                    continue
+
+            self.current_seed = seed
+            start_time = time.time()
+            journal = getattr(self.coordinator, 'journal', None)
+            if journal is not None:
+                journal.record("acquired", seed)
+            connection = self.connect()
+            try:
+                with connection.lease():
+                    new_seed = self.coordinator.work_through_seed_get_next_seed(
+                        seed=seed, connection=connection, **kwargs)
+            except Exception as e:
+                # the seed is put back, so it must not count as worked on
+                if in_flight is not None:
+                    in_flight.release(seed)
+                # the step may be half-written, so do not trust the database for it
+                restart_seeds = getattr(self.coordinator, 'restart_seeds', None)
+                if restart_seeds is not None:
+                    restart_seeds.add(seed)
+                scheduled = None
+                if retry_scheduler is not None:
+                    scheduled = retry_scheduler.retry(seed, e)
+                    if scheduled is None and retry_scheduler.drop(seed):
+                        self.drop(seed, e)
+                        continue
+                if scheduled is None:
+                    self.coordinator.seed_queue.put(seed)
+                if journal is not None:
+                    journal.record("released", seed, restart=True)
+                if scheduled is None:
+                    raise
+                stdout.write(f"Walker {self.name}: step on {seed} failed ({scheduled[0]}), "
+                             f"retrying in {scheduled[1]:.0f} seconds.\n{e}\n")
+                stdout.flush()
+                continue
+            finally:
+                self.current_seed = None
+
+            if in_flight is not None:
+                in_flight.release(seed)
+            if retry_scheduler is not None:
+                retry_scheduler.succeeded(seed)
+            if journal is not None:
+                journal.record("completed", seed, new_seed)
+
+            self.steps += 1
+            kwargs = step_kwargs
+            stdout.write(f"Walker {self.name}: step {self.steps} ({seed})-->({new_seed}) "
+                         f"took {time.time() - start_time:.1f} seconds\n")
+            stdout.flush()
+
+    def drop(self, seed, error):
+        """Drops `seed`, whose step failed too often, and continues its walk on a random seed
+        of the seed pool, if the coordinator has one."""
+        fresh = None
+        seed_pool = getattr(self.coordinator, 'seed_pool', None)
+        if seed_pool is not None:
+            seed_pool.remove(seed)
+            if len(seed_pool) > 0:
+                fresh = seed_pool.sample(n=1)[0]
+        journal = getattr(self.coordinator, 'journal', None)
+        if journal is not None:
+            journal.record("dropped", seed, fresh)
+        if fresh is not None:
+            self.coordinator.seed_queue.put(fresh)
+        stdout.write(f"Walker {self.name}: dropped seed {seed} after repeated failures, "
+                     f"continuing with {fresh}.\n{error}\n")
+        stdout.flush()
+
+
 class Coordinator(object):
     """Selects a queue of seeds and coordinates the collection with collectors
     and a queue of tokens.
     """
 
     def __init__(self, seeds=2, token_file_name="tokens.csv", seed_list=None,
-                 following_pages_limit=0):
+                 following_pages_limit=0, adjacency=False, adjacency_file=None,
+                 prefetch=False, token_queue=None, latest_seeds_file="latest_seeds.csv",
+                 coordination=None, journal=None, resume=None,
+                 token_state_file="token_state.json", redirect_duplicates=True, prescreen=0,
+                 reset_wheel=None):
+        """
+        Args:
+            seeds (int): number of seeds to draw from seeds.csv if `seed_list` is None
+            token_file_name (str): Path to file with user tokens
+            seed_list (list of int): seeds to start with
+            following_pages_limit (int): maximum number of friend pages to collect per account
+            adjacency (bool): whether to answer friends lookups from an in-memory adjacency of
+                              the friends table instead of the database
+            adjacency_file (str): directory for a memory-mapped copy of the adjacency, that
+                                  makes loading it after a restart fast
+            prefetch (bool): whether to fetch the friends of chosen next seeds in the background
+            prescreen (int): number of candidates for the next seed whose tweets are fetched
+                             at a time for the language and keyword checks (see
+                             TimelineScreener), 0 or 1 to fetch them one after another
+            token_queue (queue): queue of tokens shared with other Coordinators, e.g. of a
+                                 token_broker.TokenBroker, instead of the tokens of
+                                 `token_file_name`
+            reset_wheel (ResetWheel): wheel shared with the other users of `token_queue`, e.g.
+                                      of the token_broker.TokenBroker, defaults to an own one
+            latest_seeds_file (str): file to save the seeds to continue with after a restart
+            coordination (coordination.CrawlCoordination): to share seeds and tokens with other
+                                                           nodes through the database
+            journal (journal.WalkerJournal): journal to record the steps of walkers in
+            resume (list of journal.Walk): walks replayed from `journal` to continue instead of
+                                           starting walks at `seeds` or `seed_list`
+            token_state_file (str): file to keep the rate limit state of the tokens of
+                                    `token_file_name` in across restarts, None to not keep it
+            redirect_duplicates (bool): whether a walk reaching a seed that is queued or worked
+                                        on already goes on at a fresh seed of the seed pool
+                                        instead of being merged into the other walk
+        """
 
-        # Get seeds from seeds.csv
-        self.seed_pool = FileImport().read_seed_file()
+        # Get seeds from seeds.csv (or the compiled seeds.npy)
+        self.seed_pool = SeedPool(FileImport().read_seeds(), is_sorted=True)
 
         # Create seed_list if none is given by sampling from the seed_pool
         if seed_list is None:
@@ -716,55 +1948,222 @@ class Coordinator(object):
             except ValueError:  # seed pool too small
                 stderr.write("WARNING: Seed pool smaller than number of seeds.\n")
                 self.seeds = self.seed_pool.sample(n=self.number_of_seeds, replace=True)
-
-            self.seeds = self.seeds[0].values
         else:
             self.number_of_seeds = len(seed_list)
             self.seeds = seed_list
 
-        self.seed_queue = mp.Queue()
+        self.coordination = coordination
+        self.token_state = None
 
-        for seed in self.seeds:
-            self.seed_queue.put(seed)
+        if coordination is not None:
+            # seeds are only added if the shared crawl has none yet
+            coordination.join(seeds=self.seeds,
+                              tokens=FileImport().read_token_file(token_file_name))
+            self.seed_queue = coordination.seed_queue
+            self.token_queue = coordination.token_queue
+        else:
+            self.seed_queue = mp.Queue()
+
+            for seed in self.seeds:
+                self.seed_queue.put(seed)
+
+            if token_queue is not None:
+                self.token_queue = token_queue
+            else:
+                # Get authorized user tokens for app from tokens.csv
+                self.tokens = FileImport().read_token_file(token_file_name)
+
+                # and put them in a queue, with their rate limits of the last run
+                self.token_queue = TokenQueue()
 
-        # Get authorized user tokens for app from tokens.csv
-        self.tokens = FileImport().read_token_file(token_file_name)
+                if token_state_file is not None:
+                    self.token_state = TokenStateStore(token_state_file)
 
-        # and put them in a queue
-        self.token_queue = mp.Queue()
+                for token, secret in self.tokens.values:
+                    if self.token_state is not None:
+                        reset_time_dict, calls_dict = self.token_state.restore(token)
+                    else:
+                        reset_time_dict, calls_dict = {}, {}
+                    self.token_queue.put((token, secret, reset_time_dict, calls_dict))
 
-        for token, secret in self.tokens.values:
-            self.token_queue.put((token, secret, {}, {}))
+        self.latest_seeds_file = latest_seeds_file
 
         # Initialize DataBaseHandler for DB communication
         self.dbh = DataBaseHandler()
         self.following_pages_limit = following_pages_limit
 
+        if adjacency is True:
+            self.dbh.adjacency = get_process_adjacency(self.dbh, backing_file=adjacency_file)
+
+        self.follow_back = FollowBackResolver(self.dbh)
+
+        # protected, suspended and deleted accounts found in this or earlier runs
+        self.unavailable = UnavailableAccounts(self.dbh, self.seed_pool)
+
+        # sources of the friends and result tables in memory instead of asking the database
+        # at every step, and the walked seeds found to have no friends meeting the conditions
+        self.source_index_time = time.time()
+        if self.dbh.adjacency is None:
+            self.dbh.load_source_index()
+        self.walked_sources = SeedPool(self.dbh.read_sources("result"))
+        self.depleted_seeds = set()
+
+        if prefetch is True:
+            self.prefetcher = Prefetcher(self.token_queue,
+                                         following_pages_limit=following_pages_limit,
+                                         follow_back=self.follow_back)
+        else:
+            self.prefetcher = None
+
+        # compiled keywords of the crawl, see keyword_matcher
+        self._keyword_matcher = None
+
+        if prescreen > 1:
+            self.screener = TimelineScreener(self.token_queue, candidates=prescreen)
+        else:
+            self.screener = None
+
+        # lets connections of all walkers wait for rate limit resets together
+        self.reset_wheel = reset_wheel if reset_wheel is not None else ResetWheel()
+
+        # results of completed stages of steps, reused when a step is retried
+        self.step_memo = StepMemo()
+
+        # leased walks have to be put back by the walker holding them, so they are not delayed
+        if self.coordination is None:
+            self.retry_scheduler = RetryScheduler(self.seed_queue)
+        else:
+            self.retry_scheduler = None
+
+        # keeps two steps from working on the same seed at the same time (shared crawls lease
+        # their seeds in the database instead)
+        if self.coordination is None:
+            self.in_flight = InFlightSeeds(self.seed_queue, self.seed_pool, record=self.record,
+                                           redirect=redirect_duplicates)
+        else:
+            self.in_flight = None
+
+        # newest timestamp of user details added to the seed pool by bootstrap_seed_pool
+        self.bootstrap_watermark = None
+        self.bootstrap_overlap = 60
+
+        self.journal = journal
+        self.restart_seeds = set()
+        if journal is not None:
+            self.start_journal(resume)
+
+    def start_journal(self, walks=None):
+        """Starts a new journal queueing the seeds to walk.
+
+        If `walks` replayed from the former journal are given, their seeds are queued instead
+        of `self.seeds`. Steps that were interrupted after writing their result are finished by
+        claiming the edge and queueing the next seed. Seeds of steps that were interrupted
+        before their friend details were stored are worked through again without trusting
+        the database (like after a restart).
+
+        Args:
+            walks (list of journal.Walk)
+        Returns:
+            Nothing
+        """
+
+        if walks is None:
+            self.journal.checkpoint([(seed, False) for seed in self.seeds])
+            return
+
+        seeds = []
+        for walk in walks:
+            if walk.stage == "result_written":
+                self.dbh.burn_friend(walk.seed, walk.target)
+            if walk.stage in ["result_written", "edge_claimed"]:
+                seeds.append((walk.target, False))
+            elif walk.stage == "details_stored":
+                seeds.append((walk.seed, False))
+            else:
+                seeds.append((walk.seed, walk.restart or walk.stage != "queued"))
+
+        # the new journal has to be written before the seeds are walked
+        self.journal.checkpoint(seeds)
+
+        for seed, restart in seeds:
+            if restart:
+                self.restart_seeds.add(seed)
+            self.seed_queue.put(seed)
+
+        self.seeds = [seed for seed, _ in seeds]
+        self.number_of_seeds = len(seeds)
+
+    def record(self, event, seed, target=None):
+        """Records a step event in the journal, if there is one."""
+        if self.journal is not None:
+            self.journal.record(event, seed, target)
+
+    def queue_seed(self, seed):
+        """Puts `seed` into the seed queue, unless it is queued or worked on already (see
+        InFlightSeeds).
+
+        Returns:
+            seed put into the queue (int), None if the walk was merged
+        """
+        if self.in_flight is not None:
+            return self.in_flight.put(seed)
+        self.seed_queue.put(seed)
+        return seed
+
     def bootstrap_seed_pool(self, after_timestamp=0):
         """Adds all collected user details, i.e. friends with the desired properties
         (e.g. language) of previously found seeds to the seed pool.
 
+        Only the user details written since the last call are read, after `after_timestamp`
+        at the first call. The details written by this Coordinator's own steps are added
+        while they are written already, so this catches up with those of other processes.
+
         Args:
-            after_timestamp (int): filter for friends added after this timestamp. Default: 0
+            after_timestamp (int): filter for friends added after this timestamp at the first
+                                   call. Default: 0
         Returns:
             None
         """
 
+        if self.bootstrap_watermark is not None:
+            # rows of transactions that committed late may carry slightly older timestamps
+            after_timestamp = self.bootstrap_watermark - self.bootstrap_overlap
+
         seed_pool_size = len(self.seed_pool)
         stdout.write("Bootstrapping seeds.\n")
         stdout.write(f"Old size: {seed_pool_size}. Adding after {after_timestamp} ")
         stdout.flush()
 
-        query = f"SELECT id FROM user_details WHERE UNIX_TIMESTAMP(timestamp) >= {after_timestamp}"
+        query = f"""SELECT id, {self.dbh.unix_timestamp()} AS unix_timestamp FROM user_details
+                    WHERE {self.dbh.timestamp_after(after_timestamp, inclusive=True)}"""
 
-        more_seeds = pd.read_sql(query, self.dbh.engine)
-        more_seeds.columns = [0]  # rename from id to 0 for proper append
-        self.seed_pool = self.seed_pool.merge(more_seeds, how='outer', on=[0])
+        watermark = after_timestamp
+        for more_seeds in pd.read_sql(query, self.dbh.engine, chunksize=100000):
+            if len(more_seeds) > 0:
+                self.seed_pool.add(more_seeds['id'].values)
+                watermark = max(watermark, int(more_seeds['unix_timestamp'].max()))
+        self.bootstrap_watermark = watermark
 
         seed_pool_size = len(self.seed_pool)
         stdout.write(f"New size: {seed_pool_size}\n")
         stdout.flush()
 
+    def refresh_source_indexes(self):
+        """Adds the sources written to the friends and result tables (and the removed friend
+        targets) by other processes since the last refresh to the in-memory indexes of this
+        Coordinator, and the friend lists to the adjacency if there is one."""
+
+        # rows of transactions that committed late may carry slightly older timestamps
+        after = self.source_index_time - self.bootstrap_overlap
+        self.source_index_time = time.time()
+        if self.dbh.adjacency is not None:
+            self.dbh.adjacency.refresh(self.dbh, overlap=self.bootstrap_overlap)
+        if self.dbh.source_index is not None:
+            self.dbh.load_source_index(after=after)
+        if self.dbh.removed_targets is not None:
+            self.dbh.read_removed_targets(reload=True)
+        self.walked_sources.add(self.dbh.read_sources("result", after=after))
+
     def lookup_accounts_friend_details(self, account_id, db_connection=None, select="*"):
         """Looks up and retrieves details from friends of `account_id` via database.
 
@@ -780,14 +2179,12 @@ class Coordinator(object):
         if db_connection is None:
             db_connection = self.dbh.engine
 
-        query = f"SELECT target from friends WHERE source = {account_id} AND burned = 0"
-        friends = pd.read_sql(query, db_connection)
+        friends = self.dbh.read_friends(account_id, unburned_only=True)
 
         if len(friends) == 0:
             return None
         else:
-            friends = friends['target'].values
-            friends = tuple(friends)
+            friends = tuple(friends.tolist())
             if len(friends) == 1:
                 friends = str(friends).replace(',', '')
 
@@ -797,21 +2194,49 @@ class Coordinator(object):
             return friend_detail
 
     def choose_random_new_seed(self, msg, connection):
-        new_seed = self.seed_pool.sample(n=1)
-        new_seed = new_seed[0].values[0]
+        for i in range(10):
+            new_seed = self.seed_pool.sample(n=1)[0]
+            # e.g. added again by bootstrapping
+            if new_seed not in self.unavailable:
+                break
+            self.seed_pool.remove(new_seed)
 
         if msg is not None:
             stdout.write(msg + "\n")
             stdout.flush()
 
-        self.token_queue.put(
-            (connection.token, connection.secret,
-             connection.reset_time_dict, connection.calls_dict))
+        connection.release()
 
-        self.seed_queue.put(new_seed)
+        self.queue_seed(new_seed)
 
         return new_seed
 
+    def keyword_matcher(self, keywords):
+        """Returns the KeywordMatcher for `keywords`, compiled only once per crawl."""
+        matcher = self._keyword_matcher
+        if matcher is None or matcher.keywords != tuple(keywords):
+            matcher = self._keyword_matcher = KeywordMatcher(keywords)
+        return matcher
+
+    def get_candidate_tweets(self, seed, candidate, candidates, connection):
+        """Returns the latest tweets of `candidate` for the next seed of the step on `seed`.
+        With prescreening, the tweets of the next candidates are fetched at the same time.
+
+        Args:
+            seed (int)
+            candidate (int)
+            candidates (RankedCandidates): the candidates of the step, `candidate` first
+            connection (Connection)
+        Returns:
+            pandas.DataFrame as returned by `get_latest_tweets`
+        """
+        if self.screener is not None:
+            self.screener.start(seed, candidates.upcoming(self.screener.candidates - 1))
+            latest_tweets = self.screener.take(seed, candidate)
+            if latest_tweets is not None:
+                return latest_tweets
+        return get_latest_tweets(candidate, connection, fields=['lang', 'full_text'])
+
     def write_user_details(self, user_details):
         """Writes pandas.DataFrame `user_details` to MySQL table 'user_details'
         """
@@ -834,6 +2259,9 @@ class Coordinator(object):
                                         connection=None, fail=False, **kwargs):
         """Takes a seed and determines the next seed and saves all details collected to db.
 
+        Stages of the step completed before an error (friend list, details, tweets of
+        candidates, follow-back check and claim of the edge) are not repeated on retries.
+
         Args:
             seed (int)
             select (list of str): fields to save to database, defaults to all
@@ -844,6 +2272,39 @@ class Coordinator(object):
             seed (int)
         """
 
+        if connection is None:
+            connection = Connection(token_queue=self.token_queue, lazy=True,
+                                    reset_wheel=self.reset_wheel)
+
+        with connection.lease():
+            new_seed = self._work_through_seed(seed, select=select, status_lang=status_lang,
+                                               connection=connection, fail=fail, **kwargs)
+        self.step_memo.done(seed)
+        if self.screener is not None:
+            self.screener.discard(seed)
+        if self.in_flight is not None:
+            self.in_flight.release(seed)
+
+        return new_seed
+
+    def _work_through_claimed_seed(self, seed, **kwargs):
+        """Works through `seed` like `work_through_seed_get_next_seed` in a thread of
+        `start_collectors`. If the step fails after all retries, its seed is released and its
+        completed stages are forgotten, so that the seed can be walked again next round."""
+
+        try:
+            return self.work_through_seed_get_next_seed(seed=seed, **kwargs)
+        except Exception:
+            self.step_memo.done(seed)
+            if self.screener is not None:
+                self.screener.discard(seed)
+            if self.in_flight is not None:
+                self.in_flight.release(seed)
+            raise
+
+    def _work_through_seed(self, seed, select=[], status_lang=None, connection=None,
+                           fail=False, **kwargs):
+
         # For testing raise of errors while multithreading
         if fail is True:
             raise TestException
@@ -851,6 +2312,17 @@ class Coordinator(object):
         if 'fail_hidden' in kwargs and kwargs['fail_hidden'] is True:
             raise TestException
 
+        # seeds resumed from the journal whose step was interrupted before storing details
+        if seed in self.restart_seeds:
+            self.restart_seeds.discard(seed)
+            kwargs['restart'] = True
+
+        # a retried step that failed after claiming its edge only has to queue the next seed
+        claimed = self.step_memo.lookup(seed, "claimed")
+        if claimed is not None:
+            self.queue_seed(claimed)
+            return claimed
+
         language_check_condition = (
             status_lang is not None and
             'language_threshold' in kwargs and
@@ -861,12 +2333,15 @@ class Coordinator(object):
                              kwargs['keywords'] is not None and
                              len(kwargs['keywords']) > 0)
 
-        if connection is None:
-            connection = Connection(token_queue=self.token_queue)
-
         friends_details = None
         if 'restart' in kwargs and kwargs['restart'] is True:
             print("No db lookup after restart allowed, accessing Twitter API.")
+        elif seed in self.depleted_seeds:
+            new_seed = self.choose_random_new_seed(
+                f'Seed {seed} is depleted. No friends meet conditions. Random new seed.',
+                connection)
+
+            return new_seed
         else:
             try:
                 friends_details = self.lookup_accounts_friend_details(
@@ -881,45 +2356,53 @@ class Coordinator(object):
             if 'restart' in kwargs and kwargs['restart'] is True:
                 pass
             elif language_check_condition or keyword_condition:
-                check_exists_query = f"""
-                                        SELECT EXISTS(
-                                            SELECT source FROM result
-                                            WHERE source={seed}
-                                            )
-                                     """
-                seed_depleted = self.dbh.engine.execute(check_exists_query).scalar()
-
-                if seed_depleted == 1:
+                # walked before, but no unburned friends meeting the conditions are left
+                if seed in self.walked_sources:
+                    self.depleted_seeds.add(int(seed))
                     new_seed = self.choose_random_new_seed(
                         f'Seed {seed} is depleted. No friends meet conditions. Random new seed.',
                         connection)
 
                     return new_seed
 
+            # protected, suspended or deleted before (the seed may be from an older queue)
+            reason = self.unavailable.reason(seed)
+            if reason is not None:
+                return self.choose_random_new_seed(
+                    f"Account {seed} is known to be {reason}, selecting random seed.", connection)
+
             collector = Collector(connection, seed,
                                   following_pages_limit=self.following_pages_limit)
 
+            prefetched = None
+            if self.prefetcher is not None:
+                prefetched = self.prefetcher.take(seed)
+
             try:
-                friend_list = collector.get_friend_list()
-                if 'bootstrap' in kwargs and kwargs['bootstrap'] is True:
-                    follower_list = collector.get_friend_list(follower=True)
+                with connection.lease():
+                    if prefetched is not None:
+                        friend_list, _, prefetched_details = prefetched
+                        self.step_memo.put(seed, "friends", friend_list)
+                        self.step_memo.put(seed, "details", prefetched_details)
+                    else:
+                        friend_list = self.step_memo.get(seed, "friends",
+                                                         collector.get_friend_list)
+                    if 'bootstrap' in kwargs and kwargs['bootstrap'] is True:
+                        follower_list, complete = self.step_memo.get(
+                            seed, "followers",
+                            lambda: (collector.get_friend_list(follower=True),
+                                     collector.last_list_complete))
+                        self.follow_back.add_followers(seed, follower_list, complete=complete)
             except tweepy.error.TweepError as e:  # if account is protected
-                if "Not authorized." in e.reason:
-
-                    new_seed = self.choose_random_new_seed(
-                        "Account {} protected, selecting random seed.".format(seed), connection)
-
-                    return new_seed
-
-                elif "does not exist" in e.reason:
-
-                    new_seed = self.choose_random_new_seed(
-                        f"Account {seed} does not exist. Selecting random seed.", connection)
+                reason = UnavailableAccounts.classify(e)
+                if reason is None:
+                    raise e
+                self.unavailable.add(seed, reason)
 
-                    return new_seed
+                new_seed = self.choose_random_new_seed(
+                    f"Account {seed} is {reason}, selecting random seed.", connection)
 
-                else:
-                    raise e
+                return new_seed
 
             if friend_list == []:  # if account follows nobody
 
@@ -929,14 +2412,20 @@ class Coordinator(object):
                 return new_seed
 
             self.dbh.write_friends(seed, friend_list)
+            self.record("friends_stored", seed)
+
+            with connection.lease():
+                friends_details = self.step_memo.get(seed, "details",
+                                                     lambda: collector.get_details(friend_list))
+                if 'bootstrap' in kwargs and kwargs['bootstrap'] is True:
+                    follower_details = self.step_memo.get(
+                        seed, "follower_details", lambda: collector.get_details(follower_list))
 
-            friends_details = collector.get_details(friend_list)
             select = list(set(select + ["id", "followers_count",
                                         "status_lang", "created_at", "statuses_count"]))
             friends_details = Collector.make_friend_df(friends_details, select)
 
             if 'bootstrap' in kwargs and kwargs['bootstrap'] is True:
-                follower_details = collector.get_details(follower_list)
                 follower_details = Collector.make_friend_df(follower_details, select)
 
             if status_lang is not None:
@@ -961,22 +2450,17 @@ class Coordinator(object):
 
             if 'bootstrap' in kwargs and kwargs['bootstrap'] is True:
                 self.write_user_details(follower_details)
+                # the written details are new seeds without waiting for bootstrap_seed_pool
+                self.seed_pool.add(friends_details['id'].values)
+                self.seed_pool.add(follower_details['id'].values)
 
-        if status_lang is not None and len(friends_details) == 0:
-
-            new_seed = self.seed_pool.sample(n=1)
-            new_seed = new_seed[0].values[0]
-
-            stdout.write(
-                "No user details for friends with last status language '{}' found in db.\n".format(
-                    status_lang))
-            stdout.flush()
+        self.record("details_stored", seed)
 
-            self.token_queue.put(
-                (connection.token, connection.secret,
-                 connection.reset_time_dict, connection.calls_dict))
+        if status_lang is not None and len(friends_details) == 0:
 
-            self.seed_queue.put(new_seed)
+            new_seed = self.choose_random_new_seed(
+                "No user details for friends with last status language '{}' found in db.".format(
+                    status_lang), connection)
 
             return new_seed
 
@@ -987,32 +2471,39 @@ class Coordinator(object):
             if friends_details_db is not None and len(friends_details_db) > 0:
                 friends_details = friends_details_db
 
+        # walking to a known unavailable friend would only end at a random seed
+        friends_details = friends_details[self.unavailable.available(friends_details['id'])]
+        candidates = RankedCandidates(friends_details)
+
+        if len(candidates) == 0:
+            new_seed = self.choose_random_new_seed(
+                f"No available friends left for {seed}, selecting random seed.", connection)
+
+            return new_seed
+
         double_burned = True
 
         while double_burned is True:
-            max_follower_count = friends_details['followers_count'].max()
-
-            new_seed = friends_details[
-                friends_details['followers_count'] == max_follower_count]['id'].values[0]
+            new_seed = candidates.best()
 
             while language_check_condition or keyword_condition:
                 # RETRIEVE AND TEST MORE TWEETS FOR LANGUAGE OR KEYWORDS
                 try:
-                    latest_tweets = get_latest_tweets(new_seed, connection,
-                                                      fields=['lang', 'full_text'])
+                    with connection.lease():
+                        latest_tweets = self.step_memo.get(
+                            seed, f"tweets {new_seed}",
+                            lambda: self.get_candidate_tweets(seed, new_seed, candidates,
+                                                              connection))
                 except tweepy.error.TweepError as e:  # if account is protected
-                    if "Not authorized." in e.reason:
-                        new_seed = self.choose_random_new_seed(
-                            f"Account {new_seed} protected, selecting random seed.", connection)
+                    reason = UnavailableAccounts.classify(e)
+                    if reason is None:
+                        raise e
+                    self.unavailable.add(new_seed, reason)
 
-                        return new_seed
-                    elif "does not exist" in e.reason:
-                        new_seed = self.choose_random_new_seed(
-                            f"Account {seed} does not exist. Selecting random seed.", connection)
+                    new_seed = self.choose_random_new_seed(
+                        f"Account {new_seed} is {reason}, selecting random seed.", connection)
 
-                        return new_seed
-                    else:
-                        raise e
+                    return new_seed
 
                 threshold_met = True  # set true per default and change to False if not met
                 keyword_met = True
@@ -1024,66 +2515,48 @@ class Coordinator(object):
                                         for fraction in language_fractions.values())
 
                 if keyword_condition:
-                    keyword_met = any(latest_tweets['full_text'].str.contains(keyword,
-                                      case=False).any()
-                                      for keyword in kwargs['keywords'])
+                    keyword_met = self.keyword_matcher(kwargs['keywords']).search(
+                        latest_tweets['full_text'])
 
-                # THEN REMOVE FROM friends_details DATAFRAME, SEED POOL,
+                # THEN REMOVE FROM CANDIDATES, SEED POOL,
                 # AND DATABASE IF FALSE POSITIVE
                 # ACCORDING TO THRESHOLD OR KEYWORD
 
                 if threshold_met and keyword_met:
                     break
                 else:
-                    friends_details = friends_details[friends_details['id'] != new_seed]
-
                     print(
                         f'seed pool size before removing not matching seed: {len(self.seed_pool)}')
-                    self.seed_pool = self.seed_pool[self.seed_pool[0] != new_seed]
+                    self.seed_pool.remove(new_seed)
                     print(
                         f'seed pool size after removing not matching seed: {len(self.seed_pool)}')
 
                     # query = f"DELETE from user_details WHERE id = {new_seed}"
                     # self.dbh.engine.execute(query)
 
-                    query = f"DELETE from friends WHERE target = {new_seed}"
-                    self.dbh.engine.execute(query)
+                    self.dbh.remove_friend_target(new_seed)
 
-                    # AND REPEAT THE CHECK
-                    try:
-                        new_seed = friends_details[friends_details['followers_count'] ==
-                                                   max_follower_count]['id'].values[0]
-                    except IndexError:  # no more friends
+                    # AND REPEAT THE CHECK WITH THE NEXT BEST CANDIDATE
+                    new_seed = candidates.reject()
+                    if new_seed is None:  # no more friends
                         new_seed = self.choose_random_new_seed(
                             f'{seed}: No friends meet set conditions. Selecting random.',
                             connection)
 
                         return new_seed
 
-            check_exists_query = """
-                                    SELECT EXISTS(
-                                        SELECT * FROM friends
-                                        WHERE source={source}
-                                        )
-                                 """.format(source=new_seed)
-            node_exists_as_source = self.dbh.engine.execute(check_exists_query).scalar()
-
-            if node_exists_as_source == 1:
-                check_follow_query = """
-                                        SELECT EXISTS(
-                                            SELECT * FROM friends
-                                            WHERE source={source} and target={target}
-                                            )
-                                     """.format(source=new_seed, target=seed)
-
-                follows = self.dbh.engine.execute(check_follow_query).scalar()
-
-            elif node_exists_as_source == 0:
-                # check on Twitter
+            # new_seed is likely the next seed, so start getting its friends already
+            if self.prefetcher is not None and not self.dbh.is_source(new_seed):
+                self.prefetcher.start(new_seed)
+
+            follows = self.follow_back.resolve(source=new_seed, target=seed)
 
-                # FIXTHIS: dirty workaround because of wacky test
-                if connection == "fail":
-                    connection = Connection()
+            if follows is not None:
+                follows = int(follows)
+
+            else:
+                # check on Twitter
+                self.follow_back.count_api_call()
 
                 try:
                     collector
@@ -1091,20 +2564,18 @@ class Coordinator(object):
                     collector = Collector(connection, seed)
 
                 try:
-                    follows = int(collector.check_follows(source=new_seed, target=seed))
+                    with connection.lease():
+                        follows = self.step_memo.get(
+                            seed, f"follows {new_seed}",
+                            lambda: int(collector.check_follows(source=new_seed, target=seed)))
                 except tweepy.TweepError:
                     print(f"Follow back undetermined. User {new_seed} not available")
                     follows = 0
 
             if follows == 0:
 
-                insert_query = f"""
-                    INSERT INTO result (source, target)
-                    VALUES ({seed}, {new_seed})
-                    ON DUPLICATE KEY UPDATE source = source
-                """
-
-                self.dbh.engine.execute(insert_query)
+                self.dbh.write_result([(seed, new_seed)])
+                self.walked_sources.add([seed])
 
                 print('\nno follow back: added ({seed})-->({new_seed})'.format(
                     seed=seed, new_seed=new_seed
@@ -1112,34 +2583,20 @@ class Coordinator(object):
 
             if follows == 1:
 
-                insert_query = f"""
-                    INSERT INTO result (source, target)
-                    VALUES
-                        ({seed}, {new_seed}),
-                        ({new_seed}, {seed})
-                    ON DUPLICATE KEY UPDATE source = source
-                """
-
-                self.dbh.engine.execute(insert_query)
+                self.dbh.write_result([(seed, new_seed), (new_seed, seed)])
+                self.walked_sources.add([seed, new_seed])
 
                 print('\nfollow back: added ({seed})<-->({new_seed})'.format(
                     seed=seed, new_seed=new_seed
                 ))
 
-            update_query = """
-                            UPDATE friends
-                            SET burned=1
-                            WHERE source={source} AND target={target} AND burned = 0
-                           """.format(source=seed, target=new_seed)
-
-            update_result = self.dbh.engine.execute(update_query)
+            self.record("result_written", seed, new_seed)
 
-            if update_result.rowcount == 0:
+            if not self.dbh.burn_friend(seed, new_seed):
                 print(f"Connection ({seed})-->({new_seed}) was burned already.")
-                friends_details = self.lookup_accounts_friend_details(
-                    seed, self.dbh.engine)
 
-                if friends_details is None or len(friends_details) == 0:
+                # e.g. claimed by another walker, the other candidates are still unburned
+                if candidates.reject() is None:
                     new_seed = self.choose_random_new_seed(
                         f"No friends or unburned connections left for {seed}, selecting random.",
                         connection)
@@ -1148,13 +2605,11 @@ class Coordinator(object):
 
             else:
                 print(f"burned ({seed})-->({new_seed})")
+                self.step_memo.put(seed, "claimed", new_seed)
+                self.record("edge_claimed", seed, new_seed)
                 double_burned = False
 
-        self.token_queue.put(
-            (connection.token, connection.secret,
-             connection.reset_time_dict, connection.calls_dict))
-
-        self.seed_queue.put(new_seed)
+        self.queue_seed(new_seed)
 
         return new_seed
 
@@ -1183,6 +2638,9 @@ class Coordinator(object):
         if number_of_seeds is None:
             number_of_seeds = self.number_of_seeds
 
+        if keywords is not None and len(keywords) > 0:
+            self.keyword_matcher(keywords)  # raises an error for invalid keywords right away
+
         processes = []
         seed_list = []
 
@@ -1190,9 +2648,13 @@ class Coordinator(object):
 
         for i in range(number_of_seeds):
             seed = self.seed_queue.get()
+            if self.in_flight is not None:
+                seed = self.in_flight.claim(seed)
+                if seed is None:  # merged with a walk of this round
+                    continue
             seed_list += [seed]
             print("seed ", i, ": ", seed)
-            processes.append(MyProcess(target=self.work_through_seed_get_next_seed,
+            processes.append(MyProcess(target=self._work_through_claimed_seed,
                                        kwargs={'seed': seed,
                                                'select': select,
                                                'status_lang': status_lang,
@@ -1207,10 +2669,87 @@ class Coordinator(object):
 
         latest_seeds = pd.DataFrame(seed_list)
 
-        latest_seeds.to_csv('latest_seeds.csv', index=False, header=False)
+        latest_seeds.to_csv(self.latest_seeds_file, index=False, header=False)
+
+        if self.token_state is not None:
+            self.token_state.save()
 
         for p in processes:
             p.start()
             print(f"Thread {p.name} started.")
 
         return processes
+
+    def start_walkers(self, stop, number_of_walkers=None, max_steps=None, restart=False,
+                      fail=False, bootstrap=False, latest_start_time=0, **step_kwargs):
+        """Starts `number_of_walkers` long-running Walker threads taking seeds from
+        `self.seed_queue` until `stop` is set.
+
+        Args:
+            stop (mp.Event): event to set to let the walkers stop after their current step
+            number_of_walkers (int): Defaults to `self.number_of_seeds`
+            max_steps (int): number of steps after which each walker ends, None for unlimited
+            restart (bool): whether the first step of each walker continues after a restart
+            fail (bool): dev only, let the first step of each walker raise a TestException
+            bootstrap (bool): whether to bootstrap the seed pool first and at every step
+            latest_start_time (float): start time of the last run, for bootstrapping
+            **step_kwargs: further arguments for `work_through_seed_get_next_seed`,
+                           e.g. `select`, `status_lang`, `retries` or `keywords`
+        Returns:
+            list of Walker
+        """
+
+        if bootstrap is True:
+
+            if restart is True:
+                latest_start_time = 0
+
+            self.bootstrap_seed_pool(after_timestamp=latest_start_time)
+
+        if number_of_walkers is None:
+            number_of_walkers = self.number_of_seeds
+
+        keywords = step_kwargs.get('keywords')
+        if keywords is not None and len(keywords) > 0:
+            self.keyword_matcher(keywords)  # raises an error for invalid keywords right away
+
+        step_kwargs = dict(step_kwargs, bootstrap=bootstrap, restart=False, fail=False)
+        first_step_kwargs = {'restart': restart, 'fail': fail}
+
+        walkers = [Walker(self, stop, step_kwargs=step_kwargs,
+                          first_step_kwargs=first_step_kwargs, max_steps=max_steps,
+                          name=str(i))
+                   for i in range(number_of_walkers)]
+
+        self.save_latest_seeds(walkers)
+
+        for walker in walkers:
+            walker.start()
+
+        print(f"Started {len(walkers)} walkers.")
+
+        return walkers
+
+    def save_latest_seeds(self, walkers=[]):
+        """Writes the seeds `walkers` work on, the seeds waiting in `self.seed_queue` and those
+        waiting for a retry to `self.latest_seeds_file` (latest_seeds.csv), to restart from.
+        Also saves the rate limit state of the tokens.
+        """
+
+        if self.token_state is not None:
+            self.token_state.save()
+
+        if self.coordination is not None:
+            seed_list = self.coordination.seeds()
+        else:
+            with self.seed_queue.mutex:
+                seed_list = list(self.seed_queue.queue)
+
+            seed_list += [walker.current_seed for walker in walkers
+                          if walker.current_seed is not None]
+            seed_list += self.retry_scheduler.pending()
+
+        if len(seed_list) == 0:  # do not lose the seeds of the last save
+            return
+
+        pd.DataFrame(seed_list).to_csv(self.latest_seeds_file, index=False, header=False)
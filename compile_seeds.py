@@ -0,0 +1,35 @@
+# Compiles seeds into seeds.npy, a sorted and deduplicated int64 array that is memory-mapped
+# at startup instead of parsing seeds.csv (see FileImport.read_seeds). Run it again after
+# changing seeds.csv, otherwise the newer csv file is read.
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from setup import FileImport
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compile seeds for fast loading.')
+    parser.add_argument('-i', '--input', default="seeds.csv",
+                        help="csv file with one seed per line. Default: seeds.csv")
+    parser.add_argument('-o', '--output', default="seeds.npy",
+                        help="compiled seed file. Default: seeds.npy")
+    parser.add_argument('--user-details', action="store_true",
+                        help="also add all accounts of the user_details table of the database")
+    args = parser.parse_args()
+
+    # read in chunks to keep the memory use low for millions of seeds
+    seeds = [np.unique(chunk[0].values.astype(np.int64))
+             for chunk in pd.read_csv(args.input, header=None, chunksize=10**6)]
+
+    if args.user_details:
+        from database_handler import DataBaseHandler
+        dbh = DataBaseHandler(create_all=False)
+        seeds += [np.unique(chunk['id'].values.astype(np.int64))
+                  for chunk in pd.read_sql("SELECT id FROM user_details", dbh.engine,
+                                           chunksize=10**6)]
+
+    number = FileImport().write_compiled_seed_file(np.concatenate(seeds), args.output)
+
+    print(f"Wrote {number} seeds to {args.output}.")
@@ -0,0 +1,251 @@
+import json
+import os
+import queue
+import random
+import socket
+import sqlite3 as lite
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+class CrawlCoordination(object):
+    """Lets several nodes (machines or processes) walk one crawl in a shared database.
+
+    Tokens and walks are rows of the tables `token_leases` and `seed_leases` (see
+    `DataBaseHandler.create_coordination_tables`). A node leases a row by writing its name and
+    an expiry time into it, so that each token and each walk is used by one node at a time.
+    While a node runs, a heartbeat thread extends the leases it holds. If a node dies, its
+    leases expire after `lease_time` seconds and other nodes take over its tokens and walks.
+
+    `seed_queue` and `token_queue` can be used in place of the queues of a Coordinator.
+
+    Attributes:
+        dbh (database_handler.DataBaseHandler)
+        node (str): name of this node, defaults to "<host name>-<process id>"
+        lease_time (float): seconds after which leases of a node without heartbeat expire
+        heartbeat_interval (float): seconds between heartbeats
+    """
+
+    def __init__(self, dbh, node=None, lease_time=60, heartbeat_interval=15):
+        self.dbh = dbh
+        self.node = node if node is not None else f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_time = lease_time
+        self.heartbeat_interval = heartbeat_interval
+
+        self.sqlite = dbh.config.dbtype.lower() == "sqlite"
+        if self.sqlite:
+            # an own connection, because leases are taken from several threads
+            self.connection = lite.connect(dbh.config.dbname + ".db", check_same_thread=False,
+                                           timeout=30)
+        else:
+            self.connection = dbh.engine
+        self.lock = threading.Lock()
+
+        dbh.create_coordination_tables()
+
+        self.seed_queue = LeasedSeedQueue(self)
+        self.token_queue = LeasedTokenQueue(self)
+
+        self._stop = threading.Event()
+        self._heartbeat_thread = None
+
+    def execute(self, query, parameters=(), fetch=False):
+        """Executes `query` with %s placeholders for `parameters`.
+
+        Returns:
+            list of rows if `fetch`, else the number of changed rows
+        """
+        if self.sqlite:
+            query = query.replace("%s", "?")
+            with self.lock:
+                cursor = self.connection.execute(query, parameters)
+                result = cursor.fetchall() if fetch else cursor.rowcount
+                self.connection.commit()
+            return result
+        result = self.connection.execute(query, parameters)
+        return result.fetchall() if fetch else result.rowcount
+
+    def insert_ignore(self):
+        return "INSERT OR IGNORE" if self.sqlite else "INSERT IGNORE"
+
+    def join(self, seeds=[], tokens=None):
+        """Registers this node, adds `tokens` that are not shared yet and adds `seeds` if the
+        crawl has no walks yet. Then starts the heartbeat.
+
+        Args:
+            seeds (list of int): seeds to start the walks of a new crawl with
+            tokens (pandas.DataFrame): tokens with columns `token` and `secret`
+        Returns:
+            Nothing
+        """
+        now = time.time()
+        if self.execute("UPDATE crawl_nodes SET heartbeat = %s WHERE node = %s",
+                        (now, self.node)) == 0:
+            self.execute("INSERT INTO crawl_nodes (node, host, pid, joined, heartbeat) "
+                         "VALUES (%s, %s, %s, %s, %s)",
+                         (self.node, socket.gethostname(), os.getpid(), now, now))
+
+        if tokens is not None:
+            for token, secret in tokens.values:
+                self.execute(f"{self.insert_ignore()} INTO token_leases (token, secret, state) "
+                             "VALUES (%s, %s, %s)",
+                             (token, secret, json.dumps([{}, {}])))
+
+        if self.execute("SELECT COUNT(*) FROM seed_leases", fetch=True)[0][0] == 0:
+            for seed in seeds:
+                self.execute("INSERT INTO seed_leases (seed) VALUES (%s)", (int(seed),))
+
+        if self._heartbeat_thread is None:
+            self._heartbeat_thread = threading.Thread(target=self._beat, daemon=True,
+                                                      name=f"heartbeat {self.node}")
+            self._heartbeat_thread.start()
+
+    def heartbeat(self):
+        """Marks this node as alive and extends its leases."""
+        now = time.time()
+        self.execute("UPDATE crawl_nodes SET heartbeat = %s WHERE node = %s", (now, self.node))
+        for table in ["token_leases", "seed_leases"]:
+            self.execute(f"UPDATE {table} SET expires = %s WHERE node = %s",
+                         (now + self.lease_time, self.node))
+
+    def _beat(self):
+        while not self._stop.wait(timeout=self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"Heartbeat of node {self.node} failed: {e}")
+
+    def leave(self):
+        """Stops the heartbeat, gives up all leases of this node and unregisters it."""
+        self._stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+        for table in ["token_leases", "seed_leases"]:
+            self.execute(f"UPDATE {table} SET node = NULL WHERE node = %s", (self.node,))
+        self.execute("DELETE FROM crawl_nodes WHERE node = %s", (self.node,))
+        self._stop.clear()
+
+    def claim(self, table, key, order):
+        """Leases the first free or expired row of `table` in `order`.
+
+        Returns:
+            the `key` of the leased row, or None if all rows are leased
+        """
+        now = time.time()
+        candidates = self.execute(f"SELECT {key} FROM {table} "
+                                  "WHERE node IS NULL OR expires < %s "
+                                  f"ORDER BY {order} LIMIT 10", (now,), fetch=True)
+        for (candidate,) in candidates:
+            # only succeeds if no other node leased the row in the meantime
+            if self.execute(f"UPDATE {table} SET node = %s, expires = %s "
+                            f"WHERE {key} = %s AND (node IS NULL OR expires < %s)",
+                            (self.node, now + self.lease_time, candidate, now)) == 1:
+                return candidate
+        return None
+
+    def seeds(self):
+        """Returns the current seeds of all walks (list of int)."""
+        return [seed for (seed,) in self.execute("SELECT seed FROM seed_leases ORDER BY id",
+                                                 fetch=True)]
+
+    def nodes(self):
+        """Returns the nodes taking part in the crawl as list of (node, heartbeat) tuples."""
+        return self.execute("SELECT node, heartbeat FROM crawl_nodes ORDER BY node", fetch=True)
+
+
+class LeasedQueue(ABC):
+    """Base of the queue-like views of the leases of a CrawlCoordination.
+
+    Attributes:
+        poll_interval (float): seconds to wait before asking the database again if all items
+                               are leased, doubled after every futile try up to
+                               `max_poll_interval`
+    """
+
+    poll_interval = 0.5
+    max_poll_interval = 8
+
+    def __init__(self, coordination):
+        self.coordination = coordination
+
+    @abstractmethod
+    def claim(self):
+        """Leases a free item. Returns None if all items are leased."""
+
+    def get(self, block=True, timeout=None):
+        """Leases an item like `queue.Queue.get`, polling the database with exponential backoff
+        until one is free."""
+        deadline = None if timeout is None else time.time() + timeout
+        interval = self.poll_interval
+        while True:
+            item = self.claim()
+            if item is not None:
+                return item
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise queue.Empty
+            if deadline is not None:
+                interval = min(interval, deadline - time.time())
+            time.sleep(max(0, interval) * random.uniform(0.5, 1))
+            interval = min(2 * interval, self.max_poll_interval)
+
+
+class LeasedTokenQueue(LeasedQueue):
+    """Token queue of a CrawlCoordination: `get` leases a token, `put` returns it together
+    with its rate limit state."""
+
+    def claim(self):
+        token = self.coordination.claim("token_leases", "token", "expires")
+        if token is None:
+            return None
+        secret, state = self.coordination.execute(
+            "SELECT secret, state FROM token_leases WHERE token = %s", (token,), fetch=True)[0]
+        reset_time_dict, calls_dict = json.loads(state)
+        return token, secret, reset_time_dict, calls_dict
+
+    def put(self, token):
+        token, secret, reset_time_dict, calls_dict = token
+        # expires is the time of release, so that the least recently used token is leased next
+        self.coordination.execute(
+            "UPDATE token_leases SET state = %s, node = NULL, expires = %s WHERE token = %s",
+            (json.dumps([reset_time_dict, calls_dict]), time.time(), token))
+
+    def qsize(self):
+        return self.coordination.execute(
+            "SELECT COUNT(*) FROM token_leases WHERE node IS NULL OR expires < %s",
+            (time.time(),), fetch=True)[0][0]
+
+
+class LeasedSeedQueue(LeasedQueue):
+    """Seed queue of a CrawlCoordination: `get` leases a walk and returns its seed. The next
+    `put` of the same thread moves that walk on to the put seed and frees it."""
+
+    def __init__(self, coordination):
+        super().__init__(coordination)
+        self.local = threading.local()
+
+    def claim(self):
+        walk = self.coordination.claim("seed_leases", "id", "id")
+        if walk is None:
+            return None
+        self.local.walk = walk
+        return self.coordination.execute("SELECT seed FROM seed_leases WHERE id = %s",
+                                         (walk,), fetch=True)[0][0]
+
+    def put(self, seed):
+        walk = getattr(self.local, 'walk', None)
+        self.local.walk = None
+        if walk is None:
+            self.coordination.execute("INSERT INTO seed_leases (seed) VALUES (%s)", (int(seed),))
+        elif self.coordination.execute(
+                "UPDATE seed_leases SET seed = %s, node = NULL, expires = NULL "
+                "WHERE id = %s AND node = %s",
+                (int(seed), walk, self.coordination.node)) == 0:
+            print(f"Lease of walk {walk} expired and was taken over by another node, "
+                  f"dropping its next seed {seed}.")
+
+    def qsize(self):
+        return self.coordination.execute(
+            "SELECT COUNT(*) FROM seed_leases WHERE node IS NULL OR expires < %s",
+            (time.time(),), fetch=True)[0][0]
@@ -1,13 +1,21 @@
 import sqlite3 as lite
+import time
 import uuid
 from sqlite3 import Error
 
+import numpy as np
 import pandas as pd
 from sqlalchemy import create_engine
 from sqlalchemy.exc import OperationalError
 
+from helpers import pack_ids, unpack_ids
+from seed_pool import SeedPool
 from setup import Config
 
+# Estimated bytes per edge in the InnoDB friends table: row header, transaction fields and
+# the data of one row plus one entry each in the unique (source, target) and timestamp index.
+ROWS_BYTES_PER_EDGE = 87
+
 
 class DataBaseHandler():
     def __init__(self, config_path: str = "config.yml", config_dict: dict = None,
@@ -29,10 +37,12 @@ class DataBaseHandler():
         # Prepare user_details configured in config.yml for user_details table creation
         self.config = Config(config_path, config_dict)
         user_details_list = []
+        self.user_details_columns = []
         if "twitter_user_details" in self.config.config:
             for detail, sqldatatype in self.config.config["twitter_user_details"].items():
                 if sqldatatype is not None:
                     user_details_list.append(detail + " " + sqldatatype)
+                    self.user_details_columns.append(detail)
         else:
             print("""Key "twitter_user_details" could not be found in config.yml. Will not create
                   a user_details table.""")
@@ -77,6 +87,7 @@ class DataBaseHandler():
                         create_ud_index = "CREATE INDEX iUTimestamp ON user_details(timestamp)"
                         c.execute(create_user_details_sql)
                         c.execute(create_ud_index)
+                        self.create_nodes_table(user_details_list)
                     else:
                         # TODO: Make this a minimal user_details table?
                         print("""No user_details configured in config.yml. Will not create a
@@ -121,12 +132,254 @@ class DataBaseHandler():
                             DEFAULT CURRENT_TIMESTAMP,
                             INDEX(timestamp));"""
                         self.engine.execute(create_user_details_sql)
+                        self.create_nodes_table(user_details_list)
                     else:
                         print("""No user_details configured in config.yml. Will not create a
                               user_details table.""")
                 except OperationalError as e:
                     raise e
 
+        self.friends_storage = self.config.friends_storage
+        # optional in-memory adjacency.FriendsAdjacency answering friends lookups
+        self.adjacency = None
+        # optional in-memory set of the sources of the friends table (see load_source_index)
+        self.source_index = None
+        # sorted targets of friends_removed, read on first use (see read_removed_targets)
+        self.removed_targets = None
+        if create_all and self.friends_storage == "packed":
+            self.create_packed_friends_tables()
+        if create_all:
+            self.create_unavailable_accounts_table()
+
+        self.nodes_enabled = self.table_type("nodes") == "table"
+
+    def table_type(self, name: str):
+        """Checks whether a table or view called `name` exists in the database.
+
+        Args:
+            name (str): Name of the table or view.
+        Returns:
+            "table", "view" or None if nothing with this name exists.
+        """
+        if self.config.dbtype.lower() == "mysql":
+            query = f"""SELECT TABLE_TYPE FROM information_schema.TABLES
+                        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{name}'"""
+        elif self.config.dbtype.lower() == "sqlite":
+            query = f"SELECT type FROM sqlite_master WHERE name = '{name}'"
+        row = self.engine.execute(query).fetchone()
+        if row is None:
+            return None
+        return "view" if "view" in row[0].lower() else "table"
+
+    def timestamp_after(self, timestamp, column: str = "timestamp", inclusive: bool = False):
+        """Returns a condition selecting rows with `column` after `timestamp`.
+
+        The timestamp is converted to the column type instead of converting the column (as
+        `UNIX_TIMESTAMP(column) > timestamp` would), so that an index on the column is used.
+
+        Args:
+            timestamp (float): seconds since epoch
+            column (str): timestamp or datetime column. Defaults to "timestamp"
+            inclusive (bool): whether rows at `timestamp` are selected as well
+        Returns:
+            str
+        """
+        operator = ">=" if inclusive else ">"
+        return f"{column} {operator} {self.from_unixtime(timestamp)}"
+
+    def from_unixtime(self, timestamp):
+        """Returns an expression converting `timestamp` (seconds since epoch) to a timestamp."""
+        if self.config.dbtype.lower() == "mysql":
+            return f"FROM_UNIXTIME({float(timestamp)})"
+        elif self.config.dbtype.lower() == "sqlite":
+            return f"datetime({float(timestamp)}, 'unixepoch')"
+
+    def unix_timestamp(self, column: str = "timestamp"):
+        """Returns an expression converting `column` to seconds since epoch, to select it.
+        Use `timestamp_after` in conditions instead."""
+        if self.config.dbtype.lower() == "mysql":
+            return f"UNIX_TIMESTAMP({column})"
+        elif self.config.dbtype.lower() == "sqlite":
+            return f"CAST(strftime('%s', {column}) AS INTEGER)"
+
+    def get_latest_start_time(self) -> float:
+        """Returns the start time recorded by `set_latest_start_time` (seconds since epoch),
+        0 if none is recorded."""
+        if self.table_type("timetable") is None:
+            return 0
+        row = self.engine.execute("SELECT latest_start_time FROM timetable").fetchone()
+        return 0 if row is None else float(row[0])
+
+    def set_latest_start_time(self, timestamp: float):
+        """Records `timestamp` (seconds since epoch) as the start time of the current run."""
+        if self.config.dbtype.lower() == "mysql":
+            # DOUBLE keeps the fractional seconds compared with timestamp columns
+            self.engine.execute("CREATE TABLE IF NOT EXISTS timetable "
+                                "(latest_start_time DOUBLE NOT NULL)")
+        elif self.config.dbtype.lower() == "sqlite":
+            self.engine.execute("CREATE TABLE IF NOT EXISTS timetable "
+                                "(latest_start_time REAL NOT NULL)")
+        self.engine.execute("DELETE FROM timetable")
+        self.engine.execute(f"INSERT INTO timetable (latest_start_time) VALUES ({timestamp})")
+        if self.config.dbtype.lower() == "sqlite":
+            self.engine.commit()
+
+    def create_nodes_table(self, user_details_list: list):
+        """Creates the `nodes` table, a materialised copy of the user details of all accounts
+        that appear in `result`. It replaces the `nodes` view of `create_node_view.sql`, which
+        is dropped if it exists. The column `updated_at` changes whenever a node is added or
+        its details change and serves as a watermark for `get_changed_nodes`.
+        If the table is created for the first time, it is filled with all nodes collected so far.
+
+        Args:
+            user_details_list (list of str): column definitions of the user_details table
+        Returns:
+            Nothing
+        """
+        if self.table_type("nodes") == "view":
+            print("Replacing view 'nodes' with a materialised nodes table.")
+            self.engine.execute("DROP VIEW nodes")
+        new_table = self.table_type("nodes") is None
+
+        if self.config.dbtype.lower() == "mysql":
+            create_nodes_sql = """
+                CREATE TABLE IF NOT EXISTS nodes
+                (""" + ", ".join(user_details_list) + """, timestamp TIMESTAMP NULL,
+                updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+                ON UPDATE CURRENT_TIMESTAMP(6),
+                INDEX(updated_at));"""
+            self.engine.execute(create_nodes_sql)
+        elif self.config.dbtype.lower() == "sqlite":
+            create_nodes_sql = """
+                CREATE TABLE IF NOT EXISTS nodes
+                (""" + ", ".join(user_details_list) + """, timestamp DATETIME,
+                 updated_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')));"""
+            c = self.engine.cursor()
+            c.execute(create_nodes_sql)
+            c.execute("CREATE INDEX IF NOT EXISTS iNUpdatedAt ON nodes(updated_at)")
+
+        if new_table:
+            self.rebuild_nodes()
+
+    def _upsert_nodes_query(self, condition: str) -> str:
+        """Returns the query copying the rows of user_details matching `condition` into the
+        nodes table.
+
+        Rows whose user details equal those of the node already are skipped (a new timestamp
+        alone does not count as change), so that `updated_at` only changes for nodes that were
+        added or changed.
+        """
+        columns = ", ".join(self.user_details_columns + ["timestamp"])
+        selected = ", ".join(f"u.{column}" for column in self.user_details_columns + ["timestamp"])
+
+        if self.config.dbtype.lower() == "mysql":
+            same = " AND ".join(["n.id = u.id"] + [f"n.{column} <=> u.{column}"
+                                                   for column in self.user_details_columns])
+            updates = ", ".join(f"{column} = VALUES({column})"
+                                for column in self.user_details_columns + ["timestamp"])
+            query = f"""
+                INSERT INTO nodes ({columns})
+                SELECT {selected} FROM user_details u
+                WHERE ({condition})
+                AND NOT EXISTS (SELECT 1 FROM nodes n WHERE {same})
+                ON DUPLICATE KEY UPDATE {updates}
+            """
+        elif self.config.dbtype.lower() == "sqlite":
+            same = " AND ".join(["n.id = u.id"] + [f"n.{column} IS u.{column}"
+                                                   for column in self.user_details_columns])
+            query = f"""
+                INSERT OR REPLACE INTO nodes ({columns})
+                SELECT {selected} FROM user_details u
+                WHERE ({condition})
+                AND NOT EXISTS (SELECT 1 FROM nodes n WHERE {same})
+            """
+
+        return query
+
+    def rebuild_nodes(self):
+        """Fills the nodes table with the details of all accounts in `result`, i.e. does
+        what the `nodes` view did on every query. Only needed once for databases that were
+        created before the nodes table existed, afterwards `write_result` keeps it up to date.
+        Also catches up on user details that were rewritten in bulk.
+        """
+        self.engine.execute(self._upsert_nodes_query(
+            "u.id IN (SELECT source FROM result UNION SELECT target FROM result)"))
+
+    def refresh_nodes(self, ids):
+        """Updates the nodes table for the accounts in `ids`.
+
+        Args:
+            ids (list of int): Twitter IDs whose user details were (re-)written
+        Returns:
+            Nothing
+        """
+        if not self.nodes_enabled or len(ids) == 0:
+            return
+
+        ids = ", ".join(str(int(twitter_id)) for twitter_id in set(ids))
+        self.engine.execute(self._upsert_nodes_query(f"u.id IN ({ids})"))
+
+    def write_result(self, edges):
+        """Adds `edges` to `result` and refreshes the nodes of their accounts in the same
+        transaction.
+
+        Args:
+            edges (list of (int, int)): (source, target) pairs
+        Returns:
+            Nothing
+        """
+        ids = ", ".join(str(twitter_id) for twitter_id in
+                        sorted({int(twitter_id) for edge in edges for twitter_id in edge}))
+        upsert_nodes = self._upsert_nodes_query(f"u.id IN ({ids})")
+
+        if self.config.dbtype.lower() == "mysql":
+            values = ", ".join(f"({int(source)}, {int(target)})" for source, target in edges)
+            with self.engine.begin() as connection:
+                connection.execute(f"""INSERT INTO result (source, target) VALUES {values}
+                                       ON DUPLICATE KEY UPDATE source = source""")
+                if self.nodes_enabled:
+                    connection.execute(upsert_nodes)
+        elif self.config.dbtype.lower() == "sqlite":
+            with self.engine:  # commits, or rolls back on an error
+                # without the unique index of MySQL, duplicates are checked for each edge
+                for source, target in edges:
+                    self.engine.execute(f"""INSERT INTO result (source, target)
+                                            SELECT {int(source)}, {int(target)}
+                                            WHERE NOT EXISTS (SELECT 1 FROM result
+                                                              WHERE source = {int(source)}
+                                                              AND target = {int(target)})""")
+                if self.nodes_enabled:
+                    self.engine.execute(upsert_nodes)
+
+    def get_changed_nodes(self, since=None, settle: float = 1):
+        """Returns all nodes that were added or changed after the watermark `since`.
+
+        Rows younger than `settle` seconds are left for the next call, so that writes of
+        concurrent walkers that commit slightly out of order are not skipped.
+
+        Args:
+            since (str): watermark as returned by the last call, None to get all nodes
+            settle (float): seconds to wait before a change is handed out
+        Returns:
+            tuple of pandas.DataFrame with the changed nodes and the new watermark (str)
+        """
+        if self.config.dbtype.lower() == "mysql":
+            upper = f"NOW(6) - INTERVAL {int(settle * 1e6)} MICROSECOND"
+        elif self.config.dbtype.lower() == "sqlite":
+            upper = f"strftime('%Y-%m-%d %H:%M:%f', 'now', '-{settle} seconds')"
+
+        query = f"SELECT * FROM nodes WHERE updated_at <= {upper}"
+        if since is not None:
+            query += f" AND updated_at > '{since}'"
+        query += " ORDER BY updated_at"
+
+        changed = pd.read_sql(query, self.engine)
+
+        if len(changed) > 0:
+            since = str(changed['updated_at'].iloc[-1])
+
+        return changed, since
+
     def make_temp_tbl(self, type: str = "user_details"):
         """Creates a new temporary table with a random name consisting of a temp_ prefix
            and a uid. The structure of the table depends on the chosen type param. The
@@ -150,6 +403,146 @@ class DataBaseHandler():
         self.engine.execute(create_temp_tbl_sql)
         return temp_tbl_name
 
+    def create_packed_friends_tables(self):
+        """Creates the tables for the "packed" friends storage layout:
+
+        - friends_packed: one row per source with its friend list as blob (see `pack_ids`),
+        - friends_burned: the burned (source, target) connections,
+        - friends_removed: targets that were removed from all friend lists.
+        """
+        if self.config.dbtype.lower() == "mysql":
+            self.engine.execute("""CREATE TABLE IF NOT EXISTS friends_packed (
+                                     source BIGINT NOT NULL PRIMARY KEY,
+                                     size INT NOT NULL,
+                                     ids LONGBLOB NOT NULL,
+                                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                                     ON UPDATE CURRENT_TIMESTAMP,
+                                     INDEX(timestamp)
+                                   );""")
+            self.engine.execute("""CREATE TABLE IF NOT EXISTS friends_burned (
+                                     source BIGINT NOT NULL,
+                                     target BIGINT NOT NULL,
+                                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                     UNIQUE INDEX bedge (source, target),
+                                     INDEX(timestamp)
+                                   );""")
+            self.engine.execute("""CREATE TABLE IF NOT EXISTS friends_removed (
+                                     target BIGINT NOT NULL PRIMARY KEY
+                                   );""")
+        elif self.config.dbtype.lower() == "sqlite":
+            c = self.engine.cursor()
+            c.execute("""CREATE TABLE IF NOT EXISTS friends_packed (
+                           source BIGINT NOT NULL PRIMARY KEY,
+                           size INT NOT NULL,
+                           ids BLOB NOT NULL,
+                           timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                         );""")
+            c.execute("""CREATE TABLE IF NOT EXISTS friends_burned (
+                           source BIGINT NOT NULL,
+                           target BIGINT NOT NULL,
+                           timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                           UNIQUE (source, target)
+                         );""")
+            c.execute("CREATE INDEX IF NOT EXISTS iBTimestamp ON friends_burned(timestamp);")
+            c.execute("""CREATE TABLE IF NOT EXISTS friends_removed (
+                           target BIGINT NOT NULL PRIMARY KEY
+                         );""")
+
+    def create_unavailable_accounts_table(self):
+        """Creates the table `unavailable_accounts` of protected, suspended or deleted accounts
+        with the reason (see collector.UnavailableAccounts) and the unix timestamp until which
+        they are not tried again.
+        """
+        self.engine.execute("""CREATE TABLE IF NOT EXISTS unavailable_accounts (
+                                 id BIGINT NOT NULL PRIMARY KEY,
+                                 reason VARCHAR(16) NOT NULL,
+                                 expires DOUBLE NOT NULL
+                               );""")
+        if self.config.dbtype.lower() == "sqlite":
+            self.engine.commit()
+
+    def write_unavailable_account(self, account, reason: str, expires: float):
+        """Records `account` as unavailable for `reason` until `expires` (seconds since epoch)."""
+        if self.config.dbtype.lower() == "mysql":
+            query = "REPLACE INTO unavailable_accounts (id, reason, expires) VALUES "
+        elif self.config.dbtype.lower() == "sqlite":
+            query = "INSERT OR REPLACE INTO unavailable_accounts (id, reason, expires) VALUES "
+        self.engine.execute(query + f"({int(account)}, '{reason}', {float(expires)})")
+        if self.config.dbtype.lower() == "sqlite":
+            self.engine.commit()
+
+    def read_unavailable_accounts(self, now: float = None):
+        """Reads the accounts that are unavailable after `now` (defaults to the current time)
+        and deletes the expired ones.
+
+        Returns:
+            pandas.DataFrame with columns id, reason and expires
+        """
+        if now is None:
+            now = time.time()
+        self.engine.execute(f"DELETE FROM unavailable_accounts WHERE expires <= {float(now)}")
+        if self.config.dbtype.lower() == "sqlite":
+            self.engine.commit()
+        return pd.read_sql("SELECT id, reason, expires FROM unavailable_accounts", self.engine)
+
+    def create_coordination_tables(self):
+        """Creates the tables through which several nodes coordinate one crawl
+        (see coordination.CrawlCoordination):
+
+        - crawl_nodes: the nodes taking part with their latest heartbeat,
+        - token_leases: the tokens shared by all nodes, with their rate limit state and the node
+          leasing them until `expires`,
+        - seed_leases: one row per walk with its current seed and the node leasing it.
+
+        Times are unix timestamps.
+        """
+        if self.config.dbtype.lower() == "mysql":
+            self.engine.execute("""CREATE TABLE IF NOT EXISTS crawl_nodes (
+                                     node VARCHAR(64) NOT NULL PRIMARY KEY,
+                                     host VARCHAR(255),
+                                     pid INT,
+                                     joined DOUBLE,
+                                     heartbeat DOUBLE
+                                   );""")
+            self.engine.execute("""CREATE TABLE IF NOT EXISTS token_leases (
+                                     token VARCHAR(255) NOT NULL PRIMARY KEY,
+                                     secret VARCHAR(255) NOT NULL,
+                                     state TEXT,
+                                     node VARCHAR(64),
+                                     expires DOUBLE,
+                                     INDEX(expires)
+                                   );""")
+            self.engine.execute("""CREATE TABLE IF NOT EXISTS seed_leases (
+                                     id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                                     seed BIGINT NOT NULL,
+                                     node VARCHAR(64),
+                                     expires DOUBLE,
+                                     INDEX(node)
+                                   );""")
+        elif self.config.dbtype.lower() == "sqlite":
+            c = self.engine.cursor()
+            c.execute("""CREATE TABLE IF NOT EXISTS crawl_nodes (
+                           node VARCHAR(64) NOT NULL PRIMARY KEY,
+                           host VARCHAR(255),
+                           pid INT,
+                           joined DOUBLE,
+                           heartbeat DOUBLE
+                         );""")
+            c.execute("""CREATE TABLE IF NOT EXISTS token_leases (
+                           token VARCHAR(255) NOT NULL PRIMARY KEY,
+                           secret VARCHAR(255) NOT NULL,
+                           state TEXT,
+                           node VARCHAR(64),
+                           expires DOUBLE
+                         );""")
+            c.execute("""CREATE TABLE IF NOT EXISTS seed_leases (
+                           id INTEGER PRIMARY KEY AUTOINCREMENT,
+                           seed BIGINT NOT NULL,
+                           node VARCHAR(64),
+                           expires DOUBLE
+                         );""")
+            self.engine.commit()
+
     def write_friends(self, seed, friendlist):
         """Writes the database entries for one user and their friends in format user, friends.
         Note that the database is appended by the new entries, and that no entries will be deleted
@@ -161,6 +554,18 @@ class DataBaseHandler():
         Returns:
             Nothing
         """
+        if self.adjacency is not None:
+            self.adjacency.add_friends(seed, friendlist)
+
+        # an empty friend list adds no rows to the friends table
+        if self.source_index is not None and (self.friends_storage == "packed" or
+                                              len(friendlist) > 0):
+            self.source_index.add([seed])
+
+        if self.friends_storage == "packed":
+            self._merge_packed_friends(seed, np.unique(np.asarray(friendlist, dtype=np.int64)))
+            return
+
         temp_tbl_name = self.make_temp_tbl(type="friends")
 
         friends_df = pd.DataFrame({'target': friendlist})
@@ -185,3 +590,280 @@ class DataBaseHandler():
 
         self.engine.execute(insert_query)
         self.engine.execute(f"DROP TABLE {temp_tbl_name}")
+
+    def _execute_packed(self, query, parameters):
+        """Executes `query` with %s placeholders for `parameters` and returns the cursor."""
+        if self.config.dbtype.lower() == "sqlite":
+            cursor = self.engine.execute(query.replace("%s", "?"), parameters)
+            self.engine.commit()
+            return cursor
+        return self.engine.execute(query, parameters)
+
+    def _merge_packed_friends(self, seed, friends):
+        """Adds the sorted, unique ids `friends` to the packed friend list of `seed`.
+
+        Friend lists only grow, so their size serves as version: the merged list is only
+        written if the stored list did not change since it was read, otherwise the merge is
+        repeated. Concurrent walkers, processes or nodes writing friends of the same source
+        thus do not overwrite each other's ids.
+        """
+        seed = int(seed)
+        while True:
+            row = self.engine.execute(
+                f"SELECT size, ids FROM friends_packed WHERE source = {seed}").fetchone()
+            if row is None:
+                if self.config.dbtype.lower() == "mysql":
+                    query = "INSERT IGNORE INTO friends_packed (source, size, ids) "
+                elif self.config.dbtype.lower() == "sqlite":
+                    query = "INSERT OR IGNORE INTO friends_packed (source, size, ids) "
+                written = self._execute_packed(query + "VALUES (%s, %s, %s)",
+                                               (seed, len(friends), pack_ids(friends)))
+            else:
+                size = int(row[0])
+                merged = np.union1d(unpack_ids(row[1]), friends)
+                if len(merged) == size:  # nothing new
+                    return
+                written = self._execute_packed(
+                    "UPDATE friends_packed SET size = %s, ids = %s "
+                    "WHERE source = %s AND size = %s",
+                    (len(merged), pack_ids(merged), seed, size))
+            if written.rowcount == 1:
+                return
+
+    def read_packed_friends(self, source):
+        """Reads the complete friend list of `source` from the packed storage with one row fetch.
+
+        Args:
+            source (int): Twitter ID
+        Returns:
+            numpy.ndarray of sorted int64 Twitter IDs or None if `source` has no friend list.
+        """
+        row = self.engine.execute(
+            f"SELECT ids FROM friends_packed WHERE source = {int(source)}").fetchone()
+        if row is None:
+            return None
+        return unpack_ids(row[0])
+
+    def read_friends(self, source, unburned_only: bool = False):
+        """Reads the collected friends of `source`.
+
+        Args:
+            source (int): Twitter ID
+            unburned_only (bool): whether to leave out burned connections
+        Returns:
+            numpy.ndarray of int64 Twitter IDs (empty if no friends are stored)
+        """
+        source = int(source)
+
+        if self.adjacency is not None:
+            return self.adjacency.neighbors(source, unburned_only=unburned_only)
+
+        if self.friends_storage == "packed":
+            friends = self.read_packed_friends(source)
+            if friends is None:
+                return np.array([], dtype=np.int64)
+            friends = np.setdiff1d(friends, self.read_removed_targets(), assume_unique=True)
+            if unburned_only:
+                burned = pd.read_sql(f"SELECT target FROM friends_burned WHERE source = {source}",
+                                     self.engine)['target']
+                friends = np.setdiff1d(friends, burned.values.astype(np.int64),
+                                       assume_unique=True)
+            return friends
+
+        query = f"SELECT target FROM friends WHERE source = {source}"
+        if unburned_only:
+            query += " AND burned = 0"
+        return pd.read_sql(query, self.engine)['target'].values.astype(np.int64)
+
+    def read_removed_targets(self, reload: bool = False):
+        """Returns the targets removed from all packed friend lists, which are kept in memory
+        to filter friend lists. Targets removed through this DataBaseHandler are added to them.
+
+        Args:
+            reload (bool): whether to read them from the database again, e.g. to get the targets
+                           removed by other processes
+        Returns:
+            sorted numpy.ndarray of int64 Twitter IDs
+        """
+        if self.removed_targets is None or reload:
+            removed = pd.read_sql("SELECT target FROM friends_removed", self.engine)['target']
+            self.removed_targets = np.unique(removed.values.astype(np.int64))
+        return self.removed_targets
+
+    def read_sources(self, table: str = "result", after: float = None):
+        """Reads the distinct sources of `table` ("result", "friends" or "friends_packed").
+
+        Args:
+            table (str)
+            after (float): only read sources of rows written after this time (seconds since
+                           epoch), all if None
+        Returns:
+            numpy.ndarray of int64 Twitter IDs
+        """
+        query = f"SELECT DISTINCT source FROM {table}"
+        if after is not None:
+            query += f" WHERE {self.timestamp_after(after, inclusive=True)}"
+        return pd.read_sql(query, self.engine)['source'].values.astype(np.int64)
+
+    def load_source_index(self, after: float = None):
+        """Keeps the sources of the friends table in memory, so that `is_source` does not query
+        the database. Friend lists written through this DataBaseHandler are added to it.
+
+        Args:
+            after (float): only add the sources written after this time (seconds since epoch)
+                           to the index, e.g. by other processes. Reads all sources if None
+        """
+        table = "friends_packed" if self.friends_storage == "packed" else "friends"
+        sources = self.read_sources(table, after=after)
+        if self.source_index is None or after is None:
+            self.source_index = SeedPool(sources)
+        else:
+            self.source_index.add(sources)
+
+    def is_source(self, source) -> bool:
+        """Returns whether friends of `source` have been collected."""
+        if self.adjacency is not None:
+            return self.adjacency.has_source(source)
+        if self.source_index is not None:
+            return int(source) in self.source_index
+        if self.friends_storage == "packed":
+            table = "friends_packed"
+        else:
+            table = "friends"
+        query = f"SELECT EXISTS(SELECT * FROM {table} WHERE source={int(source)})"
+        return self.engine.execute(query).fetchone()[0] == 1
+
+    def follows(self, source, target) -> bool:
+        """Returns whether `target` is among the collected friends of `source`."""
+        source, target = int(source), int(target)
+        if self.adjacency is not None:
+            return self.adjacency.follows(source, target)
+        if self.friends_storage == "packed":
+            friends = self.read_packed_friends(source)
+            if friends is None:
+                return False
+            i = np.searchsorted(friends, target)
+            if i == len(friends) or friends[i] != target:
+                return False
+            removed = self.read_removed_targets()
+            i = np.searchsorted(removed, target)
+            return i == len(removed) or removed[i] != target
+
+        query = f"""SELECT EXISTS(
+                        SELECT * FROM friends
+                        WHERE source={source} and target={target}
+                    )"""
+        return self.engine.execute(query).fetchone()[0] == 1
+
+    def burn_friend(self, source, target) -> bool:
+        """Marks the connection (source)-->(target) as walked.
+
+        Returns:
+            False if the connection was burned already, else True.
+        """
+        source, target = int(source), int(target)
+        if self.friends_storage == "packed":
+            if self.config.dbtype.lower() == "mysql":
+                query = "INSERT IGNORE INTO friends_burned (source, target) VALUES "
+            elif self.config.dbtype.lower() == "sqlite":
+                query = "INSERT OR IGNORE INTO friends_burned (source, target) VALUES "
+            burned = self.engine.execute(query + f"({source}, {target})").rowcount > 0
+        else:
+            query = f"""UPDATE friends
+                        SET burned=1
+                        WHERE source={source} AND target={target} AND burned = 0"""
+            burned = self.engine.execute(query).rowcount > 0
+
+        # also if it was burned already, e.g. by another process
+        if self.adjacency is not None:
+            self.adjacency.set_burned(source, target)
+
+        return burned
+
+    def remove_friend_target(self, target):
+        """Removes `target` from the friend lists of all sources."""
+        target = int(target)
+        if self.adjacency is not None:
+            self.adjacency.remove_target(target)
+        if self.friends_storage == "packed":
+            if self.config.dbtype.lower() == "mysql":
+                query = "INSERT IGNORE INTO friends_removed (target) VALUES "
+            elif self.config.dbtype.lower() == "sqlite":
+                query = "INSERT OR IGNORE INTO friends_removed (target) VALUES "
+            self.engine.execute(query + f"({target})")
+            if self.config.dbtype.lower() == "sqlite":
+                self.engine.commit()
+            if self.removed_targets is not None:
+                self.removed_targets = np.union1d(self.removed_targets, [target])
+        else:
+            self.engine.execute(f"DELETE from friends WHERE target = {target}")
+
+    def unburn_friends_after(self, timestamp):
+        """Resets all connections burned after `timestamp` (seconds since epoch) to unburned."""
+        after = self.timestamp_after(timestamp)
+        if self.friends_storage == "packed":
+            table = "friends_burned"
+            query = f"DELETE FROM friends_burned WHERE {after}"
+        else:
+            table = "friends"
+            query = f"UPDATE friends SET burned=0 WHERE {after}"
+
+        if self.adjacency is not None:
+            unburned = pd.read_sql(f"SELECT source, target FROM {table} WHERE {after}",
+                                   self.engine)
+            for source, target in unburned.values:
+                self.adjacency.set_burned(source, target, burned=False)
+
+        self.engine.execute(query)
+
+    def friends_storage_report(self) -> dict:
+        """Compares the disk space of the stored friend lists with what they would take in the
+        other layout. Sizes of existing tables are taken from the database (MySQL only), the
+        size of the row layout is estimated with `ROWS_BYTES_PER_EDGE` if the friends table
+        holds no edges.
+
+        Returns:
+            dict with the number of edges and the (estimated) bytes for both layouts
+        """
+        def scalar(query):
+            value = self.engine.execute(query).fetchone()[0]
+            return 0 if value is None else int(value)
+
+        def table_bytes(table):
+            if self.config.dbtype.lower() != "mysql" or self.table_type(table) is None:
+                return None
+            return scalar(f"""SELECT DATA_LENGTH + INDEX_LENGTH FROM information_schema.TABLES
+                              WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table}'""")
+
+        if self.friends_storage == "packed":
+            edges = scalar("SELECT SUM(size) FROM friends_packed")
+            burned = scalar("SELECT COUNT(*) FROM friends_burned")
+            packed_bytes = table_bytes("friends_packed")
+            if packed_bytes is None:
+                # blob payload plus source, size and timestamp per list
+                packed_bytes = scalar("SELECT SUM(LENGTH(ids)) FROM friends_packed") + \
+                    20 * scalar("SELECT COUNT(*) FROM friends_packed")
+            burned_bytes = table_bytes("friends_burned")
+            if burned_bytes is None:
+                burned_bytes = burned * ROWS_BYTES_PER_EDGE
+            packed_bytes += burned_bytes
+            rows_bytes = edges * ROWS_BYTES_PER_EDGE
+        else:
+            edges = scalar("SELECT COUNT(*) FROM friends")
+            rows_bytes = table_bytes("friends")
+            if rows_bytes is None or edges == 0:
+                rows_bytes = edges * ROWS_BYTES_PER_EDGE
+            burned = scalar("SELECT COUNT(*) FROM friends WHERE burned = 1")
+            sources = pd.read_sql("SELECT DISTINCT source FROM friends", self.engine)['source']
+            packed_bytes = burned * ROWS_BYTES_PER_EDGE
+            for source in sources:
+                friends = self.read_friends(source)
+                packed_bytes += len(pack_ids(friends)) + 20
+
+        return {
+            'storage': self.friends_storage,
+            'edges': edges,
+            'rows_bytes': rows_bytes,
+            'packed_bytes': packed_bytes,
+            'ratio': packed_bytes / rows_bytes if rows_bytes > 0 else None
+        }
@@ -186,7 +186,7 @@ class FirstUseTest(unittest.TestCase):
         with self.assertRaises(TestException):
             main_loop(Coordinator(), test_fail=True)
 
-        p = Popen("python start.py -n 2 -t -f -p 1", stdout=PIPE, stderr=PIPE, stdin=PIPE,
+        p = Popen("python start.py -n 2 -t -f -p 1 --rounds", stdout=PIPE, stderr=PIPE, stdin=PIPE,
                   shell=True)
 
         stdout, stderr = p.communicate()
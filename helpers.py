@@ -1,3 +1,6 @@
+import re
+import zlib
+
 import numpy as np
 
 
@@ -122,3 +125,105 @@ friends_details_dtypes = {
     "verified": np.int8,
     "utc_offset": str
 }
+
+
+def pack_ids(ids) -> bytes:
+    """Packs Twitter IDs into a compressed blob of delta-encoded, sorted int64 values.
+
+    Args:
+        ids (list or numpy.ndarray of int): Twitter IDs, may be unsorted and contain duplicates
+    Returns:
+        bytes
+    """
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    deltas = np.diff(ids, prepend=np.int64(0))
+    return zlib.compress(deltas.astype('<i8').tobytes())
+
+
+def unpack_ids(blob: bytes) -> np.ndarray:
+    """Reverses `pack_ids`.
+
+    Args:
+        blob (bytes): as returned by `pack_ids`
+    Returns:
+        numpy.ndarray of sorted, unique int64 Twitter IDs
+    """
+    deltas = np.frombuffer(zlib.decompress(blob), dtype='<i8')
+    return np.cumsum(deltas, dtype=np.int64)
+
+
+# characters with a special meaning in regular expressions (outside of verbose mode)
+REGEX_CHARACTERS = set(".^$*+?{}[]\\|()")
+
+
+def trie_pattern(words) -> str:
+    """Returns a regular expression matching any of `words` literally, built from their prefix
+    tree, e.g. "ab(?:c|d)" for "abc" and "abd". Unlike the plain alternation "abc|abd", it is
+    matched at every position of a text in one pass instead of once per word.
+
+    Args:
+        words (iterable of str)
+    Returns:
+        str
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for character in word:
+            node = node.setdefault(character, {})
+        node[""] = {}  # end of a word
+
+    def pattern(node):
+        alternatives = [re.escape(character) + pattern(child)
+                        for character, child in sorted(node.items()) if character != ""]
+        if len(alternatives) == 0:
+            return ""
+        if "" in node:  # a word ends here, so the rest is optional
+            return "(?:" + "|".join(alternatives) + ")?"
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    return pattern(trie)
+
+
+class KeywordMatcher(object):
+    """Checks texts for any of a list of keywords (regular expressions, ignoring case).
+
+    The keywords are compiled once: plain words and phrases into one pattern of their prefix
+    tree, matched against the lower-cased texts, and the other keywords into one case-
+    insensitive alternation. So every text is scanned once for all keywords, and the check
+    stops at the first text with a match.
+
+    Attributes:
+        keywords (tuple of str)
+        literal_pattern (re.Pattern): for the keywords without special characters, or None
+        pattern (re.Pattern): for the other keywords, or None
+    """
+
+    def __init__(self, keywords):
+        self.keywords = tuple(keywords)
+        literals = [keyword.lower() for keyword in self.keywords
+                    if not REGEX_CHARACTERS.intersection(keyword)]
+        expressions = [keyword for keyword in self.keywords
+                       if REGEX_CHARACTERS.intersection(keyword)]
+
+        self.literal_pattern = None
+        if len(literals) > 0:
+            self.literal_pattern = re.compile(trie_pattern(literals))
+        self.pattern = None
+        if len(expressions) > 0:
+            self.pattern = re.compile("|".join(f"(?:{keyword})" for keyword in expressions),
+                                      re.IGNORECASE)
+
+    def search(self, texts) -> bool:
+        """Returns whether any of `texts` (iterable of str, others are skipped) contains any of
+        the keywords."""
+        for text in texts:
+            if not isinstance(text, str):
+                continue
+            if self.literal_pattern is not None and self.literal_pattern.search(text.lower()):
+                return True
+            if self.pattern is not None and self.pattern.search(text):
+                return True
+        return False
@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+# stages of a step in the order they are recorded
+STAGES = ["acquired", "friends_stored", "details_stored", "result_written", "edge_claimed"]
+
+Walk = namedtuple("Walk", ["seed", "stage", "target", "restart"])
+Walk.__doc__ = """State of a walk replayed from a WalkerJournal.
+
+Attributes:
+    seed (int): seed the walk was at
+    stage (str): "queued" if the seed waited in the seed queue, else the last recorded stage
+                 of the interrupted step (see STAGES)
+    target (int): chosen next seed if the stage is "result_written" or "edge_claimed"
+    restart (bool): whether the seed was queued to be worked through without database lookup
+"""
+
+
+class WalkerJournal(object):
+    """Append-only journal of the steps of walkers (one JSON object per line).
+
+    Every step is recorded as a sequence of events: the walker acquires a seed, the seed's
+    friends and friend details are stored, the result edge to the next seed is written and the
+    edge is claimed (burned), and the step is completed by queueing the next seed. A seed put
+    back after a failure is released, a seed that failed too often is dropped in favour of a
+    random seed. A seed that was queued twice is merged (dropped) or redirected to a fresh seed
+    (see collector.InFlightSeeds). Replaying the journal after a crash gives the state of every
+    walk, so that each can be resumed at the stage where it was interrupted.
+
+    Events are flushed to the operating system at once, so they survive a crash of the
+    crawler, and synced to disk together at most every `sync_interval` seconds. Once the
+    journal grows beyond `compact_size` bytes, it is replaced by a compacted one that only
+    holds the events needed to replay the current state of the walks.
+
+    Attributes:
+        path (str): journal file
+        sync_interval (float): seconds between syncs to disk (safe against power loss),
+                               0 to sync every event, None to leave it to the operating system
+        compact_size (int): size of the journal in bytes that triggers its compaction
+    """
+
+    def __init__(self, path="walker_journal.jsonl", sync_interval=1, compact_size=16 * 2**20):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.compact_size = compact_size
+        self.lock = threading.Lock()
+        self.file = None
+        self.last_sync = 0
+
+    def exists(self):
+        return os.path.isfile(self.path) and os.path.getsize(self.path) > 0
+
+    def _write(self, file, event):
+        file.write(json.dumps(event) + "\n")
+
+    def record(self, event, seed, target=None, walker=None, **data):
+        """Appends an event of the step of `walker` (the current thread by default) on `seed`.
+
+        Args:
+            event (str): "queued", "released", "completed", "merged", "redirected",
+                         "dropped" or one of STAGES
+            seed (int)
+            target (int): next seed for "result_written", "edge_claimed" and "completed", fresh
+                          seed for "redirected" and "dropped"
+            walker (str): name of the walker, defaults to the name of the current thread
+            **data: further fields of the event
+        Returns:
+            Nothing
+        """
+        entry = {'time': time.time(), 'event': event, 'seed': int(seed),
+                 'walker': walker if walker is not None else threading.current_thread().name}
+        if target is not None:
+            entry['target'] = int(target)
+        entry.update(data)
+
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a")
+            self._write(self.file, entry)
+            self.file.flush()
+            if self.sync_interval is not None and \
+                    time.time() - self.last_sync >= self.sync_interval:
+                os.fsync(self.file.fileno())
+                self.last_sync = time.time()
+            if self.file.tell() > self.compact_size:
+                self._compact()
+
+    def replay(self):
+        """Reads the journal and returns the state of all walks.
+
+        Returns:
+            list of Walk, first the interrupted steps, then the queued seeds
+        """
+        steps, queued, restart = self._replay()
+
+        walks = list(steps.values())
+        for seed, count in queued.items():
+            for i in range(count):
+                walks.append(Walk(seed, "queued", None, i < restart[seed]))
+
+        return walks
+
+    def _replay(self):
+        """Reads the journal.
+
+        Returns:
+            tuple of the interrupted steps (OrderedDict of (walker, seed) -> Walk), the number
+            of times each seed is queued (Counter) and how many of them need a restart (Counter)
+        """
+        queued = Counter()
+        restart = Counter()
+        steps = OrderedDict()  # (walker, seed) -> Walk
+
+        if not self.exists():
+            return steps, queued, restart
+
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # last line cut by a crash
+                    continue
+                event, seed = entry['event'], entry['seed']
+                key = (entry['walker'], seed)
+
+                if event == "queued":
+                    queued[seed] += 1
+                    if entry.get('restart', False):
+                        restart[seed] += 1
+                elif event == "acquired":
+                    queued[seed] -= 1
+                    steps[key] = Walk(seed, event, None, restart[seed] > 0)
+                    if restart[seed] > 0:
+                        restart[seed] -= 1
+                elif event in STAGES and key in steps:
+                    steps[key] = steps[key]._replace(stage=event,
+                                                     target=entry.get('target'))
+                elif event == "completed":
+                    steps.pop(key, None)
+                    queued[entry['target']] += 1
+                elif event == "released":
+                    steps.pop(key, None)
+                    queued[seed] += 1
+                    if entry.get('restart', False):
+                        restart[seed] += 1
+                elif event == "dropped":
+                    steps.pop(key, None)
+                    if entry.get('target') is not None:
+                        queued[entry['target']] += 1
+                elif event == "merged":
+                    queued[seed] -= 1
+                elif event == "redirected":
+                    queued[seed] -= 1
+                    queued[entry['target']] += 1
+
+        return steps, queued, restart
+
+    def _compact(self):
+        """Replaces the journal by one with the events of the interrupted steps (as recorded by
+        their walkers) and the queued seeds only. Must be called holding `lock`."""
+        self.file.close()
+        self.file = None
+        steps, queued, restart = self._replay()
+
+        entries = []
+        for (walker, seed), walk in steps.items():
+            if walk.restart:
+                entries.append({'event': "queued", 'seed': seed, 'restart': True})
+            entries.append({'event': "acquired", 'seed': seed, 'walker': walker})
+            if walk.stage != "acquired":
+                entries.append({'event': walk.stage, 'seed': seed, 'walker': walker,
+                                'target': walk.target})
+        for seed, count in queued.items():
+            for i in range(count):
+                entries.append({'event': "queued", 'seed': seed, 'restart': i < restart[seed]})
+
+        self._replace(entries)
+
+    def checkpoint(self, seeds):
+        """Replaces the journal by one that only queues `seeds`.
+
+        Args:
+            seeds (list of (int, bool)): seeds with whether they need to be restarted
+        Returns:
+            Nothing
+        """
+        entries = [{'event': "queued", 'seed': int(seed), 'restart': restart}
+                   for seed, restart in seeds]
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self._replace(entries)
+
+    def _replace(self, entries):
+        """Atomically replaces the journal file by one with `entries` (dicts with event, seed
+        and optionally walker, target and restart). Must be called holding `lock`."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for entry in entries:
+                entry = dict(entry, time=time.time(), walker=entry.get('walker'))
+                if entry.get('target') is None:
+                    entry.pop('target', None)
+                if not entry.get('restart', False):
+                    entry.pop('restart', None)
+                self._write(f, entry)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                if self.sync_interval is not None:
+                    os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
@@ -0,0 +1,160 @@
+import random
+import threading
+
+import numpy as np
+
+
+class SeedPool(object):
+    """Pool of seeds to draw random seeds from, shared by all walkers of a Coordinator.
+
+    The seeds are kept in a sorted int64 array (e.g. read from seeds.csv) and an array of
+    seeds added later (e.g. by bootstrapping) with a dict of their slots. Removed seeds of the
+    sorted array are marked in a bitmap, removed added seeds are swapped with the last added
+    seed. Drawing picks random slots and skips removed seeds. Once half of the sorted array is
+    removed, it is compacted, so that drawing, adding and removing a seed take constant
+    (removing from the sorted array logarithmic) time, even for millions of seeds.
+
+    Attributes:
+        base (numpy.ndarray): sorted and deduplicated seeds
+        removed (numpy.ndarray): bitmap of removed seeds of `base`, None if none are removed
+        added (numpy.ndarray): seeds not in `base` in its first `number_added` slots
+        slots (dict): slot in `added` of each added seed
+    """
+
+    def __init__(self, seeds=[], is_sorted=False):
+        """
+        Args:
+            seeds (array-like of int)
+            is_sorted (bool): whether `seeds` are sorted and unique already (e.g. a memory map
+                              of a seed file), so that they are used without copying
+        """
+        self.lock = threading.Lock()
+
+        if is_sorted:
+            self.base = seeds
+        else:
+            self.base = np.unique(np.asarray(seeds, dtype=np.int64))
+        self.removed = None
+        self.number_removed = 0
+
+        self.added = np.empty(1024, dtype=np.int64)
+        self.number_added = 0
+        self.slots = {}
+
+    def __len__(self):
+        return len(self.base) - self.number_removed + self.number_added
+
+    def _base_index(self, seed):
+        """Returns the index of `seed` in `self.base`, or -1 if it is not in there."""
+        i = np.searchsorted(self.base, seed)
+        if i < len(self.base) and self.base[i] == seed:
+            return int(i)
+        return -1
+
+    def __contains__(self, seed):
+        with self.lock:
+            if int(seed) in self.slots:
+                return True
+            i = self._base_index(seed)
+            return i >= 0 and (self.removed is None or not self.removed[i])
+
+    def add(self, seeds):
+        """Adds the seeds that are not in the pool yet.
+
+        Args:
+            seeds (array-like of int)
+        Returns:
+            number of seeds added (int)
+        """
+        seeds = np.unique(np.asarray(seeds, dtype=np.int64))
+
+        with self.lock:
+            number = len(self)
+
+            indices = np.searchsorted(self.base, seeds)
+            in_base = indices < len(self.base)
+            in_base[in_base] = self.base[indices[in_base]] == seeds[in_base]
+
+            # seeds removed from base before are only unmarked
+            if self.removed is not None:
+                restored = indices[in_base][self.removed[indices[in_base]]]
+                self.removed[restored] = False
+                self.number_removed -= len(restored)
+
+            for seed in seeds[~in_base].tolist():
+                if seed in self.slots:
+                    continue
+                if self.number_added == len(self.added):
+                    self.added = np.concatenate([self.added, np.empty_like(self.added)])
+                self.added[self.number_added] = seed
+                self.slots[seed] = self.number_added
+                self.number_added += 1
+
+            return len(self) - number
+
+    def remove(self, seed):
+        """Removes `seed` from the pool.
+
+        Returns:
+            whether the seed was in the pool (bool)
+        """
+        with self.lock:
+            slot = self.slots.pop(int(seed), None)
+            if slot is not None:
+                self.number_added -= 1
+                last = self.added[self.number_added]
+                if slot != self.number_added:
+                    self.added[slot] = last
+                    self.slots[int(last)] = slot
+                return True
+
+            i = self._base_index(seed)
+            if i < 0 or (self.removed is not None and self.removed[i]):
+                return False
+            if self.removed is None:
+                self.removed = np.zeros(len(self.base), dtype=bool)
+            self.removed[i] = True
+            self.number_removed += 1
+            if self.number_removed > len(self.base) / 2:
+                self.base = self.base[~self.removed]
+                self.removed = None
+                self.number_removed = 0
+            return True
+
+    def sample(self, n=1, replace=False):
+        """Draws `n` random seeds.
+
+        Args:
+            n (int): number of seeds
+            replace (bool): whether a seed may be drawn more than once
+        Returns:
+            numpy.ndarray of int64
+        Raises:
+            ValueError: if the pool has less than `n` seeds (or none with `replace`)
+        """
+        with self.lock:
+            if len(self) == 0 or (not replace and n > len(self)):
+                raise ValueError(f"Cannot draw {n} seeds from a pool of {len(self)} seeds.")
+
+            slots = set()
+            seeds = []
+            while len(seeds) < n:
+                slot = random.randrange(len(self.base) + self.number_added)
+                if slot < len(self.base) and self.removed is not None and self.removed[slot]:
+                    continue
+                if not replace:
+                    if slot in slots:
+                        continue
+                    slots.add(slot)
+                if slot < len(self.base):
+                    seeds.append(self.base[slot])
+                else:
+                    seeds.append(self.added[slot - len(self.base)])
+
+            return np.array(seeds, dtype=np.int64)
+
+    def to_array(self):
+        """Returns all seeds of the pool (numpy.ndarray of int64)."""
+        with self.lock:
+            base = self.base if self.removed is None else self.base[~self.removed]
+            return np.concatenate([base, self.added[:self.number_added]])
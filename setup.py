@@ -1,5 +1,7 @@
 import json
+import os
 from json import JSONDecodeError
+import numpy as np
 import pandas as pd
 from requests import post
 import yaml
@@ -62,6 +64,42 @@ class FileImport():
             raise e
         return self.seeds
 
+    def read_seeds(self, filename: str = "seeds.csv") -> np.ndarray:
+        """Reads the seeds as sorted and deduplicated array. If a compiled seed file (the same
+        name ending with .npy, see compile_seeds.py) exists and is not older than the csv file,
+        it is memory-mapped instead of parsing the csv file.
+
+        Args:
+            filename (str, optional): Defaults to "seeds.csv"
+
+        Returns:
+            numpy.ndarray of int64 (read-only numpy.memmap for a compiled seed file)
+        """
+        compiled = os.path.splitext(filename)[0] + ".npy"
+        if os.path.isfile(compiled) and (not os.path.isfile(filename) or
+                                         os.path.getmtime(compiled) >= os.path.getmtime(filename)):
+            return np.load(compiled, mmap_mode='r')
+
+        return np.unique(self.read_seed_file(filename)[0].values.astype(np.int64))
+
+    def write_compiled_seed_file(self, seeds, filename: str = "seeds.npy") -> int:
+        """Writes `seeds` sorted and deduplicated to a compiled seed file (.npy) that
+        `read_seeds` memory-maps.
+
+        Args:
+            seeds (array-like of int)
+            filename (str, optional): Defaults to "seeds.npy"
+
+        Returns:
+            number of seeds written (int)
+        """
+        seeds = np.unique(np.asarray(seeds, dtype=np.int64))
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            np.save(f, seeds)
+        os.replace(tmp_filename, filename)
+        return len(seeds)
+
     def read_token_file(self, filename="tokens.csv"):
         """Reads file with authorized user tokens (csv).
 
@@ -162,6 +200,15 @@ class Config():
                   "new_database".''')
             self.dbname = "new_database"
 
+        # Storage layout of the friends cache, "rows" (default) or "packed"
+        if self.sql_config.get("friends_storage") is None:
+            self.friends_storage = "rows"
+        else:
+            self.friends_storage = self.sql_config["friends_storage"].strip()
+        if self.friends_storage not in ["rows", "packed"]:
+            raise ValueError('''friends_storage parameter is neither "rows" nor "packed".
+                             Please adjust the "config.yml" ''')
+
     # Function to send mail if notifications are turned on in config.yml
     # TODO: finalize this function
     def send_mail(self, message_dict):
@@ -1,39 +1,80 @@
 import argparse
 from datetime import datetime
+import multiprocessing
 import os
+import signal
 import time
 import traceback
 from shutil import copyfile
 from sys import stderr, stdout
+from threading import Event
 
+import numpy as np
 import pandas as pd
 
 from collector import Coordinator
-from setup import Config
+from coordination import CrawlCoordination
+from journal import Walk, WalkerJournal
+from database_handler import DataBaseHandler
+from seed_pool import SeedPool
+from setup import Config, FileImport
+from token_broker import TokenBroker
 
 
-def main_loop(coordinator, select=[], status_lang=None, test_fail=False, restart=False,
-              bootstrap=False, language_threshold=0, keywords=[]):
+def record_start_time(dbh, restart=False):
+    """Replaces the start time in the timetable with the current time and returns the former
+    one. On restart, connections burned since the former start are unburned.
 
-    try:
-        latest_start_time = pd.read_sql_table('timetable', coordinator.dbh.engine)
-        latest_start_time = latest_start_time['latest_start_time'][0]
-    except ValueError:
-        latest_start_time = 0
+    Args:
+        dbh (database_handler.DataBaseHandler)
+        restart (bool)
+    Returns:
+        former start time (float)
+    """
 
-    if restart is True:
+    latest_start_time = dbh.get_latest_start_time()
 
-        update_query = f"""
-                        UPDATE friends
-                        SET burned=0
-                        WHERE UNIX_TIMESTAMP(timestamp) > {latest_start_time}
-                       """
-        coordinator.dbh.engine.execute(update_query)
+    if restart is True:
+        dbh.unburn_friends_after(latest_start_time)
 
     start_time = time.time()
 
-    pd.DataFrame({'latest_start_time': [start_time]}).to_sql('timetable', coordinator.dbh.engine,
-                                                             if_exists='replace')
+    dbh.set_latest_start_time(start_time)
+
+    return latest_start_time
+
+
+def print_stats(coordinator):
+    stdout.write(f"Follow-back checks answered by source: {coordinator.follow_back.stats()}\n")
+    if coordinator.prefetcher is not None:
+        stdout.write(f"Prefetching: {coordinator.prefetcher.stats()}\n")
+    if getattr(coordinator, 'screener', None) is not None:
+        stdout.write(f"Prescreening: {coordinator.screener.stats()}\n")
+    if getattr(coordinator, 'retry_scheduler', None) is not None:
+        stdout.write(f"Retries: {coordinator.retry_scheduler.stats()}\n")
+    stdout.write(f"Unavailable accounts: {coordinator.unavailable.stats()}\n")
+    if getattr(coordinator, 'in_flight', None) is not None:
+        stdout.write(f"Duplicate seeds: {coordinator.in_flight.stats()}\n")
+    stdout.flush()
+
+
+def notify(config, subject, text):
+    """Sends a notification mail if notifications are configured."""
+    try:
+        if config.use_notifications is True:
+            response = config.send_mail({"subject": subject, "text": text})
+            assert '200' in str(response)
+            stdout.write(f"Sent notification to {config.notif_config['email_to_notify']}")
+            stdout.flush()
+    except Exception:
+        stderr.write('Could not send error-mail: \n')
+        traceback.print_exc(file=stderr)
+
+
+def main_loop(coordinator, select=[], status_lang=None, test_fail=False, restart=False,
+              bootstrap=False, language_threshold=0, keywords=[]):
+
+    latest_start_time = record_start_time(coordinator.dbh, restart)
 
     collectors = coordinator.start_collectors(select=select,
                                               status_lang=status_lang,
@@ -63,6 +104,251 @@ to finish.")
         stdout.write(f"Thread {instance.name} joined. {i} collector(s) finished\n")
         stdout.flush()
 
+    print_stats(coordinator)
+
+
+def run_walkers(coordinator, stop, select=[], status_lang=None, test_fail=False, restart=False,
+                bootstrap=False, language_threshold=0, keywords=[], max_steps=None,
+                report_interval=300, on_walker_error=None, workers=None,
+                latest_start_time=None):
+    """Runs long-running walkers until `stop` is set (or each walker did `max_steps` steps).
+
+    In contrast to `main_loop`, walkers do not wait for each other after every step. Every
+    `report_interval` seconds, the progress is reported, latest_seeds.csv is updated, the
+    sources written by other processes are added to the in-memory indexes and, with
+    `bootstrap`, the seed pool is extended by the results since the last report. A walker
+    that failed is replaced by a new one. After `stop` is set, all walkers finish their current
+    step before latest_seeds.csv is written a last time.
+
+    Args:
+        coordinator (collector.Coordinator)
+        stop (mp.Event): event that ends the run when set
+        max_steps (int): steps per walker after which the run ends, None for unlimited
+        report_interval (float): seconds between progress reports
+        on_walker_error (function): called with the formatted traceback of a failed walker
+        workers (int): number of walker threads sharing the seeds (any number of seeds can be
+                       walked by fewer workers), defaults to the number of seeds
+        latest_start_time (float): start time of the last run if it was recorded already,
+                                   by default it is read from and replaced in the timetable
+        further Args: see `main_loop`
+    Returns:
+        number of steps done (int)
+    """
+
+    if latest_start_time is None:
+        latest_start_time = record_start_time(coordinator.dbh, restart)
+
+    stdout.write(f"\nKeywords: {keywords}\n")
+    stdout.flush()
+
+    walkers = coordinator.start_walkers(stop, select=select, status_lang=status_lang,
+                                        fail=test_fail, restart=restart, retries=4,
+                                        latest_start_time=latest_start_time,
+                                        bootstrap=bootstrap,
+                                        language_threshold=language_threshold,
+                                        keywords=keywords, max_steps=max_steps,
+                                        number_of_walkers=workers)
+
+    finished_steps = 0  # steps of walkers that were replaced
+    last_report = time.time()
+    last_steps = 0
+
+    try:
+        while any(walker.is_alive() for walker in walkers):
+            stop.wait(timeout=1)
+
+            for i, walker in enumerate(walkers):
+                if walker.is_alive() or walker.err is None or stop.is_set():
+                    continue
+                text = "".join(traceback.format_exception(
+                    type(walker.err), walker.err, walker.err.__traceback__))
+                stdout.write(f"Walker {walker.name} failed and is replaced:\n{text}")
+                stdout.flush()
+                if on_walker_error is not None:
+                    on_walker_error(text)
+                finished_steps += walker.steps
+                if walker.max_steps is None:
+                    max_steps = None
+                else:
+                    max_steps = walker.max_steps - walker.steps
+                # the failed step may be half-written, so do not trust the database for it
+                walkers[i] = type(walker)(coordinator, stop, step_kwargs=walker.step_kwargs,
+                                          first_step_kwargs={'restart': True},
+                                          max_steps=max_steps, name=walker.name)
+                walkers[i].start()
+
+            if time.time() - last_report >= report_interval:
+                steps = finished_steps + sum(walker.steps for walker in walkers)
+                rate = (steps - last_steps) / (time.time() - last_report) * 3600
+                stdout.write(f"\n{steps} steps done, {rate:.0f} steps per hour since the last "
+                             f"report, {sum(w.is_alive() for w in walkers)} walkers running, "
+                             f"{coordinator.token_queue.qsize()} tokens idle.\n")
+                print_stats(coordinator)
+                coordinator.save_latest_seeds(walkers)
+                coordinator.refresh_source_indexes()
+                if bootstrap is True:
+                    coordinator.bootstrap_seed_pool()
+                last_report, last_steps = time.time(), steps
+    except Exception:
+        # let the walkers finish their steps, so that the seeds are saved before raising
+        stop.set()
+        for walker in walkers:
+            walker.join()
+        coordinator.save_latest_seeds(walkers)
+        raise
+    finally:
+        # the walkers are done, so no seed must be put back for them any more
+        retry_scheduler = getattr(coordinator, 'retry_scheduler', None)
+        if retry_scheduler is not None:
+            retry_scheduler.stop()
+
+    coordinator.save_latest_seeds(walkers)
+    print_stats(coordinator)
+
+    return finished_steps + sum(walker.steps for walker in walkers)
+
+
+def install_stop_handlers(stop):
+    """Lets SIGINT (control-c) and SIGTERM set `stop`. A second SIGINT aborts."""
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            if signum == signal.SIGINT:
+                raise KeyboardInterrupt
+            return
+        stdout.write("\nStopping after the current steps. Interrupt again to abort.\n")
+        stdout.flush()
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+
+def restart_walks(journal, latest_seeds_file="latest_seeds.csv"):
+    """Returns the walks to continue with after a restart.
+
+    The walks are replayed from `journal` if it exists. Otherwise, e.g. on the first run with
+    a journal, they restart at the seeds of `latest_seeds_file`, flagged as restarted, so that
+    their first steps do not trust the database.
+
+    Args:
+        journal (journal.WalkerJournal)
+        latest_seeds_file (str)
+    Returns:
+        tuple of the walks (list of journal.Walk) and whether they were resumed from
+        `journal` (bool)
+    """
+
+    if journal.exists():
+        return journal.replay(), True
+
+    seeds = pd.read_csv(latest_seeds_file, header=None)[0].values
+    return [Walk(int(seed), "queued", None, True) for seed in seeds], False
+
+
+def shard_seeds_file(shard):
+    return f"latest_seeds_shard_{shard}.csv"
+
+
+def merge_shard_seeds(number_of_shards):
+    """Writes the latest seeds of all shards to latest_seeds.csv."""
+
+    seeds = [pd.read_csv(shard_seeds_file(shard), header=None)
+             for shard in range(number_of_shards) if os.path.isfile(shard_seeds_file(shard))]
+
+    if len(seeds) > 0:
+        pd.concat(seeds).to_csv('latest_seeds.csv', index=False, header=False)
+
+
+def run_shard(shard, seeds, broker_address, authkey, coordinator_kwargs, walker_kwargs):
+    """Runs walkers on `seeds` in a worker process started by `run_processes`."""
+
+    stop = Event()
+    install_stop_handlers(stop)
+
+    config = Config()
+    token_queue = TokenBroker.connect_to(broker_address, authkey)
+    reset_wheel = TokenBroker.connect_to_reset_wheel(broker_address, authkey)
+    coordinator = Coordinator(seed_list=seeds, token_queue=token_queue, reset_wheel=reset_wheel,
+                              latest_seeds_file=shard_seeds_file(shard), **coordinator_kwargs)
+
+    run_walkers(coordinator, stop,
+                on_walker_error=lambda text: notify(config, "Walker Error", text),
+                **walker_kwargs)
+
+
+def run_processes(processes, seeds, stop, coordinator_kwargs={}, restart=False,
+                  **walker_kwargs):
+    """Splits `seeds` into `processes` shards and runs the walkers of each shard in its own
+    process, so that parsing and data frame work of the walkers use several cores. The
+    processes share the tokens (and their rate limits) through a token_broker.TokenBroker.
+
+    A shard whose process ended with an error is restarted from its latest seeds, or from its
+    seeds at the start if it failed before saving latest seeds. The latest seeds of all shards
+    are merged into latest_seeds.csv every minute and at the end.
+
+    Args:
+        processes (int): number of worker processes
+        seeds (list of int)
+        stop (threading.Event): event to set to let all processes stop after their current steps
+        coordinator_kwargs (dict): arguments for the Coordinator of each shard
+        restart (bool): whether to continue after a restart
+        **walker_kwargs: arguments for `run_walkers` in each shard
+    Returns:
+        Nothing
+    """
+
+    latest_start_time = record_start_time(DataBaseHandler(), restart)
+
+    broker = TokenBroker.serve()
+    context = multiprocessing.get_context("spawn")
+
+    shards = [list(shard) for shard in np.array_split(np.asarray(seeds), processes)
+              if len(shard) > 0]
+
+    def start_shard(shard, shard_seeds, restart):
+        kwargs = dict(walker_kwargs, restart=restart, latest_start_time=latest_start_time)
+        process = context.Process(target=run_shard, name=f"shard {shard}",
+                                  args=(shard, shard_seeds, broker.address, broker.authkey,
+                                        coordinator_kwargs, kwargs))
+        process.start()
+        print(f"Started process of shard {shard} with {len(shard_seeds)} seeds.")
+        return process
+
+    running = {shard: start_shard(shard, shard_seeds, restart)
+               for shard, shard_seeds in enumerate(shards)}
+    last_merge = time.time()
+
+    try:
+        while len(running) > 0:
+            if stop.wait(timeout=1):
+                for process in running.values():
+                    process.terminate()  # SIGTERM, lets the walkers finish their steps
+                for process in running.values():
+                    process.join()
+                break
+
+            for shard, process in list(running.items()):
+                if process.is_alive():
+                    continue
+                del running[shard]
+                if process.exitcode != 0:
+                    stdout.write(f"Process of shard {shard} failed. Restarting it in 5 seconds.\n")
+                    stdout.flush()
+                    time.sleep(5)
+                    if os.path.isfile(shard_seeds_file(shard)):
+                        shard_seeds = list(pd.read_csv(shard_seeds_file(shard), header=None)[0])
+                    else:  # failed before saving its latest seeds
+                        shard_seeds = shards[shard]
+                    running[shard] = start_shard(shard, shard_seeds, True)
+
+            if time.time() - last_merge >= 60:
+                merge_shard_seeds(len(shards))
+                last_merge = time.time()
+    finally:
+        merge_shard_seeds(len(shards))
+        broker.shutdown()
+
 
 if __name__ == "__main__":
 
@@ -92,6 +378,30 @@ Lower values speed up collection. Default: 0 (unlimited)''', default=0)
     parser.add_argument('-b', '--bootstrap', help="at every step, add a seed's friends and followers \
 to the seed pool from which accounts are chosen randomly if walkers are at an impasse",
                         action="store_true")
+    parser.add_argument('-a', '--adjacency', help="keep an in-memory adjacency of all collected \
+friend lists to answer lookups without database queries", action="store_true")
+    parser.add_argument('--adjacency_file', help="directory to save the adjacency to on exit \
+and to memory-map it from on start (faster restarts)", default=None)
+    parser.add_argument('--prefetch', help="get friends and their details of the next seed \
+in the background while a walker finishes its step (uses spare tokens only)", action="store_true")
+    parser.add_argument('--prescreen', type=int, help="with -lt or -k, fetch the last tweets of \
+the PRESCREEN best candidates for the next seed at a time instead of one after another (uses \
+spare tokens only). Default: 0 (one after another)", default=0)
+    parser.add_argument('-w', '--workers', type=int, help="number of threads walking the seeds. \
+Can be lower than the number of seeds: a worker continues with whichever seed is ready next and \
+uses a token only while accessing the API. Default: number of seeds", default=None)
+    parser.add_argument('--processes', type=int, help="number of processes to split the seeds \
+(and workers) between, to use more than one CPU core. Default: 1", default=1)
+    parser.add_argument('--shared', help="coordinate with other machines (nodes) collecting \
+into the same database: tokens and walks are shared through lease tables in the database. \
+Seeds are only drawn if the shared crawl has none yet", action="store_true")
+    parser.add_argument('--node', help="name of this node in a --shared crawl. \
+Default: host name and process id", default=None)
+    parser.add_argument('--journal', help="file to record the steps of walkers in, to resume \
+every walk where it stopped with -r. Default: walker_journal.jsonl",
+                        default="walker_journal.jsonl")
+    parser.add_argument('--rounds', help="let all walkers wait for each other after every step \
+(behaviour of earlier versions)", action="store_true")
     parser.add_argument('-t', '--test', help="dev only: test for 2 loops only",
                         action="store_true")
     parser.add_argument('-f', '--fail', help="dev only: test unexpected exception",
@@ -99,6 +409,11 @@ to the seed pool from which accounts are chosen randomly if walkers are at an im
 
     args = parser.parse_args()
 
+    if args.processes > 1 and args.rounds:
+        parser.error("--rounds can only be used with a single process")
+    if args.shared and (args.processes > 1 or args.rounds):
+        parser.error("--shared can only be used with a single process and without --rounds")
+
     config = Config()
 
     user_details_list = []
@@ -106,65 +421,118 @@ to the seed pool from which accounts are chosen randomly if walkers are at an im
         if sqldatatype is not None:
             user_details_list.append(detail)
 
-    if args.restart:
-        latest_seeds_df = pd.read_csv('latest_seeds.csv', header=None)[0]
-        latest_seeds = list(latest_seeds_df.values)
-        coordinator = Coordinator(seed_list=latest_seeds,
-                                  following_pages_limit=args.following_pages_limit)
-        print("Restarting with latest seeds:\n")
-        print(latest_seeds_df)
-    else:
-        coordinator = Coordinator(seeds=args.seeds,
-                                  following_pages_limit=args.following_pages_limit)
+    coordinator_kwargs = dict(following_pages_limit=args.following_pages_limit,
+                              adjacency=args.adjacency,
+                              adjacency_file=args.adjacency_file,
+                              prefetch=args.prefetch,
+                              prescreen=args.prescreen)
 
-    k = 0
-    restart_counter = 0
+    if args.shared:
+        coordination = CrawlCoordination(DataBaseHandler(), node=args.node)
+        coordinator_kwargs['coordination'] = coordination
 
-    while True:
+    walker_kwargs = dict(select=user_details_list, status_lang=args.language,
+                         bootstrap=args.bootstrap, language_threshold=args.lthreshold,
+                         keywords=args.keywords, max_steps=2 if args.test else None,
+                         workers=args.workers)
 
-        if args.test:
-            k += 1
-            if k == 2:
-                args.fail = False
-            if k == 3:
-                break
-            stdout.write("\nTEST RUN {}\n".format(k))
-            stdout.flush()
+    stop = Event()
+    if not args.rounds:
+        install_stop_handlers(stop)
 
-        try:
-            if args.restart is True and restart_counter == 0:
+    if args.processes > 1:
+        if args.restart:
+            seeds = list(pd.read_csv('latest_seeds.csv', header=None)[0].values)
+            print("Restarting with latest seeds:\n")
+            print(seeds)
+        else:
+            seed_pool = SeedPool(FileImport().read_seeds(), is_sorted=True)
+            seeds = list(seed_pool.sample(n=args.seeds, replace=len(seed_pool) < args.seeds))
 
-                main_loop(coordinator, select=user_details_list,
-                          status_lang=args.language, test_fail=args.fail, restart=True,
-                          bootstrap=args.bootstrap, language_threshold=args.lthreshold,
-                          keywords=args.keywords)
-                restart_counter += 1
+        run_processes(args.processes, seeds, stop, coordinator_kwargs=coordinator_kwargs,
+                      restart=args.restart, test_fail=args.fail, **walker_kwargs)
+    else:
+        # walks are resumed from the journal instead of latest_seeds.csv, if it exists
+        journal = None
+        resumed = False
+        if not args.rounds and not args.shared:
+            journal = WalkerJournal(args.journal)
+            coordinator_kwargs['journal'] = journal
+
+        if args.restart and journal is not None:
+            walks, resumed = restart_walks(journal)
+            coordinator = Coordinator(seed_list=[], resume=walks, **coordinator_kwargs)
+            if resumed:
+                print(f"Resuming {len(walks)} walks from {args.journal}:\n")
             else:
-                main_loop(coordinator, select=user_details_list,
-                          status_lang=args.language, test_fail=args.fail, bootstrap=args.bootstrap,
-                          language_threshold=args.lthreshold, keywords=args.keywords)
-        except Exception:
-            stdout.write("Encountered unexpected exception:\n")
-            traceback.print_exc()
+                print("Restarting with latest seeds:\n")
+            print(pd.DataFrame(walks))
+        elif args.restart:
+            latest_seeds_df = pd.read_csv('latest_seeds.csv', header=None)[0]
+            latest_seeds = list(latest_seeds_df.values)
+            coordinator = Coordinator(seed_list=latest_seeds, **coordinator_kwargs)
+            print("Restarting with latest seeds:\n")
+            print(latest_seeds_df)
+        else:
+            coordinator = Coordinator(seeds=args.seeds, **coordinator_kwargs)
+
+        k = 0
+        restart_counter = 0
+
+        while True:
+
+            if args.test:
+                k += 1
+                if k == 2:
+                    args.fail = False
+                if k == 3:
+                    break
+                stdout.write("\nTEST RUN {}\n".format(k))
+                stdout.flush()
+
             try:
-                if config.use_notifications is True:
-                    response = config.send_mail({
-                        "subject": "Unexpected Error",
-                        "text":
-                            f"Unexpected Error encountered.\n{traceback.format_exc()}"
-                    }
-                    )
-                    assert '200' in str(response)
-                    stdout.write(f"Sent notification to {config.notif_config['email_to_notify']}")
-                    stdout.flush()
+                if not args.rounds:
+                    # in a shared crawl, the timetable and unburning after restarts concern
+                    # all nodes, so they are left out. Walks resumed from the journal go on
+                    # where they stopped, so nothing has to be unburned for them.
+                    run_walkers(coordinator, stop, test_fail=args.fail,
+                                restart=(args.restart is True and restart_counter == 0 and
+                                         not resumed),
+                                on_walker_error=lambda text: notify(config, "Walker Error", text),
+                                latest_start_time=0 if args.shared else None,
+                                **walker_kwargs)
+                    break
+                elif args.restart is True and restart_counter == 0:
+
+                    main_loop(coordinator, select=user_details_list,
+                              status_lang=args.language, test_fail=args.fail, restart=True,
+                              bootstrap=args.bootstrap, language_threshold=args.lthreshold,
+                              keywords=args.keywords)
+                    restart_counter += 1
+                else:
+                    main_loop(coordinator, select=user_details_list,
+                              status_lang=args.language, test_fail=args.fail,
+                              bootstrap=args.bootstrap, language_threshold=args.lthreshold,
+                              keywords=args.keywords)
             except Exception:
-                stderr.write('Could not send error-mail: \n')
-                traceback.print_exc(file=stderr)
-            stdout.write("Retrying in 5 seconds.")
-            stdout.flush()
-            latest_seeds = list(pd.read_csv('latest_seeds.csv', header=None)[0].values)
-            coordinator = Coordinator(seed_list=latest_seeds,
-                                      following_pages_limit=args.following_pages_limit)
-            args.restart = True
-            restart_counter = 0
-            time.sleep(5)
+                stdout.write("Encountered unexpected exception:\n")
+                traceback.print_exc()
+                notify(config, "Unexpected Error",
+                       f"Unexpected Error encountered.\n{traceback.format_exc()}")
+                stdout.write("Retrying in 5 seconds.")
+                stdout.flush()
+                if journal is not None:
+                    walks, resumed = restart_walks(journal)
+                    coordinator = Coordinator(seed_list=[], resume=walks, **coordinator_kwargs)
+                else:
+                    latest_seeds = list(pd.read_csv('latest_seeds.csv', header=None)[0].values)
+                    coordinator = Coordinator(seed_list=latest_seeds, **coordinator_kwargs)
+                args.restart = True
+                restart_counter = 0
+                stop.clear()
+                time.sleep(5)
+
+        if journal is not None:
+            journal.close()
+        if args.shared:
+            coordination.leave()
@@ -0,0 +1,14 @@
+# Reports the disk space taken by the friends cache in the configured storage layout
+# (see friends_storage in config.yml) compared to the other layout.
+from database_handler import DataBaseHandler
+
+
+if __name__ == "__main__":
+    report = DataBaseHandler(create_all=False).friends_storage_report()
+
+    print(f"Storage layout: {report['storage']}")
+    print(f"Stored friendships: {report['edges']}")
+    print(f"rows layout:   {report['rows_bytes'] / 2**20:.1f} MiB")
+    print(f"packed layout: {report['packed_bytes'] / 2**20:.1f} MiB")
+    if report['ratio'] is not None:
+        print(f"packed/rows:   {report['ratio']:.3f}")
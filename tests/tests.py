@@ -6,6 +6,7 @@ import os
 import queue
 import sqlite3 as lite
 import sys
+import tempfile
 import time
 import unittest
 import warnings
@@ -30,12 +31,21 @@ sys.path.insert(0, os.getcwd())
 import helpers
 import passwords
 import test_helpers
-from collector import (Collector, Connection, Coordinator, retry_x_times, get_latest_tweets,
-                       get_fraction_of_tweets_in_language)
+from adjacency import FriendsAdjacency
+from coordination import CrawlCoordination
+from collector import (Collector, Connection, Coordinator, FollowBackResolver, InFlightSeeds,
+                       Prefetcher, RankedCandidates, ResetWheel, RetryPolicy, RetryScheduler,
+                       StepMemo, TimelineScreener, UnavailableAccounts, Walker,
+                       get_fraction_of_tweets_in_language, get_latest_tweets, lease_spare_token,
+                       retry_x_times)
 from database_handler import DataBaseHandler
 from exceptions import TestException
+from journal import Walk, WalkerJournal
 from setup import Config, FileImport
-from start import main_loop
+from start import main_loop, restart_walks
+from token_broker import TokenBroker, TokenQueue
+from seed_pool import SeedPool
+from token_state import TokenStateStore
 
 parser = argparse.ArgumentParser(description='SparseTwitter TestSuite')
 parser.add_argument('-s', '--skip_draining_tests',
@@ -142,6 +152,17 @@ class FileImportTest(unittest.TestCase):
 
     # TODO: Check DataType of ID column of seeds.csv
 
+    def test_compiled_seed_file_is_memory_mapped(self):
+        directory = tempfile.mkdtemp()
+        compiled = os.path.join(directory, "seeds.npy")
+
+        self.assertEqual(FileImport().write_compiled_seed_file([3, 1, 2, 3], compiled), 3)
+
+        seeds = FileImport().read_seeds(os.path.join(directory, "seeds.csv"))
+        self.assertIsInstance(seeds, np.memmap)
+        self.assertEqual(list(seeds), [1, 2, 3])
+        self.assertIn(2, SeedPool(seeds, is_sorted=True))
+
     def test_read_token_file_raises_error_if_no_file(self):
         with self.assertRaises(FileNotFoundError):
             FileImport().read_token_file(filename='no_file.csv')
@@ -191,6 +212,14 @@ class DataBaseHandlerTest(unittest.TestCase):
             dbh.engine.execute("DROP TABLES user_details;")
         except Exception:
             pass
+        try:
+            dbh.engine.execute("DROP TABLES nodes;")
+        except Exception:
+            pass
+        try:
+            dbh.engine.execute("DROP TABLES friends_packed, friends_burned, friends_removed;")
+        except Exception:
+            pass
 
     config_dict_mysql = test_helpers.config_dict_mysql
     config_dict_sqlite = test_helpers.config_dict_sqlite
@@ -243,6 +272,48 @@ class DataBaseHandlerTest(unittest.TestCase):
         if dbh.config.dbtype == "sqlite":
             dbh.engine.close()
 
+    def test_timestamp_conditions_and_timetable(self):
+        dbh = DataBaseHandler(config_dict=self.config_dict_sqlite)
+        dbh.engine.execute("""INSERT INTO friends (source, target, burned, timestamp) VALUES
+                              (1, 2, 1, datetime('now', '-2 hours')), (1, 3, 1, datetime('now'))""")
+        dbh.engine.commit()
+
+        self.assertEqual(dbh.get_latest_start_time(), 0)
+        dbh.set_latest_start_time(time.time() - 3600)
+        self.assertAlmostEqual(dbh.get_latest_start_time(), time.time() - 3600, delta=5)
+
+        dbh.unburn_friends_after(dbh.get_latest_start_time())
+        self.assertEqual(list(dbh.read_friends(1, unburned_only=True)), [3])
+
+        query = f"SELECT target FROM friends WHERE {dbh.timestamp_after(0, inclusive=True)}"
+        self.assertEqual(len(dbh.engine.execute(query).fetchall()), 2)
+        dbh.engine.close()
+
+    def test_source_index_answers_is_source_from_memory(self):
+        dbh = DataBaseHandler(config_dict=self.config_dict_sqlite)
+        dbh.write_friends(1, [2, 3])
+        dbh.engine.execute("INSERT INTO result (source, target) VALUES (1, 2), (2, 1)")
+        dbh.engine.commit()
+
+        self.assertEqual(sorted(dbh.read_sources("result")), [1, 2])
+        self.assertEqual(len(dbh.read_sources("result", after=time.time() + 3600)), 0)
+
+        dbh.load_source_index()
+        self.assertTrue(dbh.is_source(1))
+        dbh.write_friends(4, [1])
+        dbh.write_friends(5, [])  # no rows, so no source
+        self.assertTrue(dbh.is_source(4))
+        self.assertFalse(dbh.is_source(5))
+
+        # friend lists written by another process are added by refreshing
+        dbh.engine.execute("INSERT INTO friends (source, target, burned) VALUES (6, 1, 0)")
+        dbh.engine.commit()
+        self.assertFalse(dbh.is_source(6))
+        dbh.load_source_index(after=time.time() - 60)
+        self.assertTrue(dbh.is_source(6))
+        self.assertTrue(dbh.is_source(4))
+        dbh.engine.close()
+
     def test_sql_connection_raises_error_if_credentials_are_wrong(self):
         wrong_cfg = copy.deepcopy(self.config_dict_mysql)
         wrong_cfg["sql"]["passwd"] = "wrong"
@@ -486,6 +557,102 @@ class DataBaseHandlerTest(unittest.TestCase):
 
         dbh.engine.execute("DROP TABLE " + temp_tbl_name + ";")
 
+    def test_nodes_table_is_refreshed_and_has_watermark(self):
+        dbh = DataBaseHandler(config_dict=self.config_dict_mysql)
+        dbh.engine.execute("""INSERT INTO user_details (id, followers_count)
+                              VALUES (1, 10), (2, 20), (3, 30)""")
+        dbh.write_result([(1, 2)])
+        time.sleep(1.1)
+
+        nodes, watermark = dbh.get_changed_nodes()
+        self.assertEqual(sorted(nodes['id']), [1, 2])
+
+        # 3 is not in result and must not be added,
+        # 1 is rewritten unchanged and must not count as changed
+        dbh.engine.execute("""REPLACE INTO user_details (id, followers_count)
+                              VALUES (1, 10), (2, 21), (3, 31)""")
+        dbh.write_result([(2, 1)])
+        time.sleep(1.1)
+
+        nodes, new_watermark = dbh.get_changed_nodes(since=watermark)
+        self.assertEqual(list(nodes['id']), [2])
+        self.assertEqual(nodes['followers_count'][0], 21)
+        self.assertGreater(new_watermark, watermark)
+
+        nodes, _ = dbh.get_changed_nodes(since=new_watermark)
+        self.assertEqual(len(nodes), 0)
+
+    def test_packed_friends_storage_behaves_like_rows(self):
+        packed_cfg = copy.deepcopy(self.config_dict_mysql)
+        packed_cfg["sql"]["friends_storage"] = "packed"
+
+        for cfg in [self.config_dict_mysql, packed_cfg]:
+            dbh = DataBaseHandler(config_dict=cfg)
+            dbh.write_friends(1, [5, 3, 4])
+            dbh.write_friends(1, [6, 3])
+
+            self.assertEqual(sorted(dbh.read_friends(1)), [3, 4, 5, 6])
+            self.assertTrue(dbh.is_source(1))
+            self.assertFalse(dbh.is_source(2))
+            self.assertTrue(dbh.follows(1, 4))
+            self.assertFalse(dbh.follows(1, 7))
+
+            self.assertTrue(dbh.burn_friend(1, 4))
+            self.assertFalse(dbh.burn_friend(1, 4))
+            self.assertEqual(sorted(dbh.read_friends(1, unburned_only=True)), [3, 5, 6])
+
+            report = dbh.friends_storage_report()
+            self.assertEqual(report['edges'], 4)
+            self.assertGreater(report['rows_bytes'], 0)
+
+            dbh.remove_friend_target(5)
+            self.assertEqual(sorted(dbh.read_friends(1)), [3, 4, 6])
+
+    def test_concurrent_packed_writes_keep_all_friends(self):
+        packed_cfg = copy.deepcopy(self.config_dict_sqlite)
+        packed_cfg["sql"]["friends_storage"] = "packed"
+        dbh = DataBaseHandler(config_dict=packed_cfg)
+        other = DataBaseHandler(config_dict=packed_cfg)
+        dbh.write_friends(1, [3, 4, 5])
+
+        # another node writes friends of 1 between the read and the write of dbh
+        write = dbh._execute_packed
+
+        def interleaved_write(query, parameters):
+            if not other.is_source(2):
+                other.write_friends(1, [7, 8])
+                other.write_friends(2, [])
+            return write(query, parameters)
+
+        dbh._execute_packed = interleaved_write
+        dbh.write_friends(1, [6])
+
+        self.assertEqual(list(dbh.read_friends(1)), [3, 4, 5, 6, 7, 8])
+
+        other.remove_friend_target(4)
+        self.assertEqual(list(other.read_friends(1)), [3, 5, 6, 7, 8])
+        self.assertTrue(dbh.follows(1, 4))
+        dbh.read_removed_targets(reload=True)
+        self.assertFalse(dbh.follows(1, 4))
+
+    def test_result_and_its_nodes_are_written_together(self):
+        dbh = DataBaseHandler(config_dict=self.config_dict_sqlite)
+        dbh.engine.execute("""INSERT INTO user_details (id, followers_count)
+                              VALUES (1, 10), (2, 20), (3, 30)""")
+        dbh.write_result([(1, 2), (2, 1)])
+        dbh.write_result([(1, 2)])  # written again by a retried step
+
+        self.assertEqual(sorted(dbh.engine.execute("SELECT source, target FROM result")),
+                         [(1, 2), (2, 1)])
+        nodes, _ = dbh.get_changed_nodes(settle=0)
+        self.assertEqual(sorted(nodes['id']), [1, 2])
+
+    def test_pack_ids_roundtrip(self):
+        ids = [5, 2**40, 3, 3, 17]
+        unpacked = helpers.unpack_ids(helpers.pack_ids(ids))
+        self.assertIsInstance(unpacked, np.ndarray)
+        self.assertEqual(list(unpacked), [3, 5, 17, 2**40])
+
 
 class ConfigTest(unittest.TestCase):
 
@@ -658,6 +825,40 @@ class CollectorTest(unittest.TestCase):
         token = connection.token_queue.get()
         self.assertIsInstance(token[2], dict)
 
+    def test_lazy_connection_leases_token_only_while_using_api(self):
+        token_queue = mp.Queue()
+        token_queue.put(('a', 'b', {}, {}))
+        connection = Connection(token_queue=token_queue, lazy=True)
+        self.assertIsNone(connection.token)
+        self.assertEqual(token_queue.qsize(), 1)
+
+        self.assertIsNotNone(connection.api)
+        self.assertEqual(connection.token, 'a')
+        self.assertEqual(token_queue.qsize(), 0)
+
+        connection.release()
+        connection.release()
+        self.assertIsNone(connection.token)
+        self.assertEqual(token_queue.qsize(), 1)
+
+    def test_lease_returns_token_with_its_state_on_any_exit(self):
+        token_queue = mp.Queue()
+        token_queue.put(('a', 'b', {}, {}))
+        connection = Connection(token_queue=token_queue, lazy=True)
+
+        with connection.lease():
+            pass  # no API access, no token taken
+        self.assertEqual(token_queue.qsize(), 1)
+
+        with self.assertRaises(tweepy.RateLimitError):
+            with connection.lease():
+                connection.api
+                connection.calls_dict['/friends/ids'] = 0
+                raise tweepy.RateLimitError("testing")
+
+        self.assertIsNone(connection.token)
+        self.assertEqual(token_queue.get(block=False), ('a', 'b', {}, {'/friends/ids': 0}))
+
     def test_collector_can_connect_with_correct_credentials(self):
 
         
@@ -934,6 +1135,18 @@ class CoordinatorTest(unittest.TestCase):
 
     db_name = Config(config_dict=config_dict_sql).dbname
 
+    class DatabaseOnlyConnection(Connection):
+        """Connection whose API cannot get friends or their details, so that a step has to
+        rely on the database. Follow-back checks still go to Twitter."""
+
+        class API(object):
+            def __init__(self, api):
+                self.show_friendship = api.show_friendship
+
+        @property
+        def api(self):
+            return self.API(Connection.api.fget(self))
+
     @classmethod
     def setUpClass(self):
         if os.path.isfile("seeds.csv"):
@@ -1078,9 +1291,11 @@ class CoordinatorTest(unittest.TestCase):
         self.assertEqual(new_seed, expected_new_seed)
 
         # destroy Twitter connection and rely on database
+        connection = self.DatabaseOnlyConnection(token_queue=self.coordinator.token_queue,
+                                                 lazy=True)
         try:
             new_seed = self.coordinator.work_through_seed_get_next_seed(seed,
-                                                                        connection="fail",
+                                                                        connection=connection,
                                                                         retries=1)
             self.assertEqual(new_seed, expected_new_seed_2)
         except AttributeError:
@@ -1295,13 +1510,32 @@ class CoordinatorTest(unittest.TestCase):
 
         new_number_of_seeds_in_pool = len(coordinator_with_bootstrap_enabled.seed_pool)
 
-        self.assertIn(939091, coordinator_with_bootstrap_enabled.seed_pool[0].values)
+        self.assertIn(939091, coordinator_with_bootstrap_enabled.seed_pool)
         # FlxVctr is following Joe Biden but not vice versa so Biden should be in seed pool
-        self.assertIn(3009677047, coordinator_with_bootstrap_enabled.seed_pool[0].values)
+        self.assertIn(3009677047, coordinator_with_bootstrap_enabled.seed_pool)
         # FlxVctr is not following this account but vice versa so it should be in seed pool
 
         self.assertGreater(new_number_of_seeds_in_pool, number_of_seeds_in_pool)
-        self.assertEqual(len(coordinator_with_bootstrap_enabled.seed_pool.columns), 1)
+        seeds = coordinator_with_bootstrap_enabled.seed_pool.to_array()
+        self.assertEqual(len(np.unique(seeds)), len(seeds))
+
+    def test_bootstrap_reads_only_new_user_details(self):
+        self.dbh.engine.execute("""INSERT INTO user_details (id, followers_count, timestamp)
+                                   VALUES (11, 1, NOW() - INTERVAL 1 DAY), (12, 1, NOW())""")
+
+        self.coordinator.bootstrap_seed_pool(after_timestamp=time.time() - 3600)
+        self.assertIn(12, self.coordinator.seed_pool)
+        self.assertNotIn(11, self.coordinator.seed_pool)
+        self.assertGreaterEqual(self.coordinator.bootstrap_watermark, time.time() - 3600)
+
+        # only rows after the watermark (minus the overlap) are read again
+        self.dbh.engine.execute("""INSERT INTO user_details (id, followers_count, timestamp)
+                                   VALUES (13, 1, NOW()), (14, 1, NOW() - INTERVAL 1 HOUR)""")
+        self.coordinator.bootstrap_seed_pool()
+        self.assertIn(13, self.coordinator.seed_pool)
+        self.assertNotIn(14, self.coordinator.seed_pool)
+
+        self.dbh.engine.execute("DELETE FROM user_details WHERE id IN (11, 12, 13, 14)")
 
     def test_overlapping_friends(self):
 
@@ -1394,6 +1628,881 @@ class CoordinatorTest(unittest.TestCase):
         self.assertGreater(last_seed_pool_size, middle_seed_pool_size)
 
 
+class FriendsAdjacencyTest(unittest.TestCase):
+
+    config_dict_sqlite = test_helpers.config_dict_sqlite
+    db_name = Config(config_dict=config_dict_sqlite).dbname
+
+    def tearDown(self):
+        if os.path.isfile(self.db_name + ".db"):
+            os.remove(self.db_name + ".db")
+
+    def test_lookups_burning_and_merging(self):
+        adjacency = FriendsAdjacency(capacity=2)
+        adjacency.add_friends(1, [5, 3, 4])
+        adjacency.add_friends(2, [1])
+
+        self.assertTrue(adjacency.has_source(2))
+        self.assertFalse(adjacency.has_source(3))
+        self.assertTrue(adjacency.follows(2, 1))
+        self.assertFalse(adjacency.follows(1, 2))
+
+        adjacency.set_burned(1, 4)
+        adjacency.add_friends(1, [7, 4])
+        self.assertEqual(list(adjacency.neighbors(1)), [3, 4, 5, 7])
+        self.assertEqual(list(adjacency.neighbors(1, unburned_only=True)), [3, 5, 7])
+
+        adjacency.remove_target(5)
+        self.assertEqual(list(adjacency.neighbors(1)), [3, 4, 7])
+        self.assertFalse(adjacency.follows(1, 5))
+
+    def test_save_and_memory_map(self):
+        with tempfile.TemporaryDirectory() as directory:
+            adjacency = FriendsAdjacency(backing_file=directory)
+            adjacency.add_friends(1, [5, 3, 4], burned=[False, False, True])
+            adjacency.add_friends(2, [1])
+            adjacency.save()
+
+            loaded = FriendsAdjacency(backing_file=directory)
+            loaded._load_backing_file()
+            self.assertEqual(len(loaded), 2)
+            self.assertEqual(list(loaded.neighbors(1, unburned_only=True)), [3, 5])
+
+            loaded.set_burned(1, 3)
+            loaded.add_friends(2, [6])
+            self.assertEqual(list(loaded.neighbors(1, unburned_only=True)), [5])
+            self.assertEqual(list(loaded.neighbors(2)), [1, 6])
+
+    def test_refresh_and_load_see_writes_of_other_processes(self):
+        packed_cfg = copy.deepcopy(self.config_dict_sqlite)
+        packed_cfg["sql"]["friends_storage"] = "packed"
+        dbh = DataBaseHandler(config_dict=packed_cfg)
+        other = DataBaseHandler(config_dict=packed_cfg)
+        dbh.write_friends(1, [3, 4, 5])
+
+        with tempfile.TemporaryDirectory() as directory:
+            adjacency = FriendsAdjacency(backing_file=directory)
+            adjacency.load(dbh)
+            dbh.adjacency = adjacency
+
+            other.write_friends(1, [6])
+            other.write_friends(2, [1])
+            other.burn_friend(1, 4)
+            other.remove_friend_target(5)
+            other.engine.commit()
+            adjacency.refresh(dbh, overlap=2)
+
+            self.assertTrue(dbh.is_source(2))
+            self.assertTrue(dbh.follows(2, 1))
+            self.assertEqual(list(dbh.read_friends(1)), [3, 4, 6])
+            self.assertEqual(list(dbh.read_friends(1, unburned_only=True)), [3, 6])
+            adjacency.save()
+
+            # the saved burned flag of (1)-->(4) is outdated once another process unburns it
+            other.unburn_friends_after(0)
+            other.engine.commit()
+            loaded = FriendsAdjacency(backing_file=directory)
+            loaded.load(dbh)
+            self.assertEqual(list(loaded.neighbors(1, unburned_only=True)), [3, 4, 6])
+
+
+class FollowBackResolverTest(unittest.TestCase):
+
+    config_dict_sqlite = test_helpers.config_dict_sqlite
+    db_name = Config(config_dict=config_dict_sqlite).dbname
+
+    def tearDown(self):
+        if os.path.isfile(self.db_name + ".db"):
+            os.remove(self.db_name + ".db")
+
+    def test_resolves_from_collected_lists_before_api(self):
+        dbh = DataBaseHandler(config_dict=self.config_dict_sqlite)
+        dbh.write_friends(1, [2, 3])
+        dbh.engine.commit()
+        resolver = FollowBackResolver(dbh)
+
+        self.assertTrue(resolver.resolve(source=1, target=2))
+        self.assertFalse(resolver.resolve(source=1, target=4))
+
+        # partial friend list of 5: only a hit is conclusive
+        resolver.add_friends(5, [1])
+        self.assertTrue(resolver.resolve(source=5, target=1))
+        self.assertIsNone(resolver.resolve(source=5, target=2))
+
+        # complete follower list of 2
+        resolver.add_followers(2, [6, 7], complete=True)
+        self.assertTrue(resolver.resolve(source=6, target=2))
+        self.assertFalse(resolver.resolve(source=8, target=2))
+
+        resolver.count_api_call()
+        stats = resolver.stats()
+        self.assertEqual(stats['stored_friends'], 2)
+        self.assertEqual(stats['friend_lists'], 1)
+        self.assertEqual(stats['follower_lists'], 2)
+        self.assertEqual(stats['api'], 1)
+        self.assertEqual(stats['hit_rate'], 5 / 6)
+        dbh.engine.close()
+
+
+class UnavailableAccountsTest(unittest.TestCase):
+
+    config_dict_sqlite = test_helpers.config_dict_sqlite
+    db_name = Config(config_dict=config_dict_sqlite).dbname
+
+    def tearDown(self):
+        if os.path.isfile(self.db_name + ".db"):
+            os.remove(self.db_name + ".db")
+
+    def test_unavailable_accounts_are_kept_and_pruned_from_seed_pool(self):
+        self.assertEqual(UnavailableAccounts.classify(tweepy.TweepError("Not authorized.")),
+                         "protected")
+        self.assertEqual(UnavailableAccounts.classify(tweepy.TweepError(
+            "[{'code': 63, 'message': 'User has been suspended.'}]")), "suspended")
+        self.assertEqual(UnavailableAccounts.classify(tweepy.TweepError(
+            "[{'code': 50, 'message': 'User not found.'}]")), "not_found")
+        self.assertIsNone(UnavailableAccounts.classify(tweepy.TweepError("Rate limit")))
+
+        dbh = DataBaseHandler(config_dict=self.config_dict_sqlite)
+        seed_pool = SeedPool([1, 2, 3, 4])
+        unavailable = UnavailableAccounts(dbh, seed_pool)
+        unavailable.add(1, "protected")
+        unavailable.add(2, "not_found")
+        dbh.write_unavailable_account(3, "suspended", time.time() - 1)  # expired
+
+        self.assertEqual(unavailable.reason(1), "protected")
+        self.assertNotIn(4, unavailable)
+        self.assertEqual(list(unavailable.available([1, 2, 3, 4])), [False, False, True, True])
+        self.assertEqual(sorted(seed_pool.to_array()), [3, 4])
+
+        # a restarted crawler knows them and prunes them from its (new) seed pool
+        seed_pool = SeedPool([1, 2, 3, 4])
+        unavailable = UnavailableAccounts(dbh, seed_pool)
+        self.assertEqual(sorted(seed_pool.to_array()), [3, 4])
+        self.assertEqual(unavailable.stats()['known'], 2)
+        self.assertEqual(len(dbh.read_unavailable_accounts()), 2)
+        dbh.engine.close()
+
+
+class PrefetcherTest(unittest.TestCase):
+
+    class TestPrefetcher(Prefetcher):
+        def _fetch(self, seed, token):
+            self.token_queue.put(token)
+            return [seed + 1], True, []
+
+    def test_prefetch_respects_token_budgets(self):
+        token_queue = mp.Queue()
+        token_queue.put(('a', 'a', {'/friends/ids': time.time() + 900}, {'/friends/ids': 0}))
+        prefetcher = self.TestPrefetcher(token_queue, min_free_tokens=1)
+
+        # the only token is left for the walkers
+        self.assertFalse(prefetcher.start(1))
+
+        # the free token has no calls left
+        token_queue.put(('b', 'b', {}, {}))
+        self.assertFalse(prefetcher.start(1))
+        self.assertEqual(token_queue.qsize(), 2)
+        self.assertEqual(prefetcher.stats()['no_token'], 2)
+
+    def test_prefetched_results_are_used_or_discarded(self):
+        token_queue = mp.Queue()
+        token_queue.put(('a', 'a', {}, {}))
+        token_queue.put(('b', 'b', {}, {}))
+        prefetcher = self.TestPrefetcher(token_queue, min_free_tokens=1, max_age=0.5)
+
+        self.assertTrue(prefetcher.start(1))
+        self.assertEqual(prefetcher.take(1), ([2], True, []))
+        self.assertIsNone(prefetcher.take(1))
+
+        self.assertTrue(prefetcher.start(2))
+        time.sleep(0.6)
+        prefetcher.start(3)
+        self.assertIsNone(prefetcher.take(2))
+
+        stats = prefetcher.stats()
+        self.assertEqual(stats['used'], 1)
+        self.assertEqual(stats['discarded'], 1)
+
+    def test_rate_limited_token_is_put_back_throttled(self):
+        class Response(object):
+            url = 'https://api.twitter.com/1.1/users/lookup.json?user_id=1'
+            headers = {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': '2000000000'}
+
+        token_queue = TokenQueue()
+        token_queue.put(('b', 'b', {}, {}))
+        for token, response in [(('a', 'a', {}, {}), None), (('c', 'c', {}, {}), Response())]:
+            connection = Connection(token_queue=token_queue, lazy=True)
+            connection.hold(token)
+            with self.assertRaises(tweepy.RateLimitError):
+                with connection.lease(Prefetcher.endpoints):
+                    raise tweepy.RateLimitError("Rate limit exceeded", response)
+
+        self.assertEqual(token_queue.take('b'), ('b', 'b', {}, {}))
+        a, c = token_queue.take('a'), token_queue.take('c')
+        self.assertEqual(a[3], {'/friends/ids': 0, '/users/lookup': 0})
+        self.assertEqual(c[2:], ({'/users/lookup': 2000000000.0}, {'/users/lookup': 0}))
+        for token in [a, c]:
+            token_queue.put(token)
+            self.assertIsNone(lease_spare_token(token_queue, Prefetcher.endpoints, 0))
+            token_queue.take(token[0])
+
+
+class StepMemoTest(unittest.TestCase):
+
+    def test_retried_step_resumes_after_completed_stages(self):
+        memo = StepMemo()
+        calls = []
+
+        def fetch(name, fail=False):
+            def compute():
+                calls.append(name)
+                if fail:
+                    raise TestException
+                return name
+            return compute
+
+        def step(fail):
+            memo.get(1, "friends", fetch("friends"))
+            return memo.get(1, "details", fetch("details", fail=fail))
+
+        self.assertRaises(TestException, step, True)
+        self.assertEqual(step(False), "details")
+        self.assertEqual(calls, ["friends", "details", "details"])
+        self.assertEqual(memo.stats(), {'stored': 2, 'reused': 1})
+
+        memo.done(1)
+        self.assertIsNone(memo.lookup(1, "friends"))
+
+    def test_stages_expire(self):
+        memo = StepMemo(max_age=0.2)
+        memo.put(1, "friends", [2, 3])
+        self.assertEqual(memo.lookup(1, "friends"), [2, 3])
+        time.sleep(0.3)
+        self.assertIsNone(memo.lookup(1, "friends"))
+
+
+class RankedCandidatesTest(unittest.TestCase):
+
+    def test_candidates_by_followers_count(self):
+        friends_details = pd.DataFrame({'id': [1, 2, 3, 4, 5],
+                                        'followers_count': [10, 30, None, 30, 20]})
+        candidates = RankedCandidates(friends_details)
+
+        self.assertEqual(len(candidates), 5)
+        self.assertEqual(candidates.best(), 2)  # first of the tie, like idxmax
+        self.assertEqual(candidates.reject(), 4)
+        self.assertEqual(candidates.reject(), 5)
+        self.assertEqual(candidates.reject(), 1)
+        self.assertEqual(candidates.reject(), 3)  # without followers count
+        self.assertIsNone(candidates.reject())
+        self.assertEqual(len(candidates), 0)
+        self.assertEqual(len(RankedCandidates(friends_details[friends_details['id'] > 5])), 0)
+
+
+class TimelineScreenerTest(unittest.TestCase):
+
+    class TestScreener(TimelineScreener):
+        def _fetch(self, key, token):
+            candidate = key[1]
+            time.sleep(0.1)
+            self.token_queue.put(token)
+            if candidate == 12:
+                raise tweepy.TweepError("Not authorized.")
+            if candidate == 13:
+                raise ConnectionError()
+            return pd.DataFrame({'lang': ['de'], 'full_text': [f"tweet of {candidate}"]})
+
+    def test_next_candidates_are_screened_with_spare_tokens(self):
+        token_queue = mp.Queue()
+        for token in ['a', 'b']:
+            token_queue.put((token, token, {}, {}))
+        screener = self.TestScreener(token_queue, candidates=3, min_free_tokens=1)
+
+        candidates = RankedCandidates(pd.DataFrame({'id': [10, 11, 12, 13],
+                                                    'followers_count': [4, 3, 2, 1]}))
+        screener.start(1, candidates.upcoming(2))  # one token is left for the walkers
+        self.assertEqual(screener.stats()['started'], 1)
+        self.assertEqual(screener.stats()['no_token'], 1)
+
+        self.assertIsNone(screener.take(1, 10))  # the step fetches the current one itself
+        self.assertEqual(screener.take(1, 11)['full_text'][0], "tweet of 11")
+
+        screener.start(1, [12, 13])
+        self.assertRaises(tweepy.TweepError, screener.take, 1, 12)
+        screener.start(1, [13])
+        self.assertIsNone(screener.take(1, 13))  # fetched by the step again
+
+        screener.start(2, [10])
+        screener.discard(2)
+        time.sleep(0.2)
+        self.assertEqual(token_queue.qsize(), 2)
+        self.assertEqual(screener.stats(), {'started': 4, 'used': 1, 'discarded': 1,
+                                            'no_token': 2, 'failed': 1})
+
+
+class WalkerTest(unittest.TestCase):
+
+    class TestCoordinator(object):
+        def __init__(self, seeds, durations={}, failing=set(), errors={}):
+            self.seed_queue = mp.Queue()
+            self.token_queue = mp.Queue()
+            for seed in seeds:
+                self.seed_queue.put(seed)
+            for token in ['a', 'b']:
+                self.token_queue.put((token, token, {}, {}))
+            self.durations = durations
+            self.failing = failing
+            self.errors = dict(errors)  # seed -> error raised by its first step
+
+        def work_through_seed_get_next_seed(self, seed, connection=None, **kwargs):
+            time.sleep(self.durations.get(seed, 0.01))
+            if seed in self.failing:
+                raise TestException
+            if seed in self.errors:
+                raise self.errors.pop(seed)
+            connection.release()
+            self.seed_queue.put(seed)
+            return seed
+
+    class TestWalker(Walker):
+        def connect(self):
+            # an offline connection holding a token
+            connection = Connection.__new__(Connection)
+            connection.token_queue = self.coordinator.token_queue
+            (connection.token, connection.secret,
+             connection.reset_time_dict, connection.calls_dict) = connection.token_queue.get()
+            return connection
+
+    def test_walkers_do_not_wait_for_each_other_and_drain(self):
+        coordinator = self.TestCoordinator([1, 2], durations={2: 0.5})
+        stop = mp.Event()
+        walkers = [self.TestWalker(coordinator, stop, name=str(i)) for i in range(2)]
+        for walker in walkers:
+            walker.start()
+
+        time.sleep(0.3)
+        stop.set()
+        for walker in walkers:
+            walker.join(timeout=5)
+            self.assertFalse(walker.is_alive())
+
+        steps = sorted(walker.steps for walker in walkers)
+        self.assertLessEqual(steps[0], 1)
+        self.assertGreater(steps[1], 5)
+
+        # seeds and tokens are back in their queues
+        self.assertEqual(coordinator.seed_queue.qsize(), 2)
+        self.assertEqual(coordinator.token_queue.qsize(), 2)
+
+    def test_failed_step_returns_seed_and_token(self):
+        coordinator = self.TestCoordinator([3], failing={3})
+        walker = self.TestWalker(coordinator, mp.Event(), max_steps=1)
+        walker.start()
+        walker.join(timeout=5)
+
+        self.assertIsInstance(walker.err, TestException)
+        self.assertIsNone(walker.current_seed)
+        self.assertEqual(coordinator.seed_queue.get(block=False), 3)
+        self.assertEqual(coordinator.token_queue.qsize(), 2)
+
+    def test_transient_error_is_retried_later_while_walking_on(self):
+        class FastPolicy(RetryPolicy):
+            backoff = {'transient': (0.3, 0.3, 1)}
+
+        coordinator = self.TestCoordinator([4, 5], durations={5: 0.1},
+                                           errors={4: ConnectionError()})
+        coordinator.retry_scheduler = RetryScheduler(coordinator.seed_queue, FastPolicy())
+        walker = self.TestWalker(coordinator, mp.Event(), max_steps=5)
+        walker.start()
+
+        time.sleep(0.1)
+        self.assertEqual(coordinator.retry_scheduler.pending(), [4])
+        walker.join(timeout=5)
+
+        self.assertIsNone(walker.err)
+        self.assertEqual(walker.steps, 5)
+        self.assertEqual(coordinator.retry_scheduler.pending(), [])
+        self.assertEqual(sorted(coordinator.seed_queue.queue), [4, 5])
+        self.assertEqual(coordinator.token_queue.qsize(), 2)
+
+    def test_seed_failing_repeatedly_is_dropped(self):
+        class NoRetryPolicy(RetryPolicy):
+            backoff = {}
+
+        coordinator = self.TestCoordinator([6], failing={6})
+        coordinator.retry_scheduler = RetryScheduler(coordinator.seed_queue, NoRetryPolicy())
+        coordinator.seed_pool = SeedPool([6, 8])
+        for i in range(RetryPolicy.max_failures):
+            walker = self.TestWalker(coordinator, mp.Event(), max_steps=1)
+            walker.start()
+            walker.join(timeout=5)
+
+        # the first failures end the walker, the last drops the seed for a fresh one
+        self.assertIsNone(walker.err)
+        self.assertEqual(list(coordinator.seed_queue.queue), [8])
+        self.assertEqual(coordinator.retry_scheduler.stats()['dropped'], 1)
+        self.assertEqual(coordinator.token_queue.qsize(), 2)
+
+    def test_seed_queued_twice_is_walked_once(self):
+        coordinator = self.TestCoordinator([7, 7], durations={7: 0.3})
+        coordinator.in_flight = InFlightSeeds(coordinator.seed_queue, redirect=False)
+        stop = mp.Event()
+        walkers = [self.TestWalker(coordinator, stop, name=str(i)) for i in range(2)]
+        for walker in walkers:
+            walker.start()
+
+        time.sleep(0.2)
+        self.assertEqual(list(coordinator.in_flight.working()), [7])
+        self.assertEqual(coordinator.seed_queue.qsize(), 0)
+        stop.set()
+        for walker in walkers:
+            walker.join(timeout=5)
+
+        self.assertEqual(coordinator.in_flight.stats()['merged'], 1)
+        self.assertEqual(list(coordinator.seed_queue.queue), [7])
+        self.assertEqual(coordinator.in_flight.working(), {})
+
+
+class ResetWheelTest(unittest.TestCase):
+
+    def test_every_reset_wakes_one_waiter(self):
+        wheel = ResetWheel(max_wait=2)
+        now = time.time()
+        wheel.throttled('a', '/friends/ids', now + 0.2)
+        wheel.throttled('b', '/friends/ids', now + 0.4)
+        wheel.throttled('a', '/friends/ids', now + 0.2)  # reported twice
+
+        woken = []
+
+        def waiter():
+            woken.append((wheel.wait('/friends/ids'), time.time() - now))
+
+        waiters = [mp.Process(target=waiter) for i in range(3)]
+        for w in waiters:
+            w.start()
+        for w in waiters:
+            w.join(timeout=5)
+
+        self.assertEqual([token for token, _ in woken], ['a', 'b', None])
+        self.assertGreaterEqual(woken[0][1], 0.2)
+        self.assertLess(woken[1][1], 1)
+
+    def test_connection_waits_for_reset_without_rotating_tokens(self):
+        endpoint = '/friends/ids'
+        token_queue = TokenQueue()
+        # b is first in the queue when the window of a resets
+        token_queue.put(('b', 'b', {endpoint: time.time() + 60}, {endpoint: 0}))
+        token_queue.put(('a', 'a', {endpoint: time.time() + 0.3}, {endpoint: 0}))
+
+        # an offline connection
+        connection = Connection.__new__(Connection)
+        connection.ctoken, connection.csecret = 'key', 'secret'
+        connection.token_queue = token_queue
+        connection.reset_wheel = ResetWheel()
+        connection.token = None
+
+        start = time.time()
+        connection.wait_for_reset(endpoint)
+
+        self.assertEqual(connection.token, 'a')
+        self.assertGreaterEqual(time.time() - start, 0.25)
+        self.assertEqual(token_queue.qsize(), 1)
+        self.assertIsNone(token_queue.take('a'))
+
+
+class SeedPoolTest(unittest.TestCase):
+
+    def test_add_remove_and_sample(self):
+        pool = SeedPool([5, 3, 3, 1])
+        self.assertEqual(len(pool), 3)
+
+        self.assertEqual(pool.add([3, 7, 7, 9]), 2)
+        self.assertEqual(len(pool), 5)
+        self.assertIn(7, pool)
+
+        self.assertTrue(pool.remove(7))  # added seed, swapped with 9
+        self.assertTrue(pool.remove(3))  # seed of the sorted array
+        self.assertFalse(pool.remove(3))
+        self.assertNotIn(3, pool)
+        self.assertEqual(sorted(pool.to_array()), [1, 5, 9])
+
+        for i in range(20):
+            self.assertIn(pool.sample(n=1)[0], [1, 5, 9])
+        self.assertEqual(sorted(pool.sample(n=3)), [1, 5, 9])
+        self.assertRaises(ValueError, pool.sample, n=4)
+        self.assertEqual(len(pool.sample(n=4, replace=True)), 4)
+
+        # removing more than half of the sorted array compacts it
+        pool.remove(1)
+        self.assertEqual(list(pool.base), [5])
+        self.assertEqual(pool.add([1, 3]), 2)
+        self.assertEqual(sorted(pool.to_array()), [1, 3, 5, 9])
+
+
+class TokenStateStoreTest(unittest.TestCase):
+
+    def test_state_of_tokens_survives_restart_until_reset(self):
+        path = os.path.join(tempfile.mkdtemp(), "token_state.json")
+
+        store = TokenStateStore(path)
+        reset_time_dict, calls_dict = store.restore('secret_token')
+        self.assertEqual((reset_time_dict, calls_dict), ({}, {}))
+
+        # state changes while the token is used
+        reset_time_dict.update({'/friends/ids': time.time() + 60, '/users/lookup': time.time()})
+        calls_dict.update({'/friends/ids': 0, '/users/lookup': 0})
+        store.save()
+
+        with open(path) as f:
+            self.assertNotIn('secret_token', f.read())
+
+        reset_time_dict, calls_dict = TokenStateStore(path).restore('secret_token')
+        self.assertEqual(calls_dict, {'/friends/ids': 0})  # the other window has reset
+        self.assertGreater(reset_time_dict['/friends/ids'], time.time())
+        self.assertEqual(TokenStateStore(path).restore('other_token'), ({}, {}))
+
+    def test_remaining_calls_are_recorded_from_response_headers(self):
+        class API(object):
+            class last_response(object):
+                url = 'https://api.twitter.com/1.1/friends/ids.json?user_id=1'
+                headers = {'x-rate-limit-remaining': '14', 'x-rate-limit-reset': '2000000000'}
+
+        connection = Connection(token_queue=TokenQueue(), lazy=True)
+        connection.hold(('a', 'a', {}, {'/users/lookup': 1}))
+        connection.api = API()
+        connection.record('/friends/ids')
+        self.assertEqual(connection.calls_dict['/friends/ids'], 14)
+        self.assertEqual(connection.reset_time_dict['/friends/ids'], 2000000000.0)
+
+        # without headers the remaining calls are unknown
+        connection.api = None
+        connection.record('/users/lookup')
+        self.assertNotIn('/users/lookup', connection.calls_dict)
+
+
+class RetrySchedulerTest(unittest.TestCase):
+
+    def test_errors_are_classified_and_retried_with_backoff(self):
+        policy = RetryPolicy()
+        self.assertEqual(policy.classify(tweepy.RateLimitError("limit")), "rate_limit")
+        self.assertEqual(policy.classify(tweepy.TweepError("Failed to send request: timeout")),
+                         "transient")
+        self.assertEqual(policy.classify(lite.OperationalError("database is locked")),
+                         "database")
+        self.assertEqual(policy.classify(TestException()), "unknown")
+        self.assertEqual(policy.classify(IntegrityError("INSERT", {}, None)), "permanent")
+
+        for attempt in range(5):
+            self.assertGreaterEqual(policy.delay("transient", attempt), 2**attempt)
+            self.assertLessEqual(policy.delay("transient", attempt), 2**(attempt + 1))
+        self.assertLessEqual(policy.delay("rate_limit", 9), 900)
+        self.assertIsNone(policy.delay("rate_limit", 10))
+        self.assertIsNone(policy.delay("unknown", 3))
+        self.assertIsNone(policy.delay("permanent", 0))
+
+        scheduler = RetryScheduler(mp.Queue())
+        permanent = IntegrityError("INSERT", {}, None)
+        self.assertIsNone(scheduler.retry(1, permanent))
+        kind, delay = scheduler.retry(2, ConnectionError())
+        self.assertEqual(kind, "transient")
+        self.assertEqual(scheduler.pending(), [2])
+        self.assertEqual(scheduler.stats()['gave_up'], 1)
+
+        # a seed failing without retry again and again is dropped
+        self.assertFalse(scheduler.drop(1))
+        self.assertIsNone(scheduler.retry(1, permanent))
+        self.assertIsNone(scheduler.retry(1, permanent))
+        self.assertTrue(scheduler.drop(1))
+        self.assertFalse(scheduler.drop(1))
+        self.assertEqual(scheduler.stats()['dropped'], 1)
+
+    def test_stopped_scheduler_puts_back_no_seeds(self):
+        class FastPolicy(RetryPolicy):
+            backoff = {'transient': (0.2, 0.2, 1)}
+
+        seed_queue = mp.Queue()
+        scheduler = RetryScheduler(seed_queue, FastPolicy())
+        scheduler.retry(1, ConnectionError())
+        thread = scheduler.thread
+        scheduler.stop()
+
+        self.assertFalse(thread.is_alive())
+        time.sleep(0.3)
+        self.assertEqual(seed_queue.qsize(), 0)
+        self.assertEqual(scheduler.pending(), [1])  # saved with the latest seeds
+
+
+class InFlightSeedsTest(unittest.TestCase):
+
+    def test_duplicate_seeds_are_merged_or_redirected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = WalkerJournal(os.path.join(directory, "walker_journal.jsonl"),
+                                    sync_interval=None)
+            journal.checkpoint([(1, False)])
+            seed_queue = mp.Queue()
+            seed_queue.put(1)
+
+            def record(event, seed, target=None):
+                journal.record(event, seed, target)
+
+            merging = InFlightSeeds(seed_queue, record=record, redirect=False)
+            self.assertEqual(merging.put(1), None)  # queued already
+            self.assertEqual(seed_queue.qsize(), 1)
+
+            journal.record("acquired", seed_queue.get(), walker="a")
+            self.assertEqual(merging.claim(1), 1)
+            self.assertEqual(merging.put(1), None)  # worked on
+            self.assertEqual(merging.claim(1), None)  # e.g. queued before the registry
+
+            redirecting = InFlightSeeds(seed_queue, seed_pool=SeedPool([1, 2]), record=record)
+            self.assertEqual(redirecting.claim(1), 1)
+            self.assertEqual(redirecting.put(1), 2)
+            self.assertEqual(list(seed_queue.queue), [2])
+
+            redirecting.release(1)
+            self.assertEqual(redirecting.working(), {})
+            self.assertEqual(redirecting.put(1), 1)
+
+            self.assertEqual(merging.stats(), {'claimed': 1, 'duplicates_enqueued': 2,
+                                               'duplicates_dequeued': 1, 'merged': 3,
+                                               'redirected': 0})
+            self.assertEqual(redirecting.stats()['redirected'], 1)
+
+            # the step on 1 is still running and the redirected walk is queued
+            self.assertEqual(journal.replay(), [Walk(1, "acquired", None, False),
+                                                Walk(2, "queued", None, False)])
+            journal.close()
+
+    def test_seed_of_failed_step_is_walked_again_next_round(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # an offline coordinator
+            coordinator = Coordinator.__new__(Coordinator)
+            coordinator.seed_queue = mp.Queue()
+            coordinator.seed_queue.put(9)
+            coordinator.in_flight = InFlightSeeds(coordinator.seed_queue, redirect=False)
+            coordinator.step_memo = StepMemo()
+            coordinator.step_memo.put(9, "friends", [10])
+            coordinator.screener = None
+            coordinator.token_queue = TokenQueue()
+            coordinator.token_queue.put(('a', 'a', {}, {}))
+            coordinator.reset_wheel = ResetWheel()
+            coordinator.latest_seeds_file = os.path.join(directory, "latest_seeds.csv")
+            coordinator.token_state = None
+
+            processes = coordinator.start_collectors(number_of_seeds=1, fail=True)
+            for p in processes:
+                p.join(timeout=5)
+            self.assertIsInstance(processes[0].err, TestException)
+
+            self.assertEqual(coordinator.in_flight.working(), {})
+            self.assertIsNone(coordinator.step_memo.lookup(9, "friends"))
+            self.assertEqual(coordinator.token_queue.qsize(), 1)
+
+            # not merged as a duplicate of the failed step
+            self.assertEqual(coordinator.in_flight.claim(9), 9)
+
+
+class WalkerJournalTest(unittest.TestCase):
+
+    def test_restart_without_journal_restarts_latest_seeds(self):
+        with tempfile.TemporaryDirectory() as directory:
+            latest_seeds_file = os.path.join(directory, "latest_seeds.csv")
+            pd.DataFrame([1, 2]).to_csv(latest_seeds_file, index=False, header=False)
+            journal = WalkerJournal(os.path.join(directory, "walker_journal.jsonl"),
+                                    sync_interval=None)
+
+            walks, resumed = restart_walks(journal, latest_seeds_file)
+            self.assertFalse(resumed)
+            self.assertEqual(walks, [Walk(1, "queued", None, True),
+                                     Walk(2, "queued", None, True)])
+
+            # an offline coordinator
+            coordinator = Coordinator.__new__(Coordinator)
+            coordinator.journal = journal
+            coordinator.seed_queue = mp.Queue()
+            coordinator.restart_seeds = set()
+            coordinator.start_journal(walks)
+            self.assertEqual(coordinator.restart_seeds, {1, 2})
+
+            # the restart flags survive a crash right after starting
+            walks, resumed = restart_walks(journal, latest_seeds_file)
+            self.assertTrue(resumed)
+            self.assertEqual(walks, [Walk(1, "queued", None, True),
+                                     Walk(2, "queued", None, True)])
+            journal.close()
+
+    def test_replay_resumes_walks_at_their_stage(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "walker_journal.jsonl")
+            journal = WalkerJournal(path, sync_interval=None)
+            journal.checkpoint([(1, False), (2, False), (3, False), (4, False), (5, True)])
+
+            # completed step
+            journal.record("acquired", 1, walker="a")
+            journal.record("friends_stored", 1, walker="a")
+            journal.record("details_stored", 1, walker="a")
+            journal.record("result_written", 1, 10, walker="a")
+            journal.record("edge_claimed", 1, 10, walker="a")
+            journal.record("completed", 1, 10, walker="a")
+            # interrupted after writing the result
+            journal.record("acquired", 2, walker="b")
+            journal.record("details_stored", 2, walker="b")
+            journal.record("result_written", 2, 20, walker="b")
+            # interrupted while storing friends
+            journal.record("acquired", 3, walker="c")
+            # failed step
+            journal.record("acquired", 4, walker="d")
+            journal.record("released", 4, walker="d", restart=True)
+            journal.close()
+
+            with open(path, "a") as f:
+                f.write('{"time": 1, "event": "acq')  # cut by a crash
+
+            self.assertEqual(journal.replay(), [Walk(2, "result_written", 20, False),
+                                                Walk(3, "acquired", None, False),
+                                                Walk(4, "queued", None, True),
+                                                Walk(5, "queued", None, True),
+                                                Walk(10, "queued", None, False)])
+
+            journal.checkpoint([(4, True)])
+            self.assertEqual(journal.replay(), [Walk(4, "queued", None, True)])
+
+    def test_journal_is_compacted_when_it_grows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "walker_journal.jsonl")
+            journal = WalkerJournal(path, sync_interval=0, compact_size=2000)
+            journal.checkpoint([(1, False), (2, True)])
+            journal.record("acquired", 2, walker="b")
+            journal.record("result_written", 2, 20, walker="b")
+
+            seed = 1
+            for i in range(100):
+                journal.record("acquired", seed, walker="a")
+                journal.record("completed", seed, seed + 1, walker="a")
+                seed += 1
+
+            self.assertLess(os.path.getsize(path), 2000)
+            self.assertEqual(journal.replay(), [Walk(2, "result_written", 20, True),
+                                                Walk(101, "queued", None, False)])
+
+            # the interrupted step is still completed by its walker
+            journal.record("completed", 2, 20, walker="b")
+            journal.close()
+            self.assertEqual(journal.replay(), [Walk(101, "queued", None, False),
+                                                Walk(20, "queued", None, False)])
+
+
+class CrawlCoordinationTest(unittest.TestCase):
+
+    config_dict_sqlite = test_helpers.config_dict_sqlite
+    db_name = Config(config_dict=config_dict_sqlite).dbname
+
+    def tearDown(self):
+        if os.path.isfile(self.db_name + ".db"):
+            os.remove(self.db_name + ".db")
+
+    def test_nodes_share_tokens_and_walks_through_leases(self):
+        dbh = DataBaseHandler(config_dict=self.config_dict_sqlite)
+        tokens = pd.DataFrame({'token': ['a'], 'secret': ['x']})
+        node_a = CrawlCoordination(dbh, node="a", lease_time=0.5, heartbeat_interval=60)
+        node_b = CrawlCoordination(dbh, node="b", lease_time=0.5, heartbeat_interval=60)
+        node_a.join(seeds=[1, 2], tokens=tokens)
+        node_b.join(seeds=[3], tokens=tokens)
+
+        self.assertEqual(node_b.seeds(), [1, 2])
+        self.assertEqual([node for node, _ in node_a.nodes()], ["a", "b"])
+
+        # a token is used by one node at a time and comes back with its rate limit state
+        token = node_a.token_queue.get()
+        with self.assertRaises(queue.Empty):
+            node_b.token_queue.get(block=False)
+        start = time.time()
+        with self.assertRaises(queue.Empty):
+            node_b.token_queue.get(timeout=0.3)
+        self.assertLess(time.time() - start, 1)
+        token[3]['/friends/ids'] = 0
+        node_a.token_queue.put(token)
+        self.assertEqual(node_b.token_queue.get(timeout=1)[3], {'/friends/ids': 0})
+
+        # walks move on to the put seed
+        self.assertEqual(node_a.seed_queue.get(), 1)
+        self.assertEqual(node_b.seed_queue.get(), 2)
+        node_a.seed_queue.put(10)
+        self.assertEqual(sorted(node_a.seeds()), [2, 10])
+
+        # leases of a node without heartbeat expire and are taken over
+        time.sleep(0.6)
+        self.assertEqual(node_a.seed_queue.get(block=False), 10)
+        self.assertEqual(node_a.seed_queue.get(block=False), 2)
+        node_b.seed_queue.put(20)
+        self.assertEqual(sorted(node_a.seeds()), [2, 10])
+
+        node_a.leave()
+        node_b.leave()
+        self.assertEqual(node_a.nodes(), [])
+        self.assertEqual(node_b.seed_queue.qsize(), 2)
+        dbh.engine.close()
+
+
+class TokenBrokerTest(unittest.TestCase):
+
+    def test_tokens_and_their_rate_limits_are_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            token_file = os.path.join(directory, "tokens.csv")
+            tokens = pd.DataFrame({'token': ['a', 'b'], 'secret': ['x', 'y']})
+            tokens.to_csv(token_file, index=False)
+            broker = TokenBroker.serve(token_file_name=token_file,
+                                       address=os.path.join(directory, "tokens.sock"))
+            try:
+                worker_queue = TokenBroker.connect_to(broker.address, broker.authkey)
+                other_worker_queue = TokenBroker.connect_to(broker.address, broker.authkey)
+
+                token, secret, reset_time_dict, calls_dict = worker_queue.get()
+                self.assertEqual(other_worker_queue.qsize(), 1)
+
+                calls_dict['/friends/ids'] = 0
+                worker_queue.put((token, secret, reset_time_dict, calls_dict))
+
+                other_worker_queue.get()
+                self.assertEqual(other_worker_queue.get()[3], {'/friends/ids': 0})
+            finally:
+                broker.shutdown()
+
+    def test_reset_wheel_is_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            token_file = os.path.join(directory, "tokens.csv")
+            pd.DataFrame({'token': ['a'], 'secret': ['x']}).to_csv(token_file, index=False)
+            broker = TokenBroker.serve(token_file_name=token_file,
+                                       address=os.path.join(directory, "tokens.sock"))
+            try:
+                wheel = TokenBroker.connect_to_reset_wheel(broker.address, broker.authkey)
+                other_wheel = TokenBroker.connect_to_reset_wheel(broker.address, broker.authkey)
+
+                wheel.throttled('a', '/friends/ids', time.time() + 0.2)
+                self.assertEqual(other_wheel.wait('/friends/ids'), 'a')
+            finally:
+                broker.shutdown()
+
+
+class KeywordMatcherTest(unittest.TestCase):
+
+    def test_matches_like_separate_case_insensitive_searches(self):
+        self.assertEqual(helpers.trie_pattern(["abc", "abd", "ab", "x y"]),
+                         r"(?:ab(?:c|d)?|x\ y)")
+
+        texts = pd.Series(["Die AfD im Bundestag", "#BTW21 jetzt wählen", "GRUENE Politik",
+                           "Wahlkampf in Berlin", None])
+        keyword_lists = [["afd"], ["#btw"], ["gr(ü|ue)ne"], ["berlin$"], ["^wahl"], ["spd", "cdu"],
+                         ["Wahlkampf in", "ab", "a"], ["csu", "kampf\\b"]]
+
+        for keywords in keyword_lists:
+            for i in range(len(texts)):
+                expected = any(texts[i:i + 1].str.contains(keyword, case=False).any()
+                               for keyword in keywords)
+                self.assertEqual(helpers.KeywordMatcher(keywords).search(texts[i:i + 1]),
+                                 expected, msg=f"{keywords} in {texts[i]}")
+
+
 class GeneralTests(unittest.TestCase):
 
     def test_can_get_account_tweets(self):
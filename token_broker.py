@@ -0,0 +1,113 @@
+import os
+import queue
+import tempfile
+from multiprocessing.managers import BaseManager
+
+from setup import FileImport
+
+
+class TokenQueue(queue.Queue):
+    """Token queue from which a particular token can be taken, e.g. the one whose rate limit
+    window a collector.ResetWheel reported to have reset."""
+
+    def take(self, token):
+        """Takes the entry of `token` out of the queue without blocking.
+
+        Returns:
+            the entry (tuple of token, secret, reset times and remaining calls), or None if
+            the token is not in the queue
+        """
+        with self.mutex:
+            for entry in self.queue:
+                if entry[0] == token:
+                    self.queue.remove(entry)
+                    self.not_full.notify()
+                    return entry
+        return None
+
+
+# live in the broker process only
+_token_queue = TokenQueue()
+_reset_wheel = None
+
+
+def _get_token_queue():
+    return _token_queue
+
+
+def _get_reset_wheel():
+    global _reset_wheel
+    if _reset_wheel is None:
+        from collector import ResetWheel  # collector imports this module
+        _reset_wheel = ResetWheel()
+    return _reset_wheel
+
+
+class TokenBroker(BaseManager):
+    """Serves one token queue to the walkers of several processes over a Unix socket.
+
+    A token is handed out together with its per-endpoint reset times and remaining calls and
+    comes back with them updated, so that all processes share one view of the rate limits.
+    The proxy returned by `get_token_queue` can be used like the token queue of a Coordinator.
+    The broker also serves one collector.ResetWheel, so that the connections of all processes
+    wait for rate limit resets together.
+
+    Example (in the process starting the broker):
+        broker = TokenBroker.serve()
+        token_queue = broker.get_token_queue()
+    and (in the worker processes):
+        token_queue = TokenBroker.connect_to(broker.address, broker.authkey)
+        reset_wheel = TokenBroker.connect_to_reset_wheel(broker.address, broker.authkey)
+
+    Attributes:
+        address (str): path of the Unix socket
+    """
+
+    @classmethod
+    def serve(cls, token_file_name="tokens.csv", address=None):
+        """Starts a broker process with the tokens of `token_file_name` in its queue.
+
+        Args:
+            token_file_name (str): Path to file with user tokens
+            address (str): path of the Unix socket, defaults to a new file in the temp directory
+        Returns:
+            TokenBroker (started)
+        """
+
+        if address is None:
+            address = os.path.join(tempfile.mkdtemp(prefix="radices_"), "tokens.sock")
+
+        broker = cls(address=address, authkey=os.urandom(32))
+        broker.start()
+
+        token_queue = broker.get_token_queue()
+        for token, secret in FileImport().read_token_file(token_file_name).values:
+            token_queue.put((token, secret, {}, {}))
+
+        return broker
+
+    @property
+    def authkey(self):
+        return bytes(self._authkey)
+
+    @classmethod
+    def connect_to(cls, address, authkey):
+        """Connects to a running broker and returns a proxy of its token queue."""
+
+        broker = cls(address=address, authkey=authkey)
+        broker.connect()
+
+        return broker.get_token_queue()
+
+    @classmethod
+    def connect_to_reset_wheel(cls, address, authkey):
+        """Connects to a running broker and returns a proxy of its collector.ResetWheel."""
+
+        broker = cls(address=address, authkey=authkey)
+        broker.connect()
+
+        return broker.get_reset_wheel()
+
+
+TokenBroker.register('get_token_queue', callable=_get_token_queue)
+TokenBroker.register('get_reset_wheel', callable=_get_reset_wheel)
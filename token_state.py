@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class TokenStateStore(object):
+    """Keeps the rate limit state of tokens (reset times and remaining calls per endpoint) in
+    a small JSON file, so that a restarted crawler knows at once which tokens are throttled
+    instead of probing every token again.
+
+    Tokens are stored by their SHA-256 hash, so that the file does not contain credentials.
+    The state of an endpoint whose rate limit window has reset since it was saved is dropped
+    when loading.
+
+    Example:
+        store = TokenStateStore()
+        reset_time_dict, calls_dict = store.restore(token)
+        token_queue.put((token, secret, reset_time_dict, calls_dict))
+        ...
+        store.save()  # saves the (meanwhile updated) dicts of all restored tokens
+
+    Attributes:
+        path (str): JSON file
+    """
+
+    def __init__(self, path="token_state.json"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.tokens = {}  # token -> (reset_time_dict, calls_dict)
+        self.saved = self.load()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def load(self):
+        """Reads the saved state of the windows that did not reset yet.
+
+        Returns:
+            dict of token hash -> (reset_time_dict, calls_dict)
+        """
+
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):  # no state saved yet or file cut by a crash
+            return {}
+
+        now = time.time()
+        states = {}
+        for key, entry in entries.items():
+            reset_time_dict, calls_dict = {}, {}
+            for endpoint, reset_at in entry['reset'].items():
+                if reset_at > now and endpoint in entry['calls']:
+                    reset_time_dict[endpoint] = reset_at
+                    calls_dict[endpoint] = entry['calls'][endpoint]
+            states[key] = (reset_time_dict, calls_dict)
+
+        return states
+
+    def restore(self, token):
+        """Returns the saved state of `token` as the dicts to put into the token queue with it.
+        The dicts are saved with `save` later, including the changes made to them meanwhile.
+
+        Returns:
+            tuple of reset_time_dict (dict) and calls_dict (dict)
+        """
+
+        reset_time_dict, calls_dict = self.saved.get(self.key(token), ({}, {}))
+        with self.lock:
+            self.tokens[token] = (reset_time_dict, calls_dict)
+        return reset_time_dict, calls_dict
+
+    def save(self):
+        """Writes the state of all restored tokens to `path` (atomically)."""
+
+        with self.lock:
+            entries = {self.key(token): {'saved': time.time(),
+                                         'reset': dict(reset_time_dict),
+                                         'calls': dict(calls_dict)}
+                       for token, (reset_time_dict, calls_dict) in self.tokens.items()}
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)